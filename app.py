@@ -1,621 +1,297 @@
-from doctest import master
-import os
-from venv import create
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-import requests
-from requests.auth import HTTPBasicAuth
 from configparser import ConfigParser
-# Initializes your app with your bot token and socket mode handler
-
-configur = ConfigParser()
-configur.read('config.ini')
-master_data = {}
+import threading
+from slack_bolt import App
+from slack_sdk import WebClient
+from catalog import LiveCatalog
+from catalog_store import open_store
+from helpdesk_views import (
+    admin_update, admin_view, apply_category_submission, apply_department_submission,
+    category_suggestions, department_added_view, help_desk_update, help_desk_view,
+    message_view, ticket_data, ticket_details, ticket_done_text, ticket_invalid_errors, ticket_key, ticket_submitted_view,
+)
+from modal_state import ADMIN, HELP_DESK, ModalSessions
+from user_cache import UserCache
+from instrumentation import InstrumentedExecutor, instrument, serve_from_config
+from traffic_capture import capture
+from event_dedup import dedupe
+from rate_limiter import limit
+from lazy import built, lazy
+from ticket_routing import Routes
+from jira_schema import MissingFields
 
-app = App(token=configur.get("config","SLACK_BOT_TOKEN"))
-JIRA_TOKEN = configur.get("jira","JIRA_TOKEN")
-JIRA_URL = configur.get("jira","JIRA_URL")
-JIRA_USERNAME = configur.get("jira","JIRA_USERNAME")
 
-def create_field(text, value):
-    '''
-    Creates the options in the required format
+class HelpDesk:
     '''
-    data = {
-        "text": {
-            "type": "plain_text",
-            "text": text,
-        },
-        "value": value
-    }
-    return data
-
-def create_initial_options(body,block_name,block_action):
-    return create_field(
-        body['view']['state']['values'][block_name][block_action]['selected_option']['text']['text'],
-        body['view']['state']['values'][block_name][block_action]['selected_option']['value']
-    )
-
-def create_options(vals_list):
+    The help desk Bolt app and what its listeners share. Building it makes no network call
+    and reads no catalog, each part is built on first use: the catalog with the first modal,
+    the Jira client and ticket pipeline with the first submission (or start()).
+    The bot token is checked with `auth.test` on the first request, or right away
+    when `[config] VERIFY_TOKEN_ON_START` is set
     '''
-    Creates the options in the required format 
-    Accepts List of tuple including name,value
-    '''
-    options = []
-    for val in vals_list:
-        options.append(
-            {
-                "text": {
-                    "type": "plain_text",
-                    "text": f"{val[0]}",
-                },
-                "value": val[1]
-            }
+    def __init__(self, configur, token_verification = None):
+        self.configur = configur
+        if token_verification is None:
+            token_verification = configur.getboolean("config", "VERIFY_TOKEN_ON_START", fallback = False)
+        # The signing secret is only checked in HTTP mode (service.py), Socket Mode ignores it.
+        # SLACK_API_URL is optional, benchmarks/load_test.py points it at a local mock
+        self.app = App(
+            client=WebClient(
+                token=configur.get("config","SLACK_BOT_TOKEN"),
+                base_url=configur.get("config","SLACK_API_URL", fallback=WebClient.BASE_URL)
+            ),
+            signing_secret=configur.get("config","SLACK_SIGNING_SECRET", fallback=None),
+            token_verification_enabled=token_verification,
+            listener_executor=InstrumentedExecutor()
         )
-    return options
+        # Ack latency, listener and Slack API timings per handler, see instrumentation.py
+        instrument(self.app)
+        # Slack tier limits per token and method, see rate_limiter.py. After instrument(), so slack_api_seconds leaves out the wait
+        limit(self.app, configur)
+        # Inbound requests to a JSONL log for benchmarks/replay.py, when [capture] PATH is set
+        capture(self.app, "helpdesk", configur)
+        # Slack retries and duplicate deliveries are acked and dropped before any listener, see event_dedup.py
+        dedupe(self.app, "helpdesk", configur)
+        register_listeners(self.app, self)
 
-def generate_master_dict():
-    '''
-    Generates the departments list with their categories for use as options from file `departments.txt`
-    '''
-    global master_data
-    master_data = {}
-    with open('departments.txt','r') as fp:
-        departments = fp.read().splitlines()
-    for dept_name in departments:
-        master_data[dept_name] = {
-            'name': create_field(dept_name, f'dept_{dept_name}'),
-            'categories': []
-        }
-        with open(f'{dept_name}_categories.txt','r') as fp:
-            categories = fp.read().splitlines()
-        for category in categories:
-            master_data[dept_name]['categories'].append(create_field(category, f'{dept_name}_category_{category}'))
-    print('Master Data\n',master_data)
-    print('*'*150)
-
-generate_master_dict()
-
-# blocks with action_id calls `@app.action` decorator with the defined name
-# eg. "action_id": 'demo_action' will execute @app.action('demo_action')
-def create_block(text1, options = None, action = None, initial_option = None, text2 = None, type1 = None, block_id = None, type2 = 'section'):
-    '''
-    To generate block, 
-    type ->
-        For Dropdown send `static_select`
-        For Radio send `radio_buttons`
-    `initial_option` -> set the default option. -> {
-        'value': 'value1',
-        'text': 'dummy_text'
-    }
-    Options -> The options you want to display
-    action -> the function to call on user interaction with this block
-    '''
-    # Block Pre Meta
-    if type2 == 'section':
-        elem_or_acc = 'accessory'
-        text_or_labl = 'text'
-    else:
-        elem_or_acc = 'element'
-        text_or_labl = 'label'
-    data={
-        'type': type2,
-        text_or_labl: {
-            'type': "plain_text",
-            'text': text1
-        }
-    }
-    if type1:
-        data[elem_or_acc] =  {
-            'type': type1,
-            'options': options,
-            'action_id': action,
-        }
-    if initial_option:
-        data[elem_or_acc]['initial_option'] = {
-            "value": initial_option['value'],
-            "text": {
-                "type": "plain_text",
-                "text": initial_option['text']
-            }
-        }
-    if type1 == 'static_select':
-        data[elem_or_acc]['placeholder'] = {
-            "type": "plain_text",
-            "text": text2,
-        }
-    if block_id:
-        data['block_id'] = block_id
-    return data
-
-def departments_list():
-    global master_data
-    data = []
-    for val in master_data.values():
-        data.append(val['name'])
-    return data
-
-@app.shortcut("admin_caxe")
-def open_modal(ack, body, shortcut, client):
-    ack()
-    x = app.client.users_info(
-        token = configur.get("config","SLACK_BOT_TOKEN"),
-        user = body['user']['id']
-    )
-    # Check if Admin
-    if x['user']['is_owner'] or True:
-        client.views_open(
-            trigger_id=shortcut["trigger_id"],
-            # A simple view payload for a modal
-            view={
-                "type": "modal",
-                "callback_id": "add_dept_view",
-                "title": {"type": "plain_text", "text": "Stealth Mode"},
-                "close": {"type": "plain_text", "text": "Close"},
-                # https://app.slack.com/block-kit-builder
-                "blocks": [
-                    create_block(
-                        '"Hi, Here you can add new departments for Help Desk or Update any existing ones."',
-                        block_id = "description_block"
-                    ),
-                    {
-                        "type": "divider",
-                        "block_id": "divider_block"
-                    },
-                    create_block( 
-                        "Select",
-                        block_id = "add_update_radio_block",
-                        options = create_options(
-                            [
-                                ("Update Existing Department","value-0"),
-                                ("Add New Department","value-1")
-                            ]
-                        ),
-                        action = "add_update_radio_buttons_action",
-                        type1 = 'radio_buttons'
-                    )
-                ]
-            }
-        )
-    else:
-        client.views_open(
-        trigger_id=shortcut["trigger_id"],
-        # A simple view payload for a modal
-        view={
-            "type": "modal",
-            "callback_id": "add_dept_view",
-            "title": {"type": "plain_text", "text": "Stealth Mode"},
-            "close": {"type": "plain_text", "text": "Close"},
-            "blocks": [
-                create_block('Only Admins are allowed to use this feature!!!')
-            ]
-        }
-        )
+    @lazy
+    def jira(self):
+        # Shared keep-alive connection pool to Jira, used from every listener thread.
+        # Imported here, requests is only loaded once a ticket is sent
+        from jira_client import JiraClient
+        return JiraClient.from_config(self.configur)
 
+    @lazy
+    def routes(self):
+        # Jira project, issue type and priority per department and category, see ticket_routing.py
+        return Routes.from_config(self.configur)
 
+    @lazy
+    def catalogs(self):
+        # Current department/category snapshot, admin edits publish a new one atomically
+        catalogs = LiveCatalog.from_config(open_store(self.configur), self.configur)
+        print(f'Catalog v{catalogs.current.version} loaded with {len(catalogs.current)} departments')
+        return catalogs
 
-@app.action("add_update_radio_buttons_action")
-def update_modal(ack, body, client):
-    ack()
-    print('radio_button_selected_successfully')
-    prev_blocks = body['view']['blocks'] # 0 > description, 1 > divider, 2 > radio, 3 > dropdown
-    prev_blocks[2]['accessory']['initial_option'] = create_initial_options(body, 'add_update_radio_block', 'add_update_radio_buttons_action')
-    choice = body['actions'][0]['selected_option']['value']
-    if choice == 'value-0':
-        if len(prev_blocks) > 3:
-            prev_blocks.pop()
-
-        prev_blocks.append(create_block(
-                        "Select the Relevant Department",
-                        text2 = "Select an item",
-                        block_id = 'dept_list_drop_down_block',
-                        type1 = 'static_select',
-                        action = 'admin_dept_drop_down_action',
-                        options = departments_list(),
-                    ))
-
-        client.views_update(
-            # Pass the view_id
-            view_id=body["view"]["id"],
-                # String that represents view state to protect against race conditions
-                hash=body["view"]["hash"],
-                # View payload with updated blocks
-                view={
-                    "type": "modal",
-                    # View identifier
-                    "callback_id": "dept_category_selection2",
-                    "title": {"type": "plain_text", "text": "Stealth Mode"},
-                    # "submit": {"type":"plain_text", "text":"susmit"},
-                    "blocks": prev_blocks
-                    }
-            )
-            
-        
-    
-    #Adding new departments from Admin Shortcuts
-
-    elif choice == 'value-1':
-        print("first time add...", len(prev_blocks))
-        if len(prev_blocks) > 3:
-            prev_blocks.pop()
-        prev_blocks.append(
-        
-            {
-                "type": "input",
-                "block_id": "enter_dept_text_block",
-                "element": {
-                    "type": "plain_text_input",
-                    "multiline": True,
-                    "action_id": "plain_text_input_action"
-                },
-                "label": {
-                    "type": "plain_text",
-                    "text": "Enter departments, separated by commas",
-                    "emoji": True
-                }
-            }
-        )
+    @lazy
+    def users(self):
+        # users.info answers, shared by every shortcut invocation
+        return UserCache.from_config(self.configur)
 
-        client.views_update(
-            view_id = body["view"]["id"],
-            view = {
-                "type": "modal",
-                "title": {"type": "plain_text", "text": "Stealth Mode"},
-                "callback_id" : "update_files_department",
-                "close": {"type": "plain_text", "text": "Close"},
-                "submit": {"type": "plain_text", "text": "Submit"},
-                
-                "blocks": prev_blocks
-               } )
-        
-
-
-#Function to update departments.txt file 
-@app.view("update_files_department")
-def handle_view_events(client, ack, body):
-    ack()
-
-    #extracting input values from textbox
-    new_dept = body['view']['state']['values']['enter_dept_text_block']['plain_text_input_action']['value']
-    new_dept = new_dept.split(',')
-    with open(f'departments.txt','a') as fp:
-        for cat in new_dept:
-            if len(cat) > 0:
-                fp.write(cat+'\n')
-
-                #creating categories.txt file for the new department
-                f = open(f'{cat}_categories.txt', "x")
-        generate_master_dict()
-    print("Success!")
-
-    #sending a success message to user
-    client.views_open(
-        trigger_id = body["trigger_id"],
-        view =  {
-            "type": "modal",
-            "title": {"type": "plain_text", "text": "Stealth Mode"},
-            "close": {"type": "plain_text", "text": "Close"},
-            "blocks": [
-                {
-			"type": "header",
-			"text": {
-				"type": "plain_text",
-				"text": "Department added successfully!",
-				"emoji": True
-			}
-		}
-            ]
-        }
-    )
-        
-
-@app.view("update_files")
-def handle_view_events(client,ack, body):
-    ack()
-    print('category_input_submitted_successfully')
-    if body['view']['state']['values']['add_delete_category_block']['add_delete_category_action']['selected_option']['value'] == 'del_cat':
-        dept = body['view']['state']['values']['dept_list_drop_down_block']['admin_dept_drop_down_action']['selected_option']['text']['text']
-        catg = body['view']['state']['values']['dept_category_list_drop_down_block']['dept_category_list_drop_down_action']['selected_option']['text']['text']
-        with open(f'{dept}_categories.txt','r') as fp:
-            catgs = fp.read().splitlines()
-            catgs.remove(catg)
-        with open(f'{dept}_categories.txt','w') as fp:
-            fp.write('\n'.join(catgs))
-            fp.write('\n')
-        message = 'Category deleted Successfully!!!'
-        generate_master_dict()
-    else:
-        catgs = body['view']['state']['values']['enter_category_text_block']['plain_text_input_action']['value']
-        catgs = catgs.split(',')
-        dept = body['view']['state']['values']['dept_list_drop_down_block']['admin_dept_drop_down_action']['selected_option']['text']['text']
-        with open(f'{dept}_categories.txt','a') as fp:
-            for cat in catgs:
-                if len(cat) > 0:
-                    fp.write(cat+'\n')
-        message = 'Category added Successfully!!!'
-        generate_master_dict()
-        print('Category added Successfully!')
-    client.views_open(
-        trigger_id=body["trigger_id"],
-        # A simple view payload for a modal
-        view={
-            "type": "modal",
-            "callback_id": "add_dept_view",
-            "title": {"type": "plain_text", "text": "Stealth Mode"},
-            "close": {"type": "plain_text", "text": "Close"},
-            "blocks": [
-                create_block(message)
-            ]
-        }
-    )
-
-@app.action("admin_dept_drop_down_action")
-def update_modal(ack, body, client):
-    ack()
-    print('admin_dept_drop_down_action_selected_successfully')
-    prev_blocks = body['view']['blocks'] # 0 > description, 1 > divider, 2 > radio, 3 > dropdown
-    if len(prev_blocks) > 4:
-        #meaning ---> dept is modified, so we will change the categories i.e. options
-        prev_blocks[3]['accessory']['initial_option'] = create_initial_options(body, 'dept_list_drop_down_block', 'admin_dept_drop_down_action')
-        prev_blocks[-1]['element']['options'] = master_data[prev_blocks[3]['accessory']['initial_option']['text']['text']]['categories']
-    
-    else:
-        #meaning ---> dept is selected for the first time
-        prev_blocks[2]['accessory']['initial_option'] = create_initial_options(body, 'add_update_radio_block', 'add_update_radio_buttons_action')
-        prev_blocks[3]['accessory']['initial_option'] = create_initial_options(body, 'dept_list_drop_down_block', 'admin_dept_drop_down_action')
-
-        prev_blocks.append(
-            create_block( 
-                "Select",
-                block_id = "add_delete_category_block",
-                options = create_options(
-                    [
-                        ("Add New Category","add_cat"),
-                        ("Delete a Category","del_cat")
-                    ]
-                ),
-                action = "add_delete_category_action",
-                type1 = 'radio_buttons'
-            )
-        )
-    client.views_update(
-            # Pass the view_id
-            view_id=body["view"]["id"],
-            # String that represents view state to protect against race conditions
-        hash=body["view"]["hash"],
-        # View payload with updated blocks
-        view={
-            "type": "modal",
-            # View identifier
-            "callback_id": "update_files",
-            "title": {"type": "plain_text", "text": "Stealth Mode"},
-            "close": {"type": "plain_text", "text": "Close"},
-            "submit": {"type": "plain_text", "text": "Submit"},
-            "blocks": prev_blocks
-        }
-    )
-
-@app.action("add_delete_category_action")
-def update_modal(ack, body, client):
-    ack()
-    print('add_delete_category_action_selected_successfully')
-    prev_blocks = body['view']['blocks'] # 0 > description, 1 > divider, 2 > radio, 3 > dropdown, 4 > radio 
-    prev_blocks[2]['accessory']['initial_option'] = create_initial_options(body, 'add_update_radio_block', 'add_update_radio_buttons_action')
-    prev_blocks[3]['accessory']['initial_option'] = create_initial_options(body, 'dept_list_drop_down_block', 'admin_dept_drop_down_action')
-    prev_blocks[4]['accessory']['initial_option'] = create_initial_options(body, 'add_delete_category_block', 'add_delete_category_action')
-    # check delete or add
-    if prev_blocks[4]['accessory']['initial_option']['value'] == 'del_cat':
-        #print(len(prev_blocks))    #--> 5
-        if len(prev_blocks) > 5:
-            prev_blocks.pop()
-        prev_blocks.append(
-                create_block(
-                    "Select the category you want to delete",
-                    text2 = "Category",
-                    type2 = 'input',
-                    block_id = 'dept_category_list_drop_down_block',
-                    type1 = 'static_select',
-                    action = 'dept_category_list_drop_down_action',
-                    options = master_data[prev_blocks[3]['accessory']['initial_option']['text']['text']]['categories'],
-                )
-            )
-       
-    else:
-        if len(prev_blocks) > 5:
-            prev_blocks.pop()
-        prev_blocks.append(
-            {
-                "type": "input",
-                "block_id": "enter_category_text_block",
-                "element": {
-                    "type": "plain_text_input",
-                    "multiline": True,
-                    "action_id": "plain_text_input_action"
-                },
-                "label": {
-                    "type": "plain_text",
-                    "text": "Enter Categories, separated by commas",
-                    "emoji": True
-                }
-            }
+    @lazy
+    def modals(self):
+        # Where each open modal is in its flow, keyed by view_id
+        return ModalSessions.from_config(self.configur)
+
+    @lazy
+    def pipeline(self):
+        # Tickets are written to a local outbox and created in the background, so a slow or
+        # unavailable Jira never blocks the listener threads nor loses a submission.
+        # Reports of an issue already raised are added to its ticket, see ticket_dedup.py
+        from ticket_outbox import open_pipeline
+        from ticket_dedup import open_duplicates
+        return open_pipeline(self.configur, self.jira, self.notify_ticket_done,
+                             duplicates = open_duplicates(self.configur, text = ticket_details))
+
+    def notify_ticket_done(self, job, issue, error):
+        '''
+        Called by the ticket workers once Jira answers, DMs the reference id to the user who raised it.
+        With bulk batching `job` still identifies the submitter of this particular issue
+        '''
+        if error:
+            print(error)
+        self.app.client.chat_postMessage(
+            text = ticket_done_text(issue, error),
+            channel = job.user_id
         )
-    client.views_update(
-        # Pass the view_id
-        view_id=body["view"]["id"],
-        # String that represents view state to protect against race conditions
-        hash=body["view"]["hash"],
-        # View payload with updated blocks
-        view={
-            "type": "modal",
-            # View identifier
-            "callback_id": "update_files",
-            "title": {"type": "plain_text", "text": "Stealth Mode"},
-            "close": {"type": "plain_text", "text": "Close"},
-            "submit": {"type": "plain_text", "text": "Submit"},
-            "blocks": prev_blocks
-        }
-    )
-
-# First Page
-@app.shortcut("caxe_app_shortcut")
-def open_modal(ack, shortcut, client, body, context):
-    # Acknowledge the shortcut request
-    ack()
-    # Call the views_open method using the built-in WebClient https://api.slack.com/reference/surfaces/views
-    client.views_open(
-        trigger_id=shortcut["trigger_id"],
-        # A simple view payload for a modal
-        view={
-            "type": "modal",
-            "callback_id": "dept_selection_view",
-            "title": {"type": "plain_text", "text": "Stealth Mode"},
-            "close": {"type": "plain_text", "text": "Close"},
-            # "submit": {"type": "plain_text", "text": "Submit"},
-            # https://app.slack.com/block-kit-builder
-            "blocks": [
-                create_block(
-                    'Your Personal Help Desk',
-                    block_id = "help_desk_description_block"
-                ),
-                {
-                    "type": "divider",
-                    "block_id": "divider_block"
-                },
-                create_block(
-                    "Select the Relevant Department",
-                    text2 = "Select an item",
-                    block_id = 'help_desk_dept_list_drop_down_block',
-                    type1 = 'static_select',
-                    action = 'help_desk_dept_drop_down_action',
-                    options = departments_list(),
-                ),
-            ]
-        }
-    )
-# Second Page
-@app.action("help_desk_dept_drop_down_action")
-def update_modal(ack, body, client):
-    ack()
-    prev_blocks = body['view']['blocks'] # 0 > description, 1 > divider, 2 > radio, 3 > dropdown, 4 > radio 
-    prev_blocks[2]['accessory']['initial_option'] = create_initial_options(body, 'help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action')
-    prev_blocks.append(
-        create_block(
-            "Select the issue category",
-            text2 = "Category",
-            block_id = 'help_desk_dept_category_list_drop_down_block',
-            type1 = 'static_select',
-            action = 'help_desk_dept_category_list_drop_down_action',
-            options = master_data[prev_blocks[2]['accessory']['initial_option']['text']['text']]['categories'],
+
+    def start(self):
+        '''
+        Fetches the createmeta of every routed project, then starts the ticket workers, which
+        deliver what the outbox held before a restart. Raises MissingFields when a create screen
+        lacks a field the pipeline sets on every issue
+        '''
+        self.load_meta()
+        self.pipeline.start()
+
+    def load_meta(self):
+        '''
+        Caches the createmeta of every project tickets are routed to, so even the first ticket
+        Jira would refuse is refused in the modal. Jira being unreachable only delays that
+        '''
+        require = [(project, issuetype, field) for project, issuetype in self.routes.targets()
+                   for field in self.pipeline.required_fields]
+        try:
+            self.jira.load_meta(self.routes.projects(), require = require)
+        except MissingFields:
+            raise
+        except Exception as err:
+            print(f'Jira createmeta unavailable: {err}')
+
+    def after_fork(self):
+        '''
+        Called in every pre-fork server worker (service.py), resets what was built in the parent
+        '''
+        if built(self, 'catalogs'):
+            self.catalogs.after_fork()
+        if built(self, 'jira'):
+            self.jira.after_fork()
+        if built(self, 'pipeline'):
+            self.pipeline.after_fork()
+
+
+def register_listeners(app, desk):
+    @app.event("user_change")
+    def handle_user_change_events(event):
+        desk.users.update(event["user"])
+
+    # The views themselves are built in helpdesk_views.py, shared with async_app.py
+    # blocks with action_id calls `@app.action` decorator with the defined name
+    # eg. "action_id": 'demo_action' will execute @app.action('demo_action')
+
+    @app.shortcut("admin_caxe")
+    def open_modal(ack, body, shortcut, client):
+        ack()
+        x = desk.users.info(app.client, body['user']['id'])
+        # Check if Admin
+        opened = client.views_open(
+            trigger_id=shortcut["trigger_id"],
+            view=admin_view(x['is_owner'] or True)
         )
-    )
-    client.views_update(
-        # Pass the view_id
-        view_id=body["view"]["id"],
-        # String that represents view state to protect against race conditions
-        hash=body["view"]["hash"],
-        # View payload with updated blocks
-        view={
-            "type": "modal",
-            # View identifier
-            "callback_id": "dept_category_selection",
-            "title": {"type": "plain_text", "text": "Stealth Mode"},
-            "blocks": prev_blocks
-        }
-    )
-
-# Third Page
-@app.action("help_desk_dept_category_list_drop_down_action")
-def update_modal(ack, body, client):
-    ack()
-    prev_blocks = body['view']['blocks'] # 0 > description, 1 > divider, 2 > radio, 3 > dropdown, 4 > radio 
-    prev_blocks[2]['accessory']['initial_option'] = create_initial_options(body, 'help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action')
-    prev_blocks[3]['accessory']['initial_option'] = create_initial_options(body, 'help_desk_dept_category_list_drop_down_block', 'help_desk_dept_category_list_drop_down_action')
-    prev_blocks.append(
-        {
-            "type": "input",
-            "block_id": "issue_description",
-            "element": {
-                "type": "plain_text_input",
-                "multiline": True,
-                "action_id": "plain_text_input_action"
-            },
-            "label": {
-                "type": "plain_text",
-                "text": "Describe your Issue",
-                "emoji": True
-            }
-        }
-    )
-    client.views_update(
-        # Pass the view_id
-        view_id=body["view"]["id"],
-        # String that represents view state to protect against race conditions
-        hash=body["view"]["hash"],
-        # View payload with updated blocks
-        view={
-            "type": "modal",
-            # View identifier
-            "callback_id": "create_ticket",
-            "title": {"type": "plain_text", "text": "Stealth Mode"},
-            "close": {"type": "plain_text", "text": "Close"},
-            "submit": {"type": "plain_text", "text": "Submit"},
-            "blocks": prev_blocks
-        }
-    )
-
-@app.view("create_ticket")
-def action_button_click(body, ack, say, client):
-    # Acknowledge the action
-    ack()
-    # hopes_and_dreams = view["state"]["values"]["input_c"]["dreamy_input"]
-    print('Creating Ticket')
-    # https://developer.atlassian.com/server/jira/platform/jira-rest-api-examples/
-    ticket_data = {
-        "fields": {
-            "project": {
-                "key": "TEST" # Same as existing JIRA Project
-            },
-            "summary": f"{body['view']['state']['values']['help_desk_dept_list_drop_down_block']['help_desk_dept_drop_down_action']['selected_option']['text']['text']}",
-            "description": f"Issue created by: <@{body['user']['id']}>\nhttps://{body['team']['domain']}.slack.com/team/{body['user']['id']}\nDetails:\n{ body['view']['state']['values']['issue_description']['plain_text_input_action']['value'] }",
-            "issuetype": {
-                "name": "Task"
-            }
-        }
-    }
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    try:
-        resp = requests.post(
-            url= JIRA_URL, 
-            json = ticket_data,
-            headers = headers,
-            auth = HTTPBasicAuth(JIRA_USERNAME, JIRA_TOKEN)
-            )
-    except Exception as e:
-        print(e)
-        message = "Failed to Create Ticket!!! PLease try again or Contact I.T"
-    else:
-        message = "Ticket Created Successfully!"
-        say(
-            text = f"Ticket Created Successfully with reference id {resp.json()['key'] + ': ' + resp.json()['id']}!",
-            channel = body['user']['id']    
+        desk.modals.start(opened["view"]["id"], ADMIN)
+
+    @app.action("add_update_radio_buttons_action")
+    def update_modal(ack, body, client):
+        ack()
+        print('radio_button_selected_successfully')
+        client.views_update(**admin_update(body, desk.modals, desk.catalogs.current))
+
+    #Function to update departments.txt file
+    @app.view("update_files_department")
+    def handle_view_events(client, ack, body):
+        ack()
+        desk.modals.close(body["view"]["id"])
+        apply_department_submission(body, desk.catalogs)
+        print("Success!")
+        #sending a success message to user
+        client.views_open(
+            trigger_id = body["trigger_id"],
+            view = department_added_view()
         )
-    finally:
+
+    @app.view("update_files")
+    def handle_view_events(client,ack, body):
+        ack()
+        desk.modals.close(body["view"]["id"])
+        print('category_input_submitted_successfully')
+        message = apply_category_submission(body, desk.catalogs)
         client.views_open(
             trigger_id=body["trigger_id"],
-            # A simple view payload for a modal
-            view={
-                "type": "modal",
-                "callback_id": "add_dept_view",
-                "title": {"type": "plain_text", "text": "Stealth Mode"},
-                "close": {"type": "plain_text", "text": "Close"},
-                "blocks": [
-                    create_block(message)
-                ]
-            }
+            view=message_view(message)
+        )
+
+    @app.action("admin_dept_drop_down_action")
+    def update_modal(ack, body, client):
+        ack()
+        print('admin_dept_drop_down_action_selected_successfully')
+        client.views_update(**admin_update(body, desk.modals, desk.catalogs.current))
+
+    @app.action("add_delete_category_action")
+    def update_modal(ack, body, client):
+        ack()
+        print('add_delete_category_action_selected_successfully')
+        client.views_update(**admin_update(body, desk.modals, desk.catalogs.current))
+
+    @app.options("dept_category_list_drop_down_action")
+    def category_options(ack, body):
+        ack(options = category_suggestions(body, desk.catalogs.current, 'dept_list_drop_down_block', 'admin_dept_drop_down_action'))
+
+    @app.options("help_desk_dept_category_list_drop_down_action")
+    def category_options(ack, body):
+        ack(options = category_suggestions(body, desk.catalogs.current, 'help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action'))
+
+    # First Page
+    @app.shortcut("caxe_app_shortcut")
+    def open_modal(ack, shortcut, client, body, context):
+        # Acknowledge the shortcut request
+        ack()
+        # Call the views_open method using the built-in WebClient https://api.slack.com/reference/surfaces/views
+        opened = client.views_open(
+            trigger_id=shortcut["trigger_id"],
+            view=help_desk_view(desk.catalogs.current)
+        )
+        desk.modals.start(opened["view"]["id"], HELP_DESK)
+
+    # Second Page
+    @app.action("help_desk_dept_drop_down_action")
+    def update_modal(ack, body, client):
+        ack()
+        client.views_update(**help_desk_update(body, desk.modals, desk.catalogs.current))
+
+    # Third Page
+    @app.action("help_desk_dept_category_list_drop_down_action")
+    def update_modal(ack, body, client):
+        ack()
+        client.views_update(**help_desk_update(body, desk.modals, desk.catalogs.current))
+
+    @app.view("create_ticket")
+    def action_button_click(body, ack):
+        print('Creating Ticket')
+        ticket = ticket_data(body, desk.routes)
+        key = ticket_key(body)
+        # A ticket the cached createmeta tells Jira would refuse stays in the modal, no round trip.
+        # Checked as the workers send it, with the outbox label
+        problems = desk.jira.known_problems(desk.pipeline.payload(ticket, key))
+        if problems:
+            ack(response_action = "errors", errors = ticket_invalid_errors(problems))
+            return
+        # Returns once the ticket is on disk, the ack only confirms what survives a crash
+        queued = desk.pipeline.submit(ticket, body['user']['id'], key = key)
+        desk.modals.close(body["view"]["id"])
+        # Acknowledge by swapping the modal in place, no extra views_open round trip
+        ack(
+            response_action = "update",
+            view = ticket_submitted_view(queued)
         )
 
+
+def load_config(path = 'config.ini'):
+    configur = ConfigParser()
+    configur.read(path)
+    return configur
+
+
+def create_app(configur = None, token_verification = None):
+    '''
+    App factory: a HelpDesk built from `configur` (config.ini when None), its Bolt App is `.app`.
+    `token_verification` -> True to call `auth.test` now, None to follow `[config] VERIFY_TOKEN_ON_START`
+    '''
+    return HelpDesk(configur if configur is not None else load_config(), token_verification)
+
+
+# `import app` only imports, the module level help desk is built from config.ini when first
+# used as `app.app`, `app.catalogs`, ... (service.py, the benchmarks)
+_helpdesk = None
+_helpdesk_lock = threading.Lock()
+
+
+def helpdesk():
+    global _helpdesk
+    with _helpdesk_lock:
+        if _helpdesk is None:
+            _helpdesk = create_app()
+        return _helpdesk
+
+
+def __getattr__(name):
+    if name in ('app', 'configur', 'jira', 'routes', 'catalogs', 'users', 'modals', 'pipeline'):
+        return getattr(helpdesk(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # Start your app
 if __name__ == "__main__":
-    SocketModeHandler(app, configur.get("config","SLACK_APP_TOKEN")).start()
\ No newline at end of file
+    from slack_bolt.adapter.socket_mode import SocketModeHandler
+    desk = helpdesk()
+    serve_from_config(desk.configur)
+    desk.start()
+    SocketModeHandler(desk.app, desk.configur.get("config","SLACK_APP_TOKEN")).start()
@@ -1,93 +1,160 @@
 import os
-import datetime
+import threading
 from configparser import ConfigParser
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-from slack_bolt.authorization import AuthorizeResult
-from slack_sdk.oauth.installation_store import FileInstallationStore, Installation
+from slack_bolt import App, BoltResponse
+from slack_sdk import WebClient
 from slack_sdk.oauth.state_store import FileOAuthStateStore
 from slack_bolt.oauth.oauth_settings import OAuthSettings
+from installation_store import cache_authorize, open_installation_store
+from ooo_state import OOOStateTable, reply_text
+from reply_ledger import ReplyLedger, app_message
+from user_cache import UserCache
+from instrumentation import instrument, serve_from_config
+from listener_pool import FairExecutor, by_team, when_shed
+from traffic_capture import capture
+from event_dedup import dedupe
+from rate_limiter import limit
+from lazy import built, lazy
 
-configur = ConfigParser()
-configur.read('config.ini')
-
-oauth_settings = OAuthSettings(
-    client_id=configur.get("config2","SLACK_CLIENT_ID"),
-    client_secret=configur.get("config2","SLACK_CLIENT_SECRET"),
-    scopes=["chat:write.customize", "chat:write"],
-    user_scopes=["im:history", "im:read", "users:read", "users:write","chat:write"],
-    installation_store=FileInstallationStore(base_dir="./data/installations"),
-    state_store=FileOAuthStateStore(expiration_seconds=600, base_dir="./data/states")
-)
-
-# Initializes your app with your bot token and socket mode handler
-app = App(
-    signing_secret=configur.get("config2","SLACK_SIGNING_SECRET"),
-    oauth_settings=oauth_settings
-)
-
-# message is an event handler refer: https://api.slack.com/events ; 
-@app.event("message") 
-def respond(event, say, context, client, body ):
-    USER_TOKEN = context.user_token #sender
-    sender = event["user"]
-    receiver = body["authorizations"][0]["user_id"]
-    # for info on methods: https://api.slack.com/methods
-    user_presence = app.client.users_getPresence(
-        user = receiver, 
-        token = USER_TOKEN
-    )["presence"]
-    user_info = app.client.users_info(
-        user = receiver,
-        token = USER_TOKEN
-    )["user"]
-    if (user_presence == "away") and (user_info["profile"]["status_text"]== "Out of Office") and (not sender == receiver):
-        try:
-            installation_store = FileInstallationStore(base_dir="./data/installations")
-            x = installation_store.find_installation(
-                enterprise_id = user_info.get("enterprise_id",None),
-                team_id = user_info["team_id"],
-                user_id = user_info["id"],
-                is_enterprise_install = user_info.get("is_enterprise_install",False),
-            )
-            RECEIVER_TOKEN = x.user_token
-        except:
-            print('failed to fetch receiver user token')
-        else:
-            # message last read by receiver
+
+class AutoResponder:
+    '''
+    The Out of Office auto responder Bolt app and what its listeners share. The OAuth stores
+    are opened when it is built, the user cache, status table and reply ledger on first use
+    '''
+    def __init__(self, configur):
+        self.configur = configur
+        # Installations are cached in memory, shared by Bolt's authorize step and `respond`
+        self.installation_store = open_installation_store(configur, configur.get("config2","SLACK_CLIENT_ID"))
+
+        oauth_settings = OAuthSettings(
+            client_id=configur.get("config2","SLACK_CLIENT_ID"),
+            client_secret=configur.get("config2","SLACK_CLIENT_SECRET"),
+            scopes=["chat:write.customize", "chat:write"],
+            user_scopes=["im:history", "im:read", "users:read", "users:write","chat:write"],
+            installation_store=self.installation_store,
+            state_store=FileOAuthStateStore(expiration_seconds=600, base_dir="./data/states")
+        )
+        # Authorize results are cached with the installations, so acking an event takes no auth.test round trip.
+        # Revoked installations and their results leave the cache together
+        cache_authorize(oauth_settings)
+
+        # Listeners and lazy listeners share a bounded pool, the teams take turns, see listener_pool.py
+        self.executor = FairExecutor.from_config(configur)
+
+        # Initializes your app with your bot token and socket mode handler.
+        # Listeners ack on the request thread, so the response never waits for a pool thread;
+        # their Slack calls run as lazy listeners on the pool
+        self.app = App(
+            # SLACK_API_URL is optional, benchmarks/load_test.py points it at a local mock
+            client=WebClient(base_url=configur.get("config2","SLACK_API_URL", fallback=WebClient.BASE_URL)),
+            signing_secret=configur.get("config2","SLACK_SIGNING_SECRET"),
+            oauth_settings=oauth_settings,
+            process_before_response=True,
+            listener_executor=self.executor
+        )
+        # Ack latency, listener and Slack API timings per handler, see instrumentation.py
+        instrument(self.app)
+        # Slack tier limits per token and method, see rate_limiter.py. After instrument(), so slack_api_seconds leaves out the wait
+        limit(self.app, configur)
+        # Inbound requests to a JSONL log for benchmarks/replay.py, when [capture] PATH is set
+        capture(self.app, "autoresp", configur)
+        # Slack retries and duplicate deliveries are acked and dropped before any listener, see event_dedup.py
+        dedupe(self.app, "autoresp", configur)
+        # Each request's team, the pool queues per team
+        by_team(self.app)
+        # Deletes (and evicts from the cache) installations on `tokens_revoked` / `app_uninstalled`
+        self.app.enable_token_revocation_listeners()
+        register_listeners(self.app, self)
+
+    @lazy
+    def users(self):
+        # Receiver profiles and presence, refreshed by `user_change` / `user_status_changed` events
+        return UserCache.from_config(self.configur)
+
+    @lazy
+    def ooo(self):
+        # Out of Office status per receiver, kept current from events
+        return OOOStateTable.from_config(self.configur)
+
+    @lazy
+    def ledger(self):
+        # When we last auto replied per (receiver, channel)
+        return ReplyLedger.from_config(self.configur)
+
+    def after_fork(self):
+        '''
+        Called in every pre-fork server worker (service.py), resets what was built in the parent
+        '''
+        self.executor.after_fork()
+        if built(self, 'ooo'):
+            self.ooo.after_fork()
+        if built(self, 'ledger'):
+            self.ledger.after_fork()
+
+
+def register_listeners(app, responder):
+    installation_store = responder.installation_store
+
+    # message is an event handler refer: https://api.slack.com/events ; 
+    # The ack side runs on the request thread from memory only, the Slack calls of a reply
+    # run afterwards as a lazy listener on the listener pool
+    def skip_without_reply(event, body, next):
+        # Listener middleware: messages we can tell need no reply are answered here and never queued
+        receiver = body["authorizations"][0]["user_id"]
+        if event["user"] == receiver:
+            # Our own reply is posted with the receiver's token and comes back as their message
+            if not app_message(event, body) and not responder.ledger.is_reply(receiver, event["channel"], event.get("ts")):
+                # the receiver answered in this channel, start counting again
+                responder.ledger.forget(receiver, event["channel"])
+            return BoltResponse(status = 200, body = "")
+        # Receivers we have seen a status event or profile for are answered from memory,
+        # no Slack calls unless they are Out of Office
+        state = responder.ooo.get(receiver)
+        if state is not None and not state.is_ooo():
+            return BoltResponse(status = 200, body = "")
+        # A reply dropped by the full listener pool is retried with the next message
+        when_shed(lambda: responder.ledger.forget(receiver, event["channel"]))
+        next()
+
+    def ack_event(ack):
+        ack()
+
+    def respond(event, context, body):
+        USER_TOKEN = context.user_token #sender
+        sender = event["user"]
+        receiver = body["authorizations"][0]["user_id"]
+        state = responder.ooo.get(receiver)
+        if state is None:
+            # for info on methods: https://api.slack.com/methods
+            state = responder.ooo.update_user(responder.users.info(app.client, receiver, token = USER_TOKEN))
+        if not state.is_ooo():
+            return
+        user_presence = responder.ooo.presence(receiver, responder.users.presences.ttl) or responder.users.presence(app.client, receiver, token = USER_TOKEN)
+        if user_presence == "away":
+            # check whether we have already replied in the current date. skip if yes
+            # after REPLY_EVERY unresponded texts reply again to remind we are out of office
+            if not responder.ledger.record_inbound(receiver, event["channel"]):
+                print("Already Replied")
+                return
             try:
-                last_read = app.client.conversations_info(
-                    token = RECEIVER_TOKEN, 
-                    channel = event["channel"]
-                )["channel"]["last_read"]
-                
-                # check whether we have already replied in the current date. skip if yes
-                # after 10 texts reply again to remind we are out of office
-
-                message_list = app.client.conversations_history(
-                    token = RECEIVER_TOKEN, 
-                    channel = event["channel"], 
-                    oldest = last_read, 
-                )["messages"]
-
-                replied = False
-                for idx, message in enumerate(message_list):
-                    # reply for every 10 Unresponded texts
-                    if idx == 9:
-                        break
-                    if "Out of Office" in message["text"]:
-                        replied = True
-                        break
-
-                if not replied:
-                    expiration = user_info["profile"]["status_expiration"]
-                    if not expiration == 0:
-                        dt = datetime.datetime.fromtimestamp(expiration)
-                        text = f"Hi, <@{ sender }>!!!\nI am Out of Office and will be back on {dt}"
-                    else:
-                        # add career manager instead of U032ATMNLVC or any other profile field that may exist.
-                        text = f"Hi, <@{ sender }>!!!\nI'll be Out of Office for a while.\nIn case of emergency please reach out to <@U032ATMNLVC>.\nThanks"
-                    app.client.chat_postMessage(
+                x = installation_store.find_installation(
+                    enterprise_id = state.enterprise_id,
+                    team_id = state.team_id,
+                    user_id = state.user_id,
+                    is_enterprise_install = False,
+                )
+                RECEIVER_TOKEN = x.user_token
+            except:
+                print('failed to fetch receiver user token')
+                responder.ledger.forget(receiver, event["channel"])
+            else:
+                # Marked before posting, Slack can send the reply back as an event before it answers
+                responder.ledger.posting(receiver, event["channel"])
+                ts = None
+                try:
+                    text = reply_text(sender, state)
+                    ts = app.client.chat_postMessage(
                         # respond as Bot with Reciever Details
                         # token = RECEIVER_TOKEN, 
                         # username = user_info["name"],
@@ -95,31 +162,90 @@ def respond(event, say, context, client, body ):
                         token = RECEIVER_TOKEN,
                         channel = sender,
                         text = text,
+                    )["ts"]
+                except Exception as err:
+                    print(err)
+                    responder.ledger.forget(receiver, event["channel"])
+                finally:
+                    responder.ledger.posted(receiver, event["channel"], ts)
+
+    app.event("message", middleware = [skip_without_reply])(ack = ack_event, lazy = [respond])
+
+    # When selecting Out of Office, change presence to away
+    def record_status(ack, event):
+        ack()
+        responder.users.update(event["user"])
+        responder.ooo.update_user(event["user"])
+
+    def set_away(event, context):
+        status = event["user"]["profile"]["status_text"]
+        try:
+            if status == "Out of Office":
+                app.client.users_setPresence(
+                    token = context.user_token,
+                    presence = "away"
                     )
-                else:
-                    print("Already Replied")
-                    pass
-            except Exception as err:
-                print(err)
-
-# When selecting Out of Office, change presence to away
-@app.event("user_status_changed")
-def handle_user_status_changed_events(logger, event, context):
-    status = event["user"]["profile"]["status_text"]
-    try:
-        if status == "Out of Office":
-            app.client.users_setPresence(
-                token = context.user_token,
-                presence = "away"
-                )
-    except Exception as err:
-        print(err)
+                responder.users.presences.invalidate(event["user"]["id"])
+                responder.ooo.update_presence(event["user"]["id"], "away")
+        except Exception as err:
+            print(err)
+
+    app.event("user_status_changed")(ack = record_status, lazy = [set_away])
+
+    @app.event("user_change")
+    def handle_user_change_events(event):
+        responder.users.update(event["user"])
+        responder.ooo.update_user(event["user"])
+
+    # Only delivered when presence is subscribed (Socket Mode / RTM), otherwise presence falls back to the cache
+    @app.event("presence_change")
+    def handle_presence_change_events(event):
+        for user_id in event.get("users") or [event["user"]]:
+            responder.ooo.update_presence(user_id, event["presence"])
+
+
+
+def load_config(path = 'config.ini'):
+    configur = ConfigParser()
+    configur.read(path)
+    return configur
+
+
+def create_app(configur = None):
+    '''
+    App factory: an AutoResponder built from `configur` (config.ini when None), its Bolt App is `.app`
+    '''
+    return AutoResponder(configur if configur is not None else load_config())
+
+
+# `import app_autoresp` only imports, the module level responder is built from config.ini when
+# first used as `app_autoresp.app`, `app_autoresp.ooo`, ... (service.py, the benchmarks)
+_responder = None
+_responder_lock = threading.Lock()
+
+
+def responder():
+    global _responder
+    with _responder_lock:
+        if _responder is None:
+            _responder = create_app()
+        return _responder
+
+
+def __getattr__(name):
+    if name in ('app', 'configur', 'installation_store', 'users', 'ooo', 'ledger'):
+        return getattr(responder(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 ## Comment out when creating flask app
 # Start your app
 if __name__ == "__main__":
+    autoresp = responder()
+    serve_from_config(autoresp.configur)
     ## Socket Mode
-    # SocketModeHandler(app, configur.get("config2","SLACK_APP_TOKEN")).start()
+    # from slack_bolt.adapter.socket_mode import SocketModeHandler
+    # SocketModeHandler(autoresp.app, autoresp.configur.get("config2","SLACK_APP_TOKEN")).start()
     ## HTTP Mode
     # Starts a web server for local development.
-    app.start(port=int(os.environ.get("PORT", 3000)))
\ No newline at end of file
+    autoresp.app.start(port=int(os.environ.get("PORT", 3000)))
@@ -0,0 +1,278 @@
+import asyncio
+import threading
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from slack_sdk.web.async_client import AsyncWebClient
+from configparser import ConfigParser
+from catalog import LiveCatalog
+from catalog_store import open_store
+from helpdesk_views import (
+    admin_update, admin_view, apply_category_submission, apply_department_submission,
+    category_suggestions, department_added_view, help_desk_update, help_desk_view,
+    message_view, ticket_data, ticket_details, ticket_done_text, ticket_invalid_errors, ticket_key, ticket_submitted_view,
+)
+from modal_state import ADMIN, HELP_DESK, ModalSessions
+from user_cache import UserCache
+from instrumentation import async_instrument, serve_from_config
+from traffic_capture import async_capture
+from event_dedup import async_dedupe
+from rate_limiter import async_limit
+from lazy import built, lazy
+from ticket_routing import Routes
+from jira_schema import MissingFields
+# asyncio variant of app.py, same shortcuts, actions and views on a single event loop.
+# Every handler awaits Slack and Jira instead of holding a listener thread
+
+
+class AsyncHelpDesk:
+    '''
+    app.HelpDesk on AsyncApp. Building it makes no network call and reads no catalog, each part
+    is built on first use; the aiohttp session and the ticket worker tasks inside the running loop
+    '''
+    def __init__(self, configur):
+        self.configur = configur
+        # SLACK_API_URL is optional, benchmarks/load_test.py points it at a local mock
+        self.app = AsyncApp(
+            client=AsyncWebClient(
+                token=configur.get("config","SLACK_BOT_TOKEN"),
+                base_url=configur.get("config","SLACK_API_URL", fallback=AsyncWebClient.BASE_URL)
+            ),
+            signing_secret=configur.get("config","SLACK_SIGNING_SECRET", fallback=None)
+        )
+        # Ack latency and Slack API timings per handler, see instrumentation.py
+        async_instrument(self.app)
+        # Slack tier limits per token and method, see rate_limiter.py. After instrument(), so slack_api_seconds leaves out the wait
+        async_limit(self.app, configur)
+        # Inbound requests to a JSONL log for benchmarks/replay.py, when [capture] PATH is set
+        async_capture(self.app, "helpdesk", configur)
+        # Slack retries and duplicate deliveries are acked and dropped before any listener, see event_dedup.py
+        async_dedupe(self.app, "helpdesk", configur)
+        register_listeners(self.app, self)
+
+    @lazy
+    def jira(self):
+        # aiohttp connection pool to Jira, opened on first use inside the event loop
+        from jira_client import AsyncJiraClient
+        return AsyncJiraClient.from_config(self.configur)
+
+    @lazy
+    def routes(self):
+        # Jira project, issue type and priority per department and category, see ticket_routing.py
+        return Routes.from_config(self.configur)
+
+    @lazy
+    def catalogs(self):
+        # Current department/category snapshot, admin edits publish a new one atomically
+        catalogs = LiveCatalog.from_config(open_store(self.configur), self.configur)
+        print(f'Catalog v{catalogs.current.version} loaded with {len(catalogs.current)} departments')
+        return catalogs
+
+    @lazy
+    def users(self):
+        # users.info answers, shared by every shortcut invocation
+        return UserCache.from_config(self.configur)
+
+    @lazy
+    def modals(self):
+        # Where each open modal is in its flow, keyed by view_id
+        return ModalSessions.from_config(self.configur)
+
+    @lazy
+    def pipeline(self):
+        # Tickets are written to a local outbox and created by worker tasks, a slow or unavailable Jira never delays the ack.
+        # Reports of an issue already raised are added to its ticket, see ticket_dedup.py
+        from ticket_outbox import open_async_pipeline
+        from ticket_dedup import open_duplicates
+        return open_async_pipeline(self.configur, self.jira, self.notify_ticket_done,
+                                   duplicates = open_duplicates(self.configur, text = ticket_details))
+
+    async def notify_ticket_done(self, job, issue, error):
+        '''
+        Awaited by the ticket worker tasks once Jira answers, DMs the reference id to the user who raised it
+        '''
+        if error:
+            print(error)
+        await self.app.client.chat_postMessage(
+            text = ticket_done_text(issue, error),
+            channel = job.user_id
+        )
+
+    async def start(self):
+        '''
+        Fetches the createmeta of every routed project and starts the ticket workers, which deliver
+        what the outbox still holds from before a restart. Raises MissingFields when a create screen
+        lacks a field the pipeline sets on every issue
+        '''
+        await self.load_meta()
+        await self.pipeline.start()
+
+    async def load_meta(self):
+        # createmeta of every routed project, so even the first ticket Jira would refuse is refused in the modal
+        require = [(project, issuetype, field) for project, issuetype in self.routes.targets()
+                   for field in self.pipeline.required_fields]
+        try:
+            await self.jira.load_meta(self.routes.projects(), require = require)
+        except MissingFields:
+            raise
+        except Exception as err:
+            print(f'Jira createmeta unavailable: {err}')
+
+    async def close(self):
+        if built(self, 'pipeline') and self.pipeline.workers:
+            await self.pipeline.stop()
+        if built(self, 'jira'):
+            await self.jira.close()
+
+
+def register_listeners(app, desk):
+    @app.event("user_change")
+    async def handle_user_change_events(event):
+        desk.users.update(event["user"])
+
+    @app.shortcut("admin_caxe")
+    async def open_modal(ack, body, shortcut, client):
+        await ack()
+        x = await desk.users.async_info(app.client, body['user']['id'])
+        # Check if Admin
+        opened = await client.views_open(
+            trigger_id=shortcut["trigger_id"],
+            view=admin_view(x['is_owner'] or True)
+        )
+        desk.modals.start(opened["view"]["id"], ADMIN)
+
+    @app.action("add_update_radio_buttons_action")
+    async def update_modal(ack, body, client):
+        await ack()
+        print('radio_button_selected_successfully')
+        await client.views_update(**admin_update(body, desk.modals, desk.catalogs.current))
+
+    # Catalog edits write through the store, run them off the event loop
+    @app.view("update_files_department")
+    async def handle_view_events(client, ack, body):
+        await ack()
+        desk.modals.close(body["view"]["id"])
+        await asyncio.to_thread(apply_department_submission, body, desk.catalogs)
+        print("Success!")
+        #sending a success message to user
+        await client.views_open(
+            trigger_id = body["trigger_id"],
+            view = department_added_view()
+        )
+
+    @app.view("update_files")
+    async def handle_view_events(client, ack, body):
+        await ack()
+        desk.modals.close(body["view"]["id"])
+        print('category_input_submitted_successfully')
+        message = await asyncio.to_thread(apply_category_submission, body, desk.catalogs)
+        await client.views_open(
+            trigger_id=body["trigger_id"],
+            view=message_view(message)
+        )
+
+    @app.action("admin_dept_drop_down_action")
+    async def update_modal(ack, body, client):
+        await ack()
+        print('admin_dept_drop_down_action_selected_successfully')
+        await client.views_update(**admin_update(body, desk.modals, desk.catalogs.current))
+
+    @app.action("add_delete_category_action")
+    async def update_modal(ack, body, client):
+        await ack()
+        print('add_delete_category_action_selected_successfully')
+        await client.views_update(**admin_update(body, desk.modals, desk.catalogs.current))
+
+    @app.options("dept_category_list_drop_down_action")
+    async def category_options(ack, body):
+        await ack(options = category_suggestions(body, desk.catalogs.current, 'dept_list_drop_down_block', 'admin_dept_drop_down_action'))
+
+    @app.options("help_desk_dept_category_list_drop_down_action")
+    async def category_options(ack, body):
+        await ack(options = category_suggestions(body, desk.catalogs.current, 'help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action'))
+
+    # First Page
+    @app.shortcut("caxe_app_shortcut")
+    async def open_modal(ack, shortcut, client):
+        await ack()
+        opened = await client.views_open(
+            trigger_id=shortcut["trigger_id"],
+            view=help_desk_view(desk.catalogs.current)
+        )
+        desk.modals.start(opened["view"]["id"], HELP_DESK)
+
+    # Second Page
+    @app.action("help_desk_dept_drop_down_action")
+    async def update_modal(ack, body, client):
+        await ack()
+        await client.views_update(**help_desk_update(body, desk.modals, desk.catalogs.current))
+
+    # Third Page
+    @app.action("help_desk_dept_category_list_drop_down_action")
+    async def update_modal(ack, body, client):
+        await ack()
+        await client.views_update(**help_desk_update(body, desk.modals, desk.catalogs.current))
+
+    @app.view("create_ticket")
+    async def action_button_click(body, ack):
+        print('Creating Ticket')
+        ticket = ticket_data(body, desk.routes)
+        key = ticket_key(body)
+        # A ticket the cached createmeta tells Jira would refuse stays in the modal, no round trip.
+        # Checked as the workers send it, with the outbox label
+        problems = desk.jira.known_problems(desk.pipeline.payload(ticket, key))
+        if problems:
+            await ack(response_action = "errors", errors = ticket_invalid_errors(problems))
+            return
+        queued = await desk.pipeline.submit(ticket, body['user']['id'], key = key)
+        desk.modals.close(body["view"]["id"])
+        await ack(
+            response_action = "update",
+            view = ticket_submitted_view(queued)
+        )
+
+
+def load_config(path = 'config.ini'):
+    configur = ConfigParser()
+    configur.read(path)
+    return configur
+
+
+def create_app(configur = None):
+    '''
+    App factory: an AsyncHelpDesk built from `configur` (config.ini when None), its Bolt AsyncApp is `.app`
+    '''
+    return AsyncHelpDesk(configur if configur is not None else load_config())
+
+
+# `import async_app` only imports, the module level help desk is built from config.ini when first
+# used as `async_app.app`, `async_app.catalogs`, ...
+_helpdesk = None
+_helpdesk_lock = threading.Lock()
+
+
+def helpdesk():
+    global _helpdesk
+    with _helpdesk_lock:
+        if _helpdesk is None:
+            _helpdesk = create_app()
+        return _helpdesk
+
+
+def __getattr__(name):
+    if name in ('app', 'configur', 'jira', 'routes', 'catalogs', 'users', 'modals', 'pipeline'):
+        return getattr(helpdesk(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+async def main():
+    desk = helpdesk()
+    await desk.start()
+    try:
+        await AsyncSocketModeHandler(desk.app, desk.configur.get("config","SLACK_APP_TOKEN")).start_async()
+    finally:
+        await desk.close()
+
+# Start your app
+if __name__ == "__main__":
+    serve_from_config(helpdesk().configur)
+    asyncio.run(main())
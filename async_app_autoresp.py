@@ -0,0 +1,190 @@
+import os
+import threading
+from configparser import ConfigParser
+from slack_bolt.async_app import AsyncApp
+from slack_sdk.web.async_client import AsyncWebClient
+from slack_sdk.oauth.state_store import FileOAuthStateStore
+from slack_bolt.oauth.async_oauth_settings import AsyncOAuthSettings
+from installation_store import open_installation_store
+from ooo_state import OOOStateTable, reply_text
+from reply_ledger import ReplyLedger, app_message
+from user_cache import UserCache
+from instrumentation import async_instrument, serve_from_config
+from traffic_capture import async_capture
+from event_dedup import async_dedupe
+from rate_limiter import async_limit
+from lazy import lazy
+# asyncio variant of app_autoresp.py, same events and replies on a single event loop
+
+
+class AsyncAutoResponder:
+    '''
+    app_autoresp.AutoResponder on AsyncApp. The OAuth stores are opened when it is built,
+    the user cache, status table and reply ledger on first use
+    '''
+    def __init__(self, configur):
+        self.configur = configur
+        # Installations are cached in memory, shared by Bolt's authorize step and `respond`
+        self.installation_store = open_installation_store(configur, configur.get("config2","SLACK_CLIENT_ID"))
+
+        oauth_settings = AsyncOAuthSettings(
+            client_id=configur.get("config2","SLACK_CLIENT_ID"),
+            client_secret=configur.get("config2","SLACK_CLIENT_SECRET"),
+            scopes=["chat:write.customize", "chat:write"],
+            user_scopes=["im:history", "im:read", "users:read", "users:write","chat:write"],
+            installation_store=self.installation_store,
+            state_store=FileOAuthStateStore(expiration_seconds=600, base_dir="./data/states")
+        )
+
+        self.app = AsyncApp(
+            # SLACK_API_URL is optional, benchmarks/load_test.py points it at a local mock
+            client=AsyncWebClient(base_url=configur.get("config2","SLACK_API_URL", fallback=AsyncWebClient.BASE_URL)),
+            signing_secret=configur.get("config2","SLACK_SIGNING_SECRET"),
+            oauth_settings=oauth_settings
+        )
+        # Ack latency and Slack API timings per handler, see instrumentation.py
+        async_instrument(self.app)
+        # Slack tier limits per token and method, see rate_limiter.py. After instrument(), so slack_api_seconds leaves out the wait
+        async_limit(self.app, configur)
+        # Inbound requests to a JSONL log for benchmarks/replay.py, when [capture] PATH is set
+        async_capture(self.app, "autoresp", configur)
+        # Slack retries and duplicate deliveries are acked and dropped before any listener, see event_dedup.py
+        async_dedupe(self.app, "autoresp", configur)
+        # Deletes (and evicts from the cache) installations on `tokens_revoked` / `app_uninstalled`
+        self.app.enable_token_revocation_listeners()
+        register_listeners(self.app, self)
+
+    @lazy
+    def users(self):
+        # Receiver profiles and presence, refreshed by `user_change` / `user_status_changed` events
+        return UserCache.from_config(self.configur)
+
+    @lazy
+    def ooo(self):
+        # Out of Office status per receiver, kept current from events
+        return OOOStateTable.from_config(self.configur)
+
+    @lazy
+    def ledger(self):
+        # When we last auto replied per (receiver, channel)
+        return ReplyLedger.from_config(self.configur)
+
+
+def register_listeners(app, responder):
+    installation_store = responder.installation_store
+
+    @app.event("message")
+    async def respond(event, context, body):
+        USER_TOKEN = context.user_token #sender
+        sender = event["user"]
+        receiver = body["authorizations"][0]["user_id"]
+        if sender == receiver:
+            # Our own reply is posted with the receiver's token and comes back as their message
+            if not app_message(event, body) and not responder.ledger.is_reply(receiver, event["channel"], event.get("ts")):
+                # the receiver answered in this channel, start counting again
+                responder.ledger.forget(receiver, event["channel"])
+            return
+        state = responder.ooo.get(receiver)
+        if state is None:
+            state = responder.ooo.update_user(await responder.users.async_info(app.client, receiver, token = USER_TOKEN))
+        if not state.is_ooo():
+            return
+        user_presence = responder.ooo.presence(receiver, responder.users.presences.ttl) or await responder.users.async_presence(app.client, receiver, token = USER_TOKEN)
+        if user_presence == "away":
+            if not responder.ledger.record_inbound(receiver, event["channel"]):
+                print("Already Replied")
+                return
+            try:
+                x = await installation_store.async_find_installation(
+                    enterprise_id = state.enterprise_id,
+                    team_id = state.team_id,
+                    user_id = state.user_id,
+                    is_enterprise_install = False,
+                )
+                RECEIVER_TOKEN = x.user_token
+            except:
+                print('failed to fetch receiver user token')
+                responder.ledger.forget(receiver, event["channel"])
+            else:
+                # Marked before posting, Slack can send the reply back as an event before it answers
+                responder.ledger.posting(receiver, event["channel"])
+                ts = None
+                try:
+                    ts = (await app.client.chat_postMessage(
+                        token = RECEIVER_TOKEN,
+                        channel = sender,
+                        text = reply_text(sender, state),
+                    ))["ts"]
+                except Exception as err:
+                    print(err)
+                    responder.ledger.forget(receiver, event["channel"])
+                finally:
+                    responder.ledger.posted(receiver, event["channel"], ts)
+
+    # When selecting Out of Office, change presence to away
+    @app.event("user_status_changed")
+    async def handle_user_status_changed_events(event, context):
+        responder.users.update(event["user"])
+        responder.ooo.update_user(event["user"])
+        status = event["user"]["profile"]["status_text"]
+        try:
+            if status == "Out of Office":
+                await app.client.users_setPresence(
+                    token = context.user_token,
+                    presence = "away"
+                    )
+                responder.users.presences.invalidate(event["user"]["id"])
+                responder.ooo.update_presence(event["user"]["id"], "away")
+        except Exception as err:
+            print(err)
+
+    @app.event("user_change")
+    async def handle_user_change_events(event):
+        responder.users.update(event["user"])
+        responder.ooo.update_user(event["user"])
+
+    @app.event("presence_change")
+    async def handle_presence_change_events(event):
+        for user_id in event.get("users") or [event["user"]]:
+            responder.ooo.update_presence(user_id, event["presence"])
+
+
+def load_config(path = 'config.ini'):
+    configur = ConfigParser()
+    configur.read(path)
+    return configur
+
+
+def create_app(configur = None):
+    '''
+    App factory: an AsyncAutoResponder built from `configur` (config.ini when None), its Bolt AsyncApp is `.app`
+    '''
+    return AsyncAutoResponder(configur if configur is not None else load_config())
+
+
+# `import async_app_autoresp` only imports, the module level responder is built from config.ini when
+# first used as `async_app_autoresp.app`, `async_app_autoresp.ooo`, ...
+_responder = None
+_responder_lock = threading.Lock()
+
+
+def responder():
+    global _responder
+    with _responder_lock:
+        if _responder is None:
+            _responder = create_app()
+        return _responder
+
+
+def __getattr__(name):
+    if name in ('app', 'configur', 'installation_store', 'users', 'ooo', 'ledger'):
+        return getattr(responder(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Start your app
+if __name__ == "__main__":
+    autoresp = responder()
+    serve_from_config(autoresp.configur)
+    # Starts an aiohttp web server
+    autoresp.app.start(port=int(os.environ.get("PORT", 3000)))
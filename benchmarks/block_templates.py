@@ -0,0 +1,103 @@
+'''
+Microbenchmark of the compiled block templates against `create_block`.
+
+Every template in helpdesk_views.py is rendered with and without an initial option and
+compared byte for byte with the JSON of the block built by hand as before the templates
+(`create_block`, then the option preselected), then both are timed. The full views are
+checked against stored golden output by tests/test_views.py
+
+    python -m benchmarks.block_templates
+'''
+import argparse
+import json
+import timeit
+from catalog import Catalog, Department
+from helpdesk_views import (
+    ADMIN_ADD_DELETE, ADMIN_ADD_DELETE_CHOICES, ADMIN_CHOICE, ADMIN_CHOICES, DEPARTMENT_SELECT,
+    HELP_DESK_CATEGORY, create_block, create_options, message_view, modal,
+)
+
+
+# Copy of the legacy builder in helpdesk_views.py
+
+def with_initial(block, option):
+    '''
+    Copy of a template block with `option` preselected, the template itself is never modified
+    '''
+    if option is None:
+        return block
+    key = 'accessory' if 'accessory' in block else 'element'
+    return {**block, key: {**block[key], 'initial_option': option}}
+
+
+def golden_cases(catalog):
+    '''
+    [(name, render(), hand-built equivalent())]
+    '''
+    dept = next(iter(catalog.departments.values()))
+    category = dept.categories[0]
+    cases = [(
+        'message view',
+        lambda: message_view('Category added Successfully!!!'),
+        lambda: modal("add_dept_view", [create_block('Category added Successfully!!!')]),
+    )]
+    radios = (
+        ('admin choice', ADMIN_CHOICE, ADMIN_CHOICES, "add_update_radio_block", "add_update_radio_buttons_action"),
+        ('add / delete', ADMIN_ADD_DELETE, ADMIN_ADD_DELETE_CHOICES, "add_delete_category_block", "add_delete_category_action"),
+    )
+    for name, template, choices, block_id, action in radios:
+        for initial in (None, choices[1]):
+            cases.append((
+                f'{name}{" + initial" if initial else ""}',
+                lambda template = template, initial = initial: template.render(initial_option = initial),
+                lambda choices = choices, block_id = block_id, action = action, initial = initial: with_initial(create_block(
+                    "Select", block_id = block_id, action = action, type1 = 'radio_buttons',
+                    options = create_options([(option['text']['text'], option['value']) for option in choices]),
+                ), initial),
+            ))
+    for initial in (None, dept.option):
+        cases.append((
+            f'department select{" + initial" if initial else ""}',
+            lambda initial = initial: DEPARTMENT_SELECT.render(
+                block_id = 'help_desk_dept_list_drop_down_block', action = 'help_desk_dept_drop_down_action',
+                options = catalog.department_options, initial_option = initial,
+            ),
+            lambda initial = initial: with_initial(create_block(
+                "Select the Relevant Department", text2 = "Select an item", block_id = 'help_desk_dept_list_drop_down_block',
+                type1 = 'static_select', action = 'help_desk_dept_drop_down_action',
+                options = catalog.department_options,
+            ), initial),
+        ))
+    for initial in (None, category.option):
+        cases.append((
+            f'category typeahead{" + initial" if initial else ""}',
+            lambda initial = initial: HELP_DESK_CATEGORY.render(initial_option = initial),
+            lambda initial = initial: with_initial(create_block(
+                "Select the issue category", text2 = "Category", block_id = 'help_desk_dept_category_list_drop_down_block',
+                type1 = 'external_select', action = 'help_desk_dept_category_list_drop_down_action',
+            ), initial),
+        ))
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--departments', type = int, default = 30)
+    parser.add_argument('--number', type = int, default = 20000)
+    args = parser.parse_args()
+
+    catalog = Catalog([Department(f'Dept{d}', [f'Category {d}-{c}' for c in range(10)]) for d in range(args.departments)])
+    cases = golden_cases(catalog)
+    for name, render, build in cases:
+        rendered, built = json.dumps(render()), json.dumps(build())
+        assert rendered == built, f'{name}: template output differs from the hand-built block\n{rendered}\n{built}'
+    print(f'{len(cases)} templates byte identical to the hand-built blocks')
+
+    for name, render, build in cases:
+        build_secs = min(timeit.repeat(build, number = args.number, repeat = 5)) / args.number
+        render_secs = min(timeit.repeat(render, number = args.number, repeat = 5)) / args.number
+        print(f'{name:>32}: create_block {build_secs * 1e6:6.2f} us | template {render_secs * 1e6:6.2f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+Per-interaction option payload build time, legacy `master_data` dict against the Catalog snapshot.
+
+    python -m benchmarks.catalog_payloads --departments 30 --categories 100
+'''
+import argparse
+import timeit
+from catalog import Catalog, Department
+
+
+def create_field(text, value):
+    # Copy of the legacy helper in app.py
+    return {"text": {"type": "plain_text", "text": text}, "value": value}
+
+
+def legacy_master_data(departments):
+    master_data = {}
+    for dept_name, categories in departments.items():
+        master_data[dept_name] = {
+            'name': create_field(dept_name, f'dept_{dept_name}'),
+            'categories': [],
+        }
+        for category in categories:
+            master_data[dept_name]['categories'].append(create_field(category, f'{dept_name}_category_{category}'))
+    return master_data
+
+
+def legacy_departments_list(master_data):
+    data = []
+    for val in master_data.values():
+        data.append(val['name'])
+    return data
+
+
+def synthetic(departments, categories):
+    return {
+        f'Dept{d}': [f'Category {d}-{c}' for c in range(categories)]
+        for d in range(departments)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--departments', type = int, default = 30)
+    parser.add_argument('--categories', type = int, default = 100)
+    parser.add_argument('--number', type = int, default = 20000)
+    args = parser.parse_args()
+
+    data = synthetic(args.departments, args.categories)
+    master_data = legacy_master_data(data)
+    catalog = Catalog([Department(name, categories) for name, categories in data.items()])
+    dept = next(iter(data))
+    assert legacy_departments_list(master_data) == list(catalog.department_options)
+    assert master_data[dept]['categories'] == list(catalog.department(dept).category_options)
+
+    def before():
+        # shortcut open + department selected, as the handlers did it
+        legacy_departments_list(master_data)
+        master_data[dept]['categories']
+
+    def after():
+        catalog.department_options
+        catalog.department(dept).category_options
+
+    for name, func in (('before', before), ('after', after)):
+        secs = min(timeit.repeat(func, number = args.number, repeat = 5)) / args.number
+        print(f'{name:>6}: {secs * 1e6:.3f} us per interaction')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''
+Typeahead latency over a synthetic catalog, compared with the static_select payload it replaces.
+
+    python -m benchmarks.category_search --categories 50000
+'''
+import argparse
+import json
+import random
+import time
+from catalog import Department
+
+WORDS = ['laptop', 'vpn', 'network', 'access', 'install', 'software', 'printer', 'payroll', 'leave',
+         'holiday', 'badge', 'email', 'password', 'reset', 'monitor', 'license', 'travel', 'claim',
+         'expense', 'onboarding', 'offboarding', 'benefits', 'insurance', 'desk', 'parking']
+
+
+def synthetic_names(count, seed = 7):
+    rnd = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        names.add(' '.join(rnd.choice(WORDS).title() for _ in range(rnd.randint(2, 4))) + f' {rnd.randint(1, 999)}')
+    return sorted(names)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--categories', type = int, default = 50000)
+    parser.add_argument('--queries', type = int, default = 2000)
+    args = parser.parse_args()
+
+    names = synthetic_names(args.categories)
+    dept = Department('I.T', names)
+    start = time.perf_counter()
+    dept.search('')
+    print(f'index build: {(time.perf_counter() - start) * 1000:.1f} ms for {len(names)} categories')
+
+    rnd = random.Random(11)
+    kinds = {
+        'prefix': lambda name: name.lower()[:rnd.randint(1, 6)],
+        'word prefix': lambda name: name.split()[-2].lower()[:4],
+        'typo': lambda name: name.lower().replace('a', 'e', 1)[:10],
+    }
+    for kind, make_query in kinds.items():
+        timings = []
+        for _ in range(args.queries):
+            query = make_query(rnd.choice(names))
+            start = time.perf_counter()
+            dept.search(query)
+            timings.append(time.perf_counter() - start)
+        print(f'{kind:>12}: p50 {percentile(timings, 50) * 1000:.3f} ms  p99 {percentile(timings, 99) * 1000:.3f} ms')
+
+    static_bytes = len(json.dumps(dept.category_options))
+    typeahead_bytes = len(json.dumps({'options': dept.search('lap')}))
+    print(f'payload: static_select {static_bytes} bytes (Slack caps it at 100 options), typeahead answer {typeahead_bytes} bytes')
+
+
+if __name__ == '__main__':
+    main()
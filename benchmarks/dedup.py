@@ -0,0 +1,119 @@
+'''
+Duplicate ticket detection through an outage spike, offline against the mock Jira.
+
+`--reports` people report the same outage in their own words within a few seconds, among
+`--others` unrelated tickets of the same and other categories. With duplicate detection on
+(ticket_dedup.py) the first report creates the issue and the rest are commented on it.
+
+    python -m benchmarks.dedup --reports 200 --others 100 --threshold 0.6
+
+Reported: Jira issues and comments, outage reports that still got an issue of their own,
+tickets added to the issue of another problem, and the cost of a signature
+'''
+import argparse
+import collections
+import random
+import threading
+import time
+from benchmarks.mock_jira import MockJira
+from helpdesk_views import DETAILS, ticket_details
+from jira_client import JiraClient
+from ticket_dedup import DuplicateIndex, signature_time
+from ticket_pipeline import TicketPipeline
+
+OUTAGE = 'I.T: VPN'
+PHRASINGS = (
+    'VPN is down, cannot connect from home',
+    'vpn down - can not connect from home!!',
+    'The VPN is down and I cannot connect from home',
+    'cannot connect to VPN from home, it is down',
+    'VPN down, can\'t connect from home since this morning',
+)
+OTHERS = (
+    ('I.T: VPN', 'VPN client asks for a licence key after the update'),
+    ('I.T: Laptop', 'Laptop does not boot, the screen stays black'),
+    ('I.T: Laptop', 'Need a second charger for the meeting room'),
+    ('I.T: Email', 'Outlook keeps asking for my password'),
+    ('HR: Payroll', 'My payslip for last month is missing'),
+    ('Facilities: Badge', 'Badge does not open the third floor door'),
+)
+
+
+def report(idx, summary, text):
+    return {
+        'fields': {
+            'project': {'key': 'TEST'},
+            'summary': summary,
+            'description': f'Issue created by: <@U{idx:06d}>\nhttps://bench.slack.com/team/U{idx:06d}{DETAILS}{text}',
+            'issuetype': {'name': 'Task'},
+        }
+    }
+
+
+def spike(reports, others, seed):
+    '''
+    [(problem, ticket_data)] in arrival order, `problem` is None for the outage, else an index of OTHERS
+    '''
+    rng = random.Random(seed)
+    tickets = [(None, report(idx, OUTAGE, rng.choice(PHRASINGS))) for idx in range(reports)]
+    for idx in range(reports, reports + others):
+        problem = rng.randrange(len(OTHERS))
+        summary, text = OTHERS[problem]
+        tickets.append((problem, report(idx, summary, f'{text}, asset {rng.randrange(10000)}')))
+    rng.shuffle(tickets)
+    return tickets
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--reports', type = int, default = 200, help = 'reports of the outage')
+    parser.add_argument('--others', type = int, default = 100, help = 'unrelated tickets')
+    parser.add_argument('--threshold', type = float, default = 0.6)
+    parser.add_argument('--workers', type = int, default = 8)
+    parser.add_argument('--latency', type = float, default = 0.05, help = 'seconds per Jira call')
+    parser.add_argument('--seed', type = int, default = 1)
+    args = parser.parse_args()
+
+    tickets = spike(args.reports, args.others, args.seed)
+    duplicates = DuplicateIndex(threshold = args.threshold, text = ticket_details)
+    answers = {}
+    done = threading.Semaphore(0)
+
+    def on_done(job, issue, error):
+        answers[job.user_id] = (issue, error)
+        done.release()
+
+    with MockJira(args.latency) as mock:
+        pipeline = TicketPipeline(JiraClient(mock.url, 'bench', 'bench'), on_done, workers = args.workers, duplicates = duplicates)
+        start = time.perf_counter()
+        for idx, (_, ticket) in enumerate(tickets):
+            pipeline.submit(ticket, idx)
+        for _ in tickets:
+            done.acquire()
+        secs = time.perf_counter() - start
+        pipeline.stop()
+
+    # The problem each issue was created for, a duplicate of another problem is a false merge
+    created_for = {answers[idx][0]['key']: problem for idx, (problem, _) in enumerate(tickets)
+                   if answers[idx][0] and not answers[idx][0].get('duplicate')}
+    outcome = collections.Counter()
+    for idx, (problem, _) in enumerate(tickets):
+        issue, error = answers[idx]
+        if error is not None:
+            outcome['failed'] += 1
+        elif not issue.get('duplicate'):
+            outcome['outage issues' if problem is None else 'other issues'] += 1
+        elif created_for[issue['key']] != problem:
+            outcome['false merges'] += 1
+    timing = signature_time.snapshot()
+    print(f'{len(tickets)} tickets ({args.reports} outage reports) in {secs:.2f}s, threshold {args.threshold:g}')
+    print(f'Jira: {len(mock.issues)} issues, {sum(len(body) for body in mock.comments.values())} comments, '
+          f'{outcome["failed"]} failed')
+    print(f'outage reports: {outcome["outage issues"]} issues, {outcome["outage issues"] - 1} more than one')
+    print(f'other tickets: {outcome["other issues"]} issues for {len({problem for problem, _ in tickets if problem is not None})} problems')
+    print(f'false merges: {outcome["false merges"]}')
+    print(f'signature: {timing["sum"] / timing["count"] * 1e3:.2f}ms mean over {timing["count"]} tickets')
+
+
+if __name__ == '__main__':
+    main()
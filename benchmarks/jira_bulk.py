@@ -0,0 +1,65 @@
+'''
+Compares single issue creation against `/issue/bulk` batching through TicketPipeline.
+
+    python -m benchmarks.jira_bulk --tickets 500 --latency 0.05
+'''
+import argparse
+import threading
+import time
+from benchmarks.mock_jira import MockJira
+from jira_client import JiraClient
+from ticket_pipeline import TicketPipeline
+
+
+def ticket(idx):
+    return {
+        "fields": {
+            "project": {"key": "TEST"},
+            "summary": "I.T",
+            "description": f"Benchmark ticket {idx}",
+            "issuetype": {"name": "Task"},
+        }
+    }
+
+
+def run(mock, tickets, workers, max_batch, max_linger):
+    jira = JiraClient(mock.url, 'bench', 'bench', pool_size = workers)
+    done = threading.Semaphore(0)
+    owners = {}
+
+    def on_done(job, issue, error):
+        owners[job.user_id] = issue['key'] if issue else error
+        done.release()
+
+    calls_before = mock.calls
+    pipeline = TicketPipeline(jira, on_done, workers = workers, max_queue = tickets, max_batch = max_batch, max_linger = max_linger)
+    start = time.perf_counter()
+    for idx in range(tickets):
+        pipeline.submit(ticket(idx), f'U{idx:06d}')
+    for _ in range(tickets):
+        done.acquire()
+    elapsed = time.perf_counter() - start
+    pipeline.stop()
+    jira.close()
+    assert len(owners) == tickets, 'every submitter must get a reply'
+    return elapsed, mock.calls - calls_before
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--tickets', type = int, default = 500)
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--latency', type = float, default = 0.05, help = 'mock Jira latency per call in seconds')
+    parser.add_argument('--batch', type = int, default = 50)
+    parser.add_argument('--linger', type = float, default = 0.05)
+    args = parser.parse_args()
+
+    with MockJira(latency = args.latency) as mock:
+        for name, batch in (('single', 1), ('bulk', args.batch)):
+            elapsed, calls = run(mock, args.tickets, args.workers, batch, args.linger)
+            print(f'{name:>6}: {args.tickets} tickets in {elapsed:.3f}s '
+                  f'({args.tickets / elapsed:.1f} tickets/s, {calls} Jira calls)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+'''
+Offline load test of app.py / app_autoresp.py against local mock Slack and Jira servers.
+
+Payloads are dispatched straight into the Bolt app (`app.dispatch`, Socket Mode style, so
+no signature check), from `--concurrency` client threads. Each simulated user walks its
+flow in order: help desk shortcut -> department -> category typeahead -> category -> submit,
+or DMs a receiver for the auto responder, some receivers being Out of Office.
+
+    python -m benchmarks.load_test --app helpdesk --users 200 --concurrency 8 --slack-latency 0.05 --jira-latency 0.1
+    python -m benchmarks.load_test --app autoresp --users 200 --messages 10
+    python -m benchmarks.load_test --app helpdesk --corpus recorded.jsonl
+    python -m benchmarks.load_test --app autoresp --ratelimit
+    python -m benchmarks.load_test --app autoresp --redeliver 0.2
+    python -m benchmarks.load_test --app autoresp --teams 4 --noisy 0.7 --workers 8
+    python -m benchmarks.load_test --app autoresp --echo --messages 25
+
+`--corpus` replays a JSONL file of {"body": {...}} lines instead, each user's requests in file order.
+The apps' Slack rate limiter (rate_limiter.py) is off unless `--ratelimit` is given, the mock Slack
+then answers calls over the tier limits with 429s, as Slack does.
+`--redeliver` sends that share of the DMs a second time as a Slack retry (`X-Slack-Retry-Num`),
+event_dedup.py should drop them before the listener.
+`--teams` spreads the DMs over several workspaces, `--noisy` of the senders in the first one,
+and reports every listener per team: the listener pool (listener_pool.py) should keep the quiet teams fast.
+`--echo` sends every auto reply back to the app as a message of its receiver, as Slack does, and every
+sender DMs a single receiver: the replies sent must match the reply policy (reply_ledger.py).
+Reported per listener: events, throughput, p50/p99 of ack latency (dispatch returned) and
+end to end latency (every listener the request started has returned), then Slack and Jira calls per event
+'''
+import argparse
+import collections
+import concurrent.futures
+import contextvars
+import importlib
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from slack_bolt import BoltRequest
+from benchmarks.mock_jira import MockJira
+from benchmarks.mock_slack import MockSlack, view_id_for
+from event_dedup import checked, dropped
+from listener_pool import shed, submit_wait
+from instrumentation import listener_key
+from rate_limiter import CHANNEL_METHODS, TIERS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEAM = {'id': 'T0001', 'domain': 'example'}
+
+# Futures of the listeners started by the request being dispatched on this thread
+_pending = contextvars.ContextVar('pending', default = None)
+
+
+def write_config(workdir, slack, jira, departments = 30, categories = 50, catalog_dir = None, ratelimit = False, dedup = False,
+                 listeners = None):
+    '''
+    config.ini and a text catalog in `workdir`, pointing both apps at the mocks.
+    The catalog is synthetic, or a copy of the text files in `catalog_dir`.
+    Duplicate ticket detection is off unless `dedup`, every simulated user reports the same issue.
+    `listeners` -> settings of the `[listeners]` section, eg. {'WORKERS': 8}
+    '''
+    os.makedirs(os.path.join(workdir, 'data'), exist_ok = True)
+    if catalog_dir:
+        shutil.copy(os.path.join(catalog_dir, 'departments.txt'), workdir)
+        with open(os.path.join(catalog_dir, 'departments.txt')) as fp:
+            for name in fp.read().splitlines():
+                shutil.copy(os.path.join(catalog_dir, f'{name}_categories.txt'), workdir)
+    else:
+        names = [f'Dept{d}' for d in range(departments)]
+        with open(os.path.join(workdir, 'departments.txt'), 'w') as fp:
+            fp.write('\n'.join(names) + '\n')
+        for name in names:
+            with open(os.path.join(workdir, f'{name}_categories.txt'), 'w') as fp:
+                fp.write('\n'.join(f'{name} category {c}' for c in range(categories)) + '\n')
+    with open(os.path.join(workdir, 'config.ini'), 'w') as fp:
+        fp.write(f'''[config]
+SLACK_BOT_TOKEN = xoxb-load-test
+SLACK_APP_TOKEN = xapp-load-test
+SLACK_API_URL = {slack.url}
+
+[config2]
+SLACK_CLIENT_ID = 1.1
+SLACK_CLIENT_SECRET = load-test
+SLACK_SIGNING_SECRET = load-test
+SLACK_API_URL = {slack.url}
+
+[jira]
+JIRA_URL = {jira.url}
+JIRA_USERNAME = load-test
+JIRA_TOKEN = load-test
+
+[ratelimit]
+ENABLED = {'yes' if ratelimit else 'no'}
+
+[dedup]
+ENABLED = {'yes' if dedup else 'no'}
+
+[listeners]
+''' + ''.join(f'{key} = {value}\n' for key, value in (listeners or {}).items()))
+
+
+def load_app(name, workdir):
+    '''
+    Imports app.py / app_autoresp.py with `workdir` as the current directory
+    '''
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    module = importlib.import_module({'helpdesk': 'app', 'autoresp': 'app_autoresp'}[name])
+    track_listeners(module.app)
+    return module
+
+
+def track_listeners(app):
+    '''
+    Collects the futures of the listeners each dispatch submits, ack() returns before they finish
+    '''
+    executor = app.listener_runner.listener_executor
+    submit = executor.submit
+
+    def tracked(fn, *args, **kwargs):
+        future = submit(fn, *args, **kwargs)
+        pending = _pending.get()
+        if pending is not None:
+            pending.append(future)
+        return future
+
+    executor.submit = tracked
+
+
+def select_state(block_id, action_id, option):
+    # Slack echoes options back with "emoji": true
+    option = {'text': dict(option['text'], emoji = True), 'value': option['value']}
+    return {block_id: {action_id: {'type': 'static_select', 'selected_option': option}}}, option
+
+
+def helpdesk_flow(user_idx, dept, category):
+    '''
+    Payloads of one user raising a ticket, in order, `dept` and `category` are catalog entries
+    '''
+    user = {'id': f'U{user_idx:06d}', 'username': f'user{user_idx}', 'team_id': TEAM['id']}
+    trigger_id = f'{user_idx}.{int(time.time())}'
+    dept_values, dept_option = select_state('help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action', dept.option)
+    category_values, category_option = select_state(
+        'help_desk_dept_category_list_drop_down_block', 'help_desk_dept_category_list_drop_down_action', category.option
+    )
+
+    def view(values, callback_id = ''):
+        return {'id': view_id_for(trigger_id), 'team_id': TEAM['id'], 'type': 'modal', 'callback_id': callback_id,
+                'hash': '1700000000.abcdef', 'state': {'values': values}}
+
+    description = {'issue_description': {'plain_text_input_action': {'type': 'plain_text_input', 'value': 'Laptop does not boot'}}}
+    return [
+        {'type': 'shortcut', 'callback_id': 'caxe_app_shortcut', 'trigger_id': trigger_id, 'user': user, 'team': TEAM},
+        {'type': 'block_actions', 'user': user, 'team': TEAM, 'trigger_id': trigger_id, 'view': view(dept_values),
+         'actions': [{'type': 'static_select', 'action_id': 'help_desk_dept_drop_down_action',
+                      'block_id': 'help_desk_dept_list_drop_down_block', 'selected_option': dept_option}]},
+        {'type': 'block_suggestion', 'user': user, 'team': TEAM, 'view': view(dept_values),
+         'action_id': 'help_desk_dept_category_list_drop_down_action',
+         'block_id': 'help_desk_dept_category_list_drop_down_block', 'value': category.option['text']['text'].split()[-1]},
+        {'type': 'block_actions', 'user': user, 'team': TEAM, 'trigger_id': trigger_id, 'view': view({**dept_values, **category_values}),
+         'actions': [{'type': 'static_select', 'action_id': 'help_desk_dept_category_list_drop_down_action',
+                      'block_id': 'help_desk_dept_category_list_drop_down_block', 'selected_option': category_option}]},
+        {'type': 'view_submission', 'user': user, 'team': TEAM, 'trigger_id': trigger_id,
+         'view': view({**dept_values, **category_values, **description}, 'create_ticket')},
+    ]
+
+
+def im_channel(sender, receiver):
+    return f'D{sender}{receiver}'
+
+
+def message_event(sender, receiver, seq, team_id = TEAM['id'], author = None, ts = None, text = 'Are you around?'):
+    '''
+    Message of `author` (`sender` when None) in the IM of `sender` and `receiver`, delivered to `receiver`
+    '''
+    return {
+        'type': 'event_callback', 'team_id': team_id, 'api_app_id': 'A0001',
+        'event_id': f'Ev{seq:09d}', 'event_time': int(time.time()),
+        'event': {'type': 'message', 'channel_type': 'im', 'user': author or sender, 'channel': im_channel(sender, receiver),
+                  'text': text, 'ts': ts or f'{time.time():.6f}'},
+        'authorizations': [{'enterprise_id': None, 'team_id': team_id, 'user_id': receiver, 'is_bot': False}],
+    }
+
+
+def team_of(idx, count, teams, noisy):
+    '''
+    Team of the `idx`th of `count` senders or receivers: the first `noisy` share of them in the first team,
+    the others round robin
+    '''
+    if idx < noisy * count or len(teams) == 1:
+        return teams[0]
+    return teams[idx % len(teams)] if not noisy else teams[1 + idx % (len(teams) - 1)]
+
+
+def autoresp_flows(users, messages, receivers, redeliver = 0.0, teams = (TEAM['id'],), noisy = 0.0, single = False):
+    '''
+    Every sender DMs the receivers of its team round robin, `messages` times, or one of them when `single`.
+    Every 1 / `redeliver`th DM is followed by its Slack retry, a (body, headers) pair
+    '''
+    seq = itertools.count()
+    every = round(1 / redeliver) if redeliver else 0
+    per_team = collections.defaultdict(list)
+    for idx, receiver in enumerate(receivers):
+        per_team[team_of(idx, len(receivers), teams, noisy)].append(receiver)
+    flows = []
+    for idx in range(users):
+        team = team_of(idx, users, teams, noisy)
+        mine = per_team[team] or receivers
+        flow = []
+        for n in range(messages):
+            num = next(seq)
+            flow.append(message_event(f'U{idx:06d}', mine[(idx + (0 if single else n)) % len(mine)], num, team))
+            if every and num % every == 0:
+                flow.append((flow[-1], {'x-slack-retry-num': ['1'], 'x-slack-retry-reason': ['http_timeout']}))
+        flows.append(flow)
+    return flows
+
+
+def expected_replies(flows, ooo_users, reply_every):
+    '''
+    Auto replies the reply policy sends for `flows` within a day: the first message of every
+    IM with an Out of Office receiver, then one every `reply_every` messages
+    '''
+    per_channel = collections.Counter(
+        body['event']['channel'] for flow in flows for body in flow
+        if not isinstance(body, tuple) and body['authorizations'][0]['user_id'] in ooo_users
+    )
+    return sum(1 + (count - 1) // reply_every for count in per_channel.values())
+
+
+class Echo:
+    '''
+    MockSlack `on_post` hook sending every auto reply back to `app` as its receiver's message,
+    from another thread and possibly before the app got Slack's answer, as Slack does
+    '''
+    def __init__(self, teams = None):
+        self.app = None
+        self.teams = teams or {}
+        self.seq = itertools.count(10 ** 8)
+        self.pool = concurrent.futures.ThreadPoolExecutor(4)
+        self.futures = []
+
+    def __call__(self, token, args, answer):
+        # Replies are posted with the receiver's user token, to the sender
+        receiver = token.rpartition('xoxp-')[2]
+        if not receiver or self.app is None:
+            return
+        body = message_event(args['channel'], receiver, next(self.seq), self.teams.get(receiver, TEAM['id']),
+                             author = receiver, ts = answer['ts'], text = args.get('text'))
+        self.futures.append(self.pool.submit(self.app.dispatch, BoltRequest(body = body, mode = 'socket_mode')))
+
+    def wait(self):
+        concurrent.futures.wait(self.futures)
+        return len(self.futures)
+
+
+def install_receivers(module, receivers, teams = None):
+    '''
+    `teams` -> {receiver: team_id}, TEAM when left out
+    '''
+    from slack_sdk.oauth.installation_store import Installation
+    for receiver in receivers:
+        module.installation_store.save(Installation(
+            app_id = 'A0001', team_id = (teams or {}).get(receiver, TEAM['id']), user_id = receiver,
+            bot_token = 'xoxb-load-test', bot_id = 'BBOT', bot_user_id = 'UBOT',
+            user_token = f'xoxp-{receiver}', user_scopes = ['chat:write'],
+        ))
+
+
+def corpus_flows(path):
+    '''
+    Recorded bodies grouped per user, keeping the file order within a user
+    '''
+    flows = collections.OrderedDict()
+    with open(path) as fp:
+        for line in fp:
+            if line.strip():
+                body = json.loads(line)['body']
+                user = (body.get('user') or {}).get('id') or body.get('event', {}).get('user')
+                flows.setdefault(user, []).append(body)
+    return list(flows.values())
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def timed_dispatch(app, body, headers = None, label = listener_key):
+    '''
+    Dispatches one request body, returns (label(body), ack secs, end to end secs)
+    '''
+    pending = []
+    _pending.set(pending)
+    start = time.perf_counter()
+    app.dispatch(BoltRequest(body = body, headers = headers, mode = 'socket_mode'))
+    acked = time.perf_counter()
+    concurrent.futures.wait(pending)
+    return label(body), acked - start, time.perf_counter() - start
+
+
+def by_team(body):
+    return f"{listener_key(body)} {body.get('team_id') or (body.get('team') or {}).get('id')}"
+
+
+def run(app, flows, concurrency, label = listener_key):
+    '''
+    Dispatches `flows` from `concurrency` threads, returns ([(label, ack secs, end to end secs)], wall secs)
+    '''
+    samples = []
+    lock = threading.Lock()
+    flows = iter(flows)
+
+    def client():
+        mine = []
+        while True:
+            with lock:
+                flow = next(flows, None)
+            if flow is None:
+                break
+            for body in flow:
+                body, headers = body if isinstance(body, tuple) else (body, None)
+                mine.append(timed_dispatch(app, body, headers, label))
+        with lock:
+            samples.extend(mine)
+
+    threads = [threading.Thread(target = client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def wait_for_tickets(samples, slack, timeout = 60):
+    '''
+    Waits for the ticket workers, they create the issue and DM its key after the submission was acked
+    '''
+    tickets = sum(1 for key, _, _ in samples if key == 'view:create_ticket')
+    deadline = time.monotonic() + timeout
+    while slack.calls['chat.postMessage'] < tickets and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def report(samples, wall, slack, jira):
+    events = len(samples)
+    print(f'{events} events in {wall:.2f}s, {events / wall:.1f} events/s')
+    per_listener = collections.defaultdict(list)
+    for key, ack, total in samples:
+        per_listener[key].append((ack, total))
+    print(f'{"listener":>56} {"events":>7} {"ack p50":>9} {"ack p99":>9} {"e2e p50":>9} {"e2e p99":>9}')
+    for key, values in sorted(per_listener.items()):
+        acks, totals = [ack for ack, _ in values], [total for _, total in values]
+        print(f'{key:>56} {len(values):7d} '
+              f'{percentile(acks, 50) * 1e3:7.1f}ms {percentile(acks, 99) * 1e3:7.1f}ms '
+              f'{percentile(totals, 50) * 1e3:7.1f}ms {percentile(totals, 99) * 1e3:7.1f}ms')
+    print(f'Slack API calls per event: {slack.total_calls() / max(events, 1):.2f} '
+          f'({", ".join(f"{method} {count}" for method, count in slack.calls.most_common())})')
+    if slack.limited:
+        print(f'Slack 429s: {", ".join(f"{method} {count}" for method, count in slack.limited.most_common())}')
+    print(f'Jira calls per event: {jira.calls / max(events, 1):.2f} ({len(jira.issues)} issues created)')
+    seen = sum(checked.snapshot().values())
+    if seen:
+        drops = dropped.snapshot()
+        print(f'Events dropped as already handled: {sum(drops.values())} of {seen} '
+              f'({", ".join(f"{app} {reason} {count}" for (app, reason), count in sorted(drops.items())) or "none"})')
+    held = submit_wait.snapshot()
+    if held['count']:
+        print(f'Listener pool full: {held["count"]} requests held {held["sum"] / held["count"] * 1e3:.1f}ms on average, '
+              f'{sum(shed.snapshot().values())} listeners dropped')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--app', choices = ('helpdesk', 'autoresp'), default = 'helpdesk')
+    parser.add_argument('--users', type = int, default = 200, help = 'simulated users, each walks one flow')
+    parser.add_argument('--messages', type = int, default = 5, help = 'DMs sent per user (autoresp)')
+    parser.add_argument('--receivers', type = int, default = 20, help = 'DM receivers, half of them Out of Office (autoresp)')
+    parser.add_argument('--concurrency', type = int, default = 8, help = 'client threads dispatching at once')
+    parser.add_argument('--departments', type = int, default = 30)
+    parser.add_argument('--categories', type = int, default = 50)
+    parser.add_argument('--slack-latency', type = float, default = 0.05, help = 'seconds per Slack API call')
+    parser.add_argument('--jira-latency', type = float, default = 0.1, help = 'seconds per Jira call')
+    parser.add_argument('--corpus', help = 'JSONL of recorded {"body": ...} requests to replay instead')
+    parser.add_argument('--ratelimit', action = 'store_true', help = 'rate limit the apps, and the mock Slack to the tier limits')
+    parser.add_argument('--redeliver', type = float, default = 0.0, help = 'share of the DMs Slack retries (autoresp)')
+    parser.add_argument('--teams', type = int, default = 1, help = 'workspaces the DMs are spread over (autoresp)')
+    parser.add_argument('--noisy', type = float, default = 0.0, help = 'share of the senders in the first workspace (autoresp)')
+    parser.add_argument('--workers', type = int, help = 'listener pool threads (autoresp)')
+    parser.add_argument('--max-queue', type = int, help = 'listeners waiting at most (autoresp)')
+    parser.add_argument('--max-per-team', type = int, help = 'listeners of one team waiting at most (autoresp)')
+    parser.add_argument('--echo', action = 'store_true', help = 'send every auto reply back as a message event (autoresp)')
+    args = parser.parse_args()
+
+    # The apps read config.ini from the current directory, which moves to the work directory
+    corpus = os.path.abspath(args.corpus) if args.corpus else None
+    receivers = [f'R{idx:05d}' for idx in range(args.receivers)]
+    teams = [TEAM['id']] + [f'T{idx + 1:04d}' for idx in range(1, args.teams)]
+    receiver_teams = {receiver: team_of(idx, len(receivers), teams, args.noisy) for idx, receiver in enumerate(receivers)}
+    listeners = {key: value for key, value in (('WORKERS', args.workers), ('MAX_QUEUE', args.max_queue),
+                                               ('MAX_PER_TEAM', args.max_per_team)) if value is not None}
+    workdir = tempfile.mkdtemp(prefix = 'slackapp-load-')
+    # The mock limits per token only, not per channel
+    limits = {method: per_minute for method, (per_minute, _) in TIERS.items() if method not in CHANNEL_METHODS} if args.ratelimit else None
+    echo = Echo(receiver_teams) if args.echo else None
+    with MockSlack(args.slack_latency, ooo_users = receivers[::2], limits = limits, teams = receiver_teams, on_post = echo) as slack, \
+            MockJira(args.jira_latency) as jira:
+        write_config(workdir, slack, jira, args.departments, args.categories, ratelimit = args.ratelimit, listeners = listeners)
+        module = load_app(args.app, workdir)
+        if args.app == 'autoresp':
+            install_receivers(module, receivers, receiver_teams)
+            if echo is not None:
+                echo.app = module.app
+        if corpus:
+            flows = corpus_flows(corpus)
+        elif args.app == 'helpdesk':
+            departments = list(module.catalogs.current.departments.values())
+            flows = []
+            for idx in range(args.users):
+                dept = departments[idx % len(departments)]
+                flows.append(helpdesk_flow(idx, dept, dept.categories[idx % len(dept.categories)]))
+        else:
+            flows = autoresp_flows(args.users, args.messages, receivers, args.redeliver, teams, args.noisy, single = args.echo)
+        setup_calls = dict(slack.calls)
+        slack.calls.clear()
+
+        samples, wall = run(module.app, flows, args.concurrency, by_team if args.teams > 1 else listener_key)
+        if args.app == 'helpdesk':
+            wait_for_tickets(samples, slack)
+        print(f'workdir {workdir}, startup Slack calls {setup_calls}')
+        report(samples, wall, slack, jira)
+        if echo is not None:
+            sent = echo.wait()
+            expected = expected_replies(flows, set(receivers[::2]), module.ledger.reply_every)
+            print(f'Auto replies: {sent} sent and echoed, {expected} expected by the reply policy'
+                  f'{"" if sent == expected else " MISMATCH"}')
+
+
+if __name__ == '__main__':
+    main()
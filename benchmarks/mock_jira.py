@@ -0,0 +1,229 @@
+'''
+Local stand-in for the Jira REST API used by the benchmarks
+'''
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+from jira_schema import field_problems
+
+PRIORITIES = ('Highest', 'High', 'Medium', 'Low', 'Lowest')
+
+
+def issue_fields():
+    '''
+    Create screen fields of every issue type of the mock, as `createmeta` lists them
+    '''
+    return {
+        'project': {'name': 'Project', 'required': True, 'schema': {'type': 'project'}},
+        'issuetype': {'name': 'Issue Type', 'required': True, 'schema': {'type': 'issuetype'}},
+        'summary': {'name': 'Summary', 'required': True, 'schema': {'type': 'string'}},
+        'description': {'name': 'Description', 'required': False, 'schema': {'type': 'string'}},
+        'priority': {
+            'name': 'Priority', 'required': False, 'hasDefaultValue': True, 'schema': {'type': 'priority'},
+            'allowedValues': [{'id': str(idx), 'name': name} for idx, name in enumerate(PRIORITIES, 1)],
+        },
+        'labels': {'name': 'Labels', 'required': False, 'schema': {'type': 'array', 'items': 'string'}},
+    }
+
+
+# Project key -> its issue types, every one with issue_fields()
+PROJECTS = {'TEST': ('Task', 'Bug', 'Incident')}
+
+
+class MockJira:
+    '''
+    Serves `/rest/api/2/issue/` and `/rest/api/2/issue/bulk` on localhost
+
+    `latency` -> seconds slept before answering every request
+    `issues` -> every issue created, in order
+    `calls` -> number of requests served
+    `outage` -> while set, every request is answered with this status (eg. 503)
+    `lose_answers` -> while set, issues are created but the caller gets a 504, like a proxy timing out
+
+    `/rest/api/2/search` answers `labels = "..."` queries from the created issues,
+    PUT `/rest/api/2/issue/<key>` adds comments (kept in `comments` per key) and labels
+
+    `projects` -> project key -> issue type names, served by `/rest/api/2/issue/createmeta`.
+    An issue in another project or issue type, or with a field its create screen refuses, is
+    answered 400 with Jira's `errors`, counted in `rejected`
+    '''
+    def __init__(self, latency = 0.0, port = 0, projects = None):
+        self.latency = latency
+        self.projects = dict(PROJECTS if projects is None else projects)
+        self.rejected = 0
+        self.createmeta_calls = 0
+        self.outage = None
+        self.lose_answers = False
+        self.issues = []
+        self.comments = {}
+        self.calls = 0
+        self._ids = itertools.count(10000)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/rest/api/2/issue/'
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _errors(self, ticket):
+        '''
+        Jira's `errors` for an issue it refuses, None when it is created
+        '''
+        fields = ticket.get('fields', {})
+        issuetypes = self.projects.get(fields.get('project', {}).get('key'))
+        if issuetypes is None:
+            return {'project': 'valid project is required'}
+        if fields.get('issuetype', {}).get('name') not in issuetypes:
+            return {'issuetype': 'valid issue type is required'}
+        problems = field_problems(fields, issue_fields())
+        return {'fields': '; '.join(problems)} if problems else None
+
+    def _createmeta(self, query):
+        params = dict(parse_qsl(query))
+        keys = [key for key in params.get('projectKeys', '').split(',') if key in self.projects]
+        with self._lock:
+            self.createmeta_calls += 1
+        return {'projects': [
+            {'key': key, 'issuetypes': [{'name': name, 'fields': issue_fields()} for name in self.projects[key]]}
+            for key in keys
+        ]}
+
+    def _create(self, ticket):
+        with self._lock:
+            issue_id = next(self._ids)
+            project = ticket['fields']['project']['key']
+            issue = {
+                'id': str(issue_id),
+                'key': f'{project}-{issue_id}',
+                'self': f'{self.url}{issue_id}',
+            }
+            self.issues.append((issue, ticket))
+        return issue
+
+    def _edit(self, issue_key, update):
+        with self._lock:
+            for issue, ticket in self.issues:
+                if issue['key'] == issue_key:
+                    for op in update.get('comment', []):
+                        self.comments.setdefault(issue_key, []).append(op['add']['body'])
+                    labels = ticket['fields'].setdefault('labels', [])
+                    labels.extend(op['add'] for op in update.get('labels', []))
+                    return True
+        return False
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def _start(self):
+                with mock._lock:
+                    mock.calls += 1
+                if mock.latency:
+                    time.sleep(mock.latency)
+                if mock.outage:
+                    self._body()
+                    self._reply(mock.outage, {'errorMessages': ['Service unavailable']})
+                    return False
+                return True
+
+            def do_POST(self):
+                if not self._start():
+                    return
+                data = self._body()
+                path = self.path.split('?')[0].rstrip('/')
+                if path.endswith('/issue/bulk'):
+                    issues, errors = [], []
+                    for idx, ticket in enumerate(data['issueUpdates']):
+                        refused = mock._errors(ticket)
+                        if refused:
+                            errors.append({'status': 400, 'failedElementNumber': idx, 'elementErrors': {'errors': refused}})
+                        else:
+                            issues.append(mock._create(ticket))
+                    with mock._lock:
+                        mock.rejected += len(errors)
+                    self._answer(400 if errors else 201, {'issues': issues, 'errors': errors})
+                elif path.endswith('/issue'):
+                    refused = mock._errors(data)
+                    if refused:
+                        with mock._lock:
+                            mock.rejected += 1
+                        self._reply(400, {'errorMessages': [], 'errors': refused})
+                    else:
+                        self._answer(201, mock._create(data))
+                else:
+                    self._reply(404, {'errorMessages': [f'No route for {self.path}']})
+
+            def _answer(self, status, data):
+                if mock.lose_answers:
+                    self._reply(504, {'errorMessages': ['Gateway timeout']})
+                elif data is None:
+                    self.send_response(status)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                else:
+                    self._reply(status, data)
+
+            def do_PUT(self):
+                if not self._start():
+                    return
+                data = self._body()
+                issue_key = self.path.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+                if mock._edit(issue_key, data.get('update', {})):
+                    self._answer(204, None)
+                else:
+                    self._reply(404, {'errorMessages': ['Issue does not exist']})
+
+            def do_GET(self):
+                if not self._start():
+                    return
+                path, _, query = self.path.partition('?')
+                if path.rstrip('/').endswith('/issue/createmeta'):
+                    self._reply(200, mock._createmeta(query))
+                    return
+                if not path.rstrip('/').endswith('/search'):
+                    self._reply(404, {'errorMessages': [f'No route for {self.path}']})
+                    return
+                jql = dict(parse_qsl(query)).get('jql', '')
+                match = re.fullmatch(r'labels = "(.*)"', jql)
+                wanted = match.group(1) if match else None
+                with mock._lock:
+                    found = [issue for issue, ticket in mock.issues if wanted in ticket['fields'].get('labels', ())]
+                self._reply(200, {'total': len(found), 'issues': found[:1]})
+
+        return Handler
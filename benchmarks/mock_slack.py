@@ -0,0 +1,167 @@
+'''
+Local stand-in for the Slack Web API methods the apps call, for the benchmarks
+'''
+import collections
+import itertools
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+def view_id_for(trigger_id):
+    '''
+    Id MockSlack gives the view opened with `trigger_id`
+    '''
+    return f'V{trigger_id}' if trigger_id else None
+
+
+class MockSlack:
+    '''
+    Serves `https://slack.com/api/<method>` on localhost, point a WebClient's `base_url` at `url`
+
+    `latency` -> seconds slept before answering every call
+    `ooo_users` -> user ids whose profile status is "Out of Office" (their presence is "away")
+    `calls` -> number of calls served per API method
+    `limits` -> {method: calls per minute} allowed per token, more are answered 429 with Retry-After
+    `limited` -> number of 429s answered per API method
+    `teams` -> {user_id: team_id} of users outside `team_id`
+    `on_post(token, args, answer)` -> called with every message posted before Slack answers,
+        like Slack sending its message event, eg. to dispatch that event to the app
+    '''
+    def __init__(self, latency = 0.0, ooo_users = (), team_id = 'T0001', port = 0, limits = None, teams = None, on_post = None):
+        self.latency = latency
+        self.on_post = on_post
+        self.ooo_users = set(ooo_users)
+        self.team_id = team_id
+        self.teams = dict(teams or {})
+        self.calls = collections.Counter()
+        self.limits = dict(limits or {})
+        self.limited = collections.Counter()
+        # (method, token) -> [window start, calls in the window]
+        self._windows = {}
+        self._view_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/'
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def user(self, user_id):
+        profile = {'real_name': user_id, 'status_text': '', 'status_expiration': 0}
+        if user_id in self.ooo_users:
+            profile['status_text'] = 'Out of Office'
+        return {'id': user_id, 'team_id': self.teams.get(user_id, self.team_id), 'name': user_id.lower(), 'is_owner': False, 'profile': profile}
+
+    def retry_after(self, method, token):
+        '''
+        Seconds to answer with a 429 when the call is over its minute window, None to serve it
+        '''
+        per_minute = self.limits.get(method)
+        if per_minute is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get((method, token))
+            if window is None or now - window[0] >= 60:
+                window = self._windows[(method, token)] = [now, 0]
+            if window[1] < per_minute:
+                window[1] += 1
+                return None
+            self.limited[method] += 1
+            return math.ceil(window[0] + 60 - now)
+
+    def answer(self, method, args):
+        '''
+        Body of the answer to one API call
+        '''
+        if method == 'auth.test':
+            return {'ok': True, 'url': 'https://example.slack.com/', 'team': 'Example', 'user': 'bot',
+                    'team_id': self.team_id, 'user_id': 'UBOT', 'bot_id': 'BBOT'}
+        if method in ('views.open', 'views.push', 'views.update'):
+            view = args.get('view')
+            if isinstance(view, str):
+                view = json.loads(view)
+            # Opened views get their id from the trigger, so a load generator knows it in advance
+            view_id = args.get('view_id') or view_id_for(args.get('trigger_id'))
+            if not view_id:
+                with self._lock:
+                    view_id = f'V{next(self._view_ids):08d}'
+            return {'ok': True, 'view': dict(view or {}, id = view_id, team_id = self.team_id, hash = f'{time.time():.6f}')}
+        if method == 'users.info':
+            return {'ok': True, 'user': self.user(args.get('user'))}
+        if method == 'users.getPresence':
+            return {'ok': True, 'presence': 'away' if args.get('user') in self.ooo_users else 'active'}
+        if method == 'chat.postMessage':
+            return {'ok': True, 'channel': args.get('channel'), 'ts': f'{time.time():.6f}', 'message': {'text': args.get('text')}}
+        return {'ok': True}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _args(self):
+                path, _, query = self.path.partition('?')
+                args = dict(parse_qsl(query))
+                length = int(self.headers.get('Content-Length', 0))
+                if length:
+                    raw = self.rfile.read(length)
+                    if 'json' in self.headers.get('Content-Type', ''):
+                        args.update(json.loads(raw))
+                    else:
+                        args.update(parse_qsl(raw.decode()))
+                return path.rstrip('/').rsplit('/', 1)[-1], args
+
+            def _serve(self):
+                method, args = self._args()
+                with mock._lock:
+                    mock.calls[method] += 1
+                if mock.latency:
+                    time.sleep(mock.latency)
+                token = args.get('token') or self.headers.get('Authorization', '').rpartition(' ')[2]
+                wait = mock.retry_after(method, token)
+                if wait is None:
+                    answer = mock.answer(method, args)
+                    if method == 'chat.postMessage' and mock.on_post is not None:
+                        mock.on_post(token, args, answer)
+                    body = json.dumps(answer).encode()
+                    self.send_response(200)
+                else:
+                    body = json.dumps({'ok': False, 'error': 'ratelimited'}).encode()
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(wait))
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _serve
+
+        return Handler
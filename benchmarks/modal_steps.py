@@ -0,0 +1,123 @@
+'''
+Per-step handler time and views.update payload size of the 3-page help desk flow,
+legacy "patch the echoed blocks" builders against the modal sessions.
+
+    python -m benchmarks.modal_steps --departments 30
+'''
+import argparse
+import copy
+import json
+import timeit
+from catalog import Catalog, Department
+from helpdesk_views import create_block, help_desk_update, help_desk_view, modal, text_input_block, update_args
+from modal_state import HELP_DESK, ModalSessions
+
+
+# Copies of the legacy builders in helpdesk_views.py
+
+def create_initial_options(body, block_name, block_action):
+    option = body['view']['state']['values'][block_name][block_action]['selected_option']
+    return {"text": {"type": "plain_text", "text": option['text']['text']}, "value": option['value']}
+
+def legacy_dept_update(body):
+    prev_blocks = body['view']['blocks']
+    prev_blocks[2]['accessory']['initial_option'] = create_initial_options(body, 'help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action')
+    prev_blocks.append(
+        create_block(
+            "Select the issue category",
+            text2 = "Category",
+            block_id = 'help_desk_dept_category_list_drop_down_block',
+            type1 = 'external_select',
+            action = 'help_desk_dept_category_list_drop_down_action',
+        )
+    )
+    return update_args(body, modal("dept_category_selection", prev_blocks, close = False))
+
+def legacy_category_update(body):
+    prev_blocks = body['view']['blocks']
+    prev_blocks[2]['accessory']['initial_option'] = create_initial_options(body, 'help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action')
+    prev_blocks[3]['accessory']['initial_option'] = create_initial_options(body, 'help_desk_dept_category_list_drop_down_block', 'help_desk_dept_category_list_drop_down_action')
+    prev_blocks.append(text_input_block("issue_description", "Describe your Issue"))
+    return update_args(body, modal("create_ticket", prev_blocks, submit = True))
+
+
+def slack_echo(value):
+    # Slack returns plain_text objects with "emoji": true added
+    if isinstance(value, dict):
+        echoed = {key: slack_echo(item) for key, item in value.items()}
+        if echoed.get('type') == 'plain_text':
+            echoed.setdefault('emoji', True)
+        return echoed
+    if isinstance(value, (list, tuple)):
+        return [slack_echo(item) for item in value]
+    return value
+
+
+def action_body(view, values, action_id, option):
+    '''
+    `block_actions` payload as Slack sends it for `view` after choosing `option`
+    '''
+    view = slack_echo(view)
+    view.update({
+        'id': 'V0001', 'team_id': 'T0001', 'hash': '1700000000.abcdef', 'private_metadata': '',
+        'state': {'values': values}, 'app_id': 'A0001', 'bot_id': 'B0001',
+    })
+    return {
+        'type': 'block_actions', 'user': {'id': 'U0001'}, 'team': {'id': 'T0001', 'domain': 'example'},
+        'view': view, 'actions': [{'action_id': action_id, 'selected_option': slack_echo(option)}],
+    }
+
+
+def selection(block_id, action_id, option):
+    return {block_id: {action_id: {'type': 'static_select', 'selected_option': slack_echo(option)}}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--departments', type = int, default = 30)
+    parser.add_argument('--categories', type = int, default = 100)
+    parser.add_argument('--number', type = int, default = 5000)
+    args = parser.parse_args()
+
+    catalog = Catalog([
+        Department(f'Dept{d}', [f'Category {d}-{c}' for c in range(args.categories)])
+        for d in range(args.departments)
+    ])
+    dept = catalog.department('Dept0')
+    category = dept.categories[0]
+    dept_values = selection('help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action', dept.option)
+    both_values = {
+        **dept_values,
+        **selection('help_desk_dept_category_list_drop_down_block', 'help_desk_dept_category_list_drop_down_action', category.option),
+    }
+
+    # Bodies of step 2 (department chosen) and step 3 (category chosen), as each approach would receive them
+    page1 = help_desk_view(catalog)
+    step2 = action_body(page1, dept_values, 'help_desk_dept_drop_down_action', dept.option)
+    page2 = legacy_dept_update(copy.deepcopy(step2))['view']
+    step3 = action_body(page2, both_values, 'help_desk_dept_category_list_drop_down_action', category.option)
+
+    sessions = ModalSessions()
+    sessions.start('V0001', HELP_DESK)
+    steps = (
+        ('department', step2, legacy_dept_update),
+        ('category', step3, legacy_category_update),
+    )
+    print(f'{args.departments} departments, {args.categories} categories each')
+    for name, body, legacy in steps:
+        # The legacy builders modify the body, each run gets its own copy made beforehand.
+        # Timings include serialising the views.update arguments
+        bodies = iter([copy.deepcopy(body) for _ in range(args.number)])
+        legacy_secs = timeit.timeit(lambda: json.dumps(legacy(next(bodies))), number = args.number) / args.number
+        session_secs = min(timeit.repeat(
+            lambda: json.dumps(help_desk_update(body, sessions, catalog)), number = args.number, repeat = 5
+        )) / args.number
+        # What goes over the wire to views.update
+        legacy_bytes = len(json.dumps(legacy(copy.deepcopy(body))))
+        session_bytes = len(json.dumps(help_desk_update(body, sessions, catalog)))
+        print(f'{name:>10} step: legacy {legacy_secs * 1e6:7.1f} us {legacy_bytes:6d} bytes | '
+              f'session {session_secs * 1e6:7.1f} us {session_bytes:6d} bytes')
+
+
+if __name__ == '__main__':
+    main()
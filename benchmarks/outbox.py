@@ -0,0 +1,89 @@
+'''
+Submission throughput of the durable ticket outbox and delivery through a Jira outage.
+
+Threads submit tickets as the create_ticket listener does, each submit returns once the ticket
+is on disk. Jira then answers 503 for `--outage` seconds and, for `--lost` seconds, creates
+issues but answers 504, so the retries must find them by label instead of creating them twice.
+
+    python -m benchmarks.outbox --tickets 2000 --threads 16 --outage 3 --lost 2
+'''
+import argparse
+import collections
+import os
+import tempfile
+import threading
+import time
+from benchmarks.jira_bulk import ticket
+from benchmarks.mock_jira import MockJira
+from jira_client import JiraClient
+from ticket_outbox import DurableTicketPipeline, TicketOutbox, commit_sizes
+
+
+def submit_all(pipeline, tickets, threads):
+    keys = iter(range(tickets))
+    lock = threading.Lock()
+
+    def submitter():
+        while True:
+            with lock:
+                idx = next(keys, None)
+            if idx is None:
+                return
+            assert pipeline.submit(ticket(idx), f'U{idx:06d}', key = f'bench-{idx}')
+
+    workers = [threading.Thread(target = submitter) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--tickets', type = int, default = 2000)
+    parser.add_argument('--threads', type = int, default = 16, help = 'concurrent submitters, like listener threads')
+    parser.add_argument('--outage', type = float, default = 3, help = 'seconds Jira answers 503')
+    parser.add_argument('--lost', type = float, default = 2, help = 'seconds Jira creates issues but answers 504')
+    parser.add_argument('--latency', type = float, default = 0.02, help = 'seconds per Jira call')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix = 'slackapp-outbox-'), 'outbox.db')
+    delivered = collections.Counter()
+    done = threading.Semaphore(0)
+
+    def on_done(job, issue, error):
+        delivered['created' if issue else 'failed'] += 1
+        done.release()
+
+    with MockJira(args.latency) as mock:
+        # The outbox retries, the client's own retries are turned off to show its behaviour
+        jira = JiraClient(mock.url, 'bench', 'bench', retries = 0)
+        pipeline = DurableTicketPipeline(jira, on_done, TicketOutbox(path), workers = 8, backoff = 0.2, max_backoff = 1)
+
+        mock.outage = 503
+        secs = submit_all(pipeline, args.tickets, args.threads)
+        data = commit_sizes.snapshot()
+        print(f'{args.tickets} submits from {args.threads} threads in {secs:.2f}s: '
+              f'{args.tickets / secs:.0f}/s, {data["count"]} commits, {args.tickets / data["count"]:.1f} tickets per fsync')
+
+        time.sleep(max(0, args.outage - secs))
+        mock.outage = None
+        mock.lose_answers = True
+        print(f'Jira down for {args.outage:g}s, then {args.lost:g}s of lost answers, {pipeline.depth()} tickets waiting')
+        time.sleep(args.lost)
+        mock.lose_answers = False
+
+        start = time.perf_counter()
+        for _ in range(args.tickets):
+            done.acquire()
+        pipeline.stop()
+        labels = collections.Counter(label for _, data in mock.issues for label in data['fields']['labels'])
+        print(f'drained in {time.perf_counter() - start:.2f}s after recovery: {dict(delivered)}, '
+              f'{len(mock.issues)} issues in Jira, {sum(1 for count in labels.values() if count > 1)} duplicated, '
+              f'{pipeline.depth()} left in the outbox')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Replays a traffic capture (traffic_capture.py) into app.py / app_autoresp.py against the mock Slack and Jira servers.
+
+    python -m benchmarks.replay data/capture/requests.jsonl --app helpdesk --speed 1 --catalog /srv/slackapp
+    python -m benchmarks.replay data/capture/requests.jsonl.2 data/capture/requests.jsonl.1 data/capture/requests.jsonl --app autoresp --speed 10
+
+Requests keep their captured spacing divided by `--speed` (0 sends them back to back) and are
+sent open loop, so a Monday morning burst arrives as a burst however slow the handlers are.
+`--catalog` copies the recorded instance's department / category files, captured selections
+refer to its options. Half of the DM receivers found in the capture are Out of Office on the mock
+'''
+import argparse
+import collections
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.load_test import install_receivers, load_app, percentile, report, timed_dispatch, wait_for_tickets, write_config
+from benchmarks.mock_jira import MockJira
+from benchmarks.mock_slack import MockSlack
+
+
+def read_capture(paths, app_name):
+    '''
+    Captured requests of `app_name` from every file in `paths` (eg. a rotated set), oldest first
+    '''
+    records = []
+    for path in paths:
+        with open(path, encoding = 'utf-8') as fp:
+            for line in fp:
+                if line.strip():
+                    record = json.loads(line)
+                    if record.get('app', app_name) == app_name:
+                        records.append(record)
+    records.sort(key = lambda record: record['t'])
+    return records
+
+
+def receivers_of(records):
+    receivers = []
+    for record in records:
+        for authorization in record['body'].get('authorizations') or []:
+            if authorization.get('user_id') and authorization['user_id'] not in receivers:
+                receivers.append(authorization['user_id'])
+    return receivers
+
+
+def peak_rate(records):
+    # Most requests captured within one second
+    per_second = collections.Counter(int(record['t']) for record in records)
+    return max(per_second.values(), default = 0)
+
+
+def replay(app, records, speed, threads):
+    '''
+    Sends `records` on their captured schedule, returns ([(listener, ack secs, end to end secs)], [lag secs], wall secs)
+    '''
+    def send(body, due):
+        lag = time.perf_counter() - due
+        return timed_dispatch(app, body), lag
+
+    first = records[0]['t']
+    futures = []
+    with ThreadPoolExecutor(threads) as pool:
+        start = time.perf_counter()
+        for record in records:
+            due = start + (record['t'] - first) / speed if speed else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send, record['body'], due))
+        results = [future.result() for future in futures]
+    wall = time.perf_counter() - start
+    return [sample for sample, _ in results], [lag for _, lag in results], wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('paths', nargs = '+', help = 'capture files, rotated ones included')
+    parser.add_argument('--app', choices = ('helpdesk', 'autoresp'), default = 'helpdesk')
+    parser.add_argument('--speed', type = float, default = 1.0, help = 'replay speed, 10 -> 10x faster, 0 -> no gaps')
+    parser.add_argument('--threads', type = int, default = 64, help = 'requests in flight at most')
+    parser.add_argument('--catalog', help = 'directory with departments.txt and the category files of the recorded instance')
+    parser.add_argument('--slack-latency', type = float, default = 0.05, help = 'seconds per Slack API call')
+    parser.add_argument('--jira-latency', type = float, default = 0.1, help = 'seconds per Jira call')
+    args = parser.parse_args()
+
+    records = read_capture(args.paths, args.app)
+    if not records:
+        parser.error(f'no {args.app} requests in {", ".join(args.paths)}')
+    span = records[-1]['t'] - records[0]['t']
+    print(f'{len(records)} requests captured over {span:.0f}s, peak {peak_rate(records)}/s, replaying at {args.speed or "max"}x')
+
+    # The apps read config.ini from the current directory, which moves to the work directory
+    catalog = os.path.abspath(args.catalog) if args.catalog else None
+    receivers = receivers_of(records)
+    workdir = tempfile.mkdtemp(prefix = 'slackapp-replay-')
+    with MockSlack(args.slack_latency, ooo_users = receivers[::2]) as slack, MockJira(args.jira_latency) as jira:
+        write_config(workdir, slack, jira, catalog_dir = catalog)
+        module = load_app(args.app, workdir)
+        if args.app == 'autoresp':
+            install_receivers(module, receivers)
+        slack.calls.clear()
+
+        samples, lags, wall = replay(module.app, records, args.speed, args.threads)
+        if args.app == 'helpdesk':
+            wait_for_tickets(samples, slack)
+        print(f'workdir {workdir}')
+        report(samples, wall, slack, jira)
+        print(f'dispatch behind schedule: p50 {percentile(lags, 50) * 1e3:.1f}ms, p99 {percentile(lags, 99) * 1e3:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
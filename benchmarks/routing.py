@@ -0,0 +1,84 @@
+'''
+Ticket routing and local validation against the cached createmeta, offline against the mock Jira.
+
+`--departments` x `--categories` routes are looked up for every ticket, then a ticket Jira
+refuses (issue type not in its project) is sent `--tickets` times with validation on and off.
+
+    python -m benchmarks.routing --tickets 200 --latency 0.05
+
+Reported: route lookup time, createmeta fetches, and how long a refused ticket takes to fail
+locally against the Jira round trip
+'''
+import argparse
+import time
+from benchmarks.mock_jira import MockJira
+from jira_client import JiraClient, JiraRejected
+from ticket_routing import Route, Routes
+
+
+def routes(departments, categories):
+    table = {}
+    for dept in range(departments):
+        table[(f'Dept {dept}', None)] = Route(f'P{dept}', 'Task', None)
+        for category in range(categories):
+            table[(f'Dept {dept}', f'Category {category}')] = Route(f'P{dept}', 'Incident', 'High')
+    return Routes(table)
+
+
+def ticket(idx, route):
+    return {'fields': {**route.fields(), 'summary': f'Dept {idx}', 'description': f'Routing benchmark ticket {idx}'}}
+
+
+def refuse(jira, tickets):
+    '''
+    Seconds per ticket to learn Jira refuses it, every one of `tickets` must be refused
+    '''
+    start = time.perf_counter()
+    for data in tickets:
+        try:
+            jira.create_issue(data)
+        except JiraRejected:
+            pass
+        except Exception as err:
+            # Jira's own 400, without local validation
+            if getattr(getattr(err, 'response', None), 'status_code', None) != 400:
+                raise
+        else:
+            raise AssertionError('ticket was created')
+    return (time.perf_counter() - start) / len(tickets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--departments', type = int, default = 50)
+    parser.add_argument('--categories', type = int, default = 40)
+    parser.add_argument('--tickets', type = int, default = 200)
+    parser.add_argument('--latency', type = float, default = 0.05, help = 'seconds per Jira call')
+    args = parser.parse_args()
+
+    table = routes(args.departments, args.categories)
+    lookups = [(f'dept {idx % args.departments}', f'CATEGORY {idx % (args.categories + 5)}') for idx in range(100000)]
+    start = time.perf_counter()
+    for dept, category in lookups:
+        table.route(dept, category)
+    lookup = (time.perf_counter() - start) / len(lookups)
+
+    # P0 only has Task in the mock, every Incident routed there is refused
+    bad = [ticket(idx, table.route('Dept 0', 'Category 0')) for idx in range(args.tickets)]
+    with MockJira(args.latency, projects = {'P0': ('Task',)}) as mock:
+        remote = refuse(JiraClient(mock.url, 'bench', 'bench', validate = False), bad)
+        rejected = mock.rejected
+        jira = JiraClient(mock.url, 'bench', 'bench')
+        start = time.perf_counter()
+        jira.load_meta(['P0'])
+        fetch = time.perf_counter() - start
+        local = refuse(jira, bad)
+
+    print(f'{args.departments * (args.categories + 1)} routes, lookup {lookup * 1e9:.0f}ns')
+    print(f'refused ticket: {remote * 1e3:.2f}ms through Jira ({rejected} 400s), '
+          f'{local * 1e6:.1f}us locally ({mock.rejected - rejected} 400s)')
+    print(f'createmeta: {mock.createmeta_calls} call, {fetch * 1e3:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''
+Cold start of app.py / app_autoresp.py, offline: import, app build and first request.
+
+Every run starts a fresh interpreter in a work directory whose config.ini points at local
+mock Slack and Jira servers (see load_test.py). It imports the app module, builds the app
+with create_app() and dispatches the first request: the help desk shortcut, or a DM to an
+Out of Office receiver for the auto responder.
+
+    python -m benchmarks.startup --app helpdesk --runs 10 --slack-latency 0.1
+    python -m benchmarks.startup --app helpdesk --verify-token
+
+Reported per phase (p50 and max over the runs): interpreter start, module import, app build,
+ack of the first request and its listener finishing, plus the Slack calls made by then.
+`--verify-token` calls auth.test while building instead of with the first request
+'''
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.load_test import ROOT, percentile, write_config
+from benchmarks.mock_jira import MockJira
+from benchmarks.mock_slack import MockSlack
+
+# Run in the child interpreter, the clock starts before anything is imported
+CHILD = '''
+import time
+started = time.time()
+t0 = time.perf_counter()
+import {module} as module
+imported = time.perf_counter()
+built = module.create_app({verify})
+t1 = time.perf_counter()
+import json
+from benchmarks.load_test import TEAM, install_receivers, message_event, timed_dispatch, track_listeners
+track_listeners(built.app)
+if {autoresp}:
+    install_receivers(built, ['R00000'])
+    body = message_event('U000001', 'R00000', 0)
+else:
+    user = {{'id': 'U000001', 'username': 'user1', 'team_id': TEAM['id']}}
+    body = {{'type': 'shortcut', 'callback_id': 'caxe_app_shortcut', 'trigger_id': '1.1', 'user': user, 'team': TEAM}}
+_, ack, total = timed_dispatch(built.app, body)
+print(json.dumps({{'started': started, 'import': imported - t0, 'build': t1 - imported, 'ack': ack, 'first': total}}))
+'''
+
+PHASES = (
+    ('interpreter', 'interpreter start'),
+    ('import', 'import app module'),
+    ('build', 'create_app()'),
+    ('ack', 'first request acked'),
+    ('first', 'first listener done'),
+    ('total', 'process start -> first ack'),
+)
+
+
+def cold_start(module, workdir, verify, autoresp):
+    '''
+    One run in a new interpreter, returns {phase: seconds}
+    '''
+    code = CHILD.format(module = module, verify = 'token_verification = True' if verify else '', autoresp = autoresp)
+    env = dict(os.environ, PYTHONPATH = ROOT)
+    spawned = time.time()
+    out = subprocess.run([sys.executable, '-c', code], cwd = workdir, env = env, capture_output = True, text = True)
+    if out.returncode:
+        raise RuntimeError(out.stderr)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result['interpreter'] = result.pop('started') - spawned
+    result['total'] = result['interpreter'] + result['import'] + result['build'] + result['ack']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[1])
+    parser.add_argument('--app', choices = ('helpdesk', 'autoresp'), default = 'helpdesk')
+    parser.add_argument('--runs', type = int, default = 10)
+    parser.add_argument('--verify-token', action = 'store_true', help = 'auth.test while building the help desk')
+    parser.add_argument('--slack-latency', type = float, default = 0.1, help = 'seconds per Slack API call')
+    args = parser.parse_args()
+    if args.verify_token and args.app == 'autoresp':
+        parser.error('the auto responder is an OAuth app, its tokens are checked per request')
+
+    module = {'helpdesk': 'app', 'autoresp': 'app_autoresp'}[args.app]
+    workdir = tempfile.mkdtemp(prefix = 'slackapp-startup-')
+    runs = collections.defaultdict(list)
+    calls = collections.Counter()
+    with MockSlack(args.slack_latency, ooo_users = ['R00000']) as slack, MockJira() as jira:
+        write_config(workdir, slack, jira)
+        # The first run also writes the bytecode caches, it is not counted
+        cold_start(module, workdir, args.verify_token, args.app == 'autoresp')
+        for _ in range(args.runs):
+            slack.calls.clear()
+            for phase, secs in cold_start(module, workdir, args.verify_token, args.app == 'autoresp').items():
+                runs[phase].append(secs)
+            calls.update(slack.calls)
+
+    print(f'{args.app}: {args.runs} cold starts, Slack latency {args.slack_latency * 1e3:.0f}ms, '
+          f'token verified {"while building" if args.verify_token else "with the first request"}')
+    print(f'{"phase":>28} {"p50":>9} {"max":>9}')
+    for phase, title in PHASES:
+        print(f'{title:>28} {percentile(runs[phase], 50) * 1e3:7.1f}ms {max(runs[phase]) * 1e3:7.1f}ms')
+    print(f'Slack calls per start: {", ".join(f"{method} {count / args.runs:g}" for method, count in calls.most_common())}')
+
+
+if __name__ == '__main__':
+    main()
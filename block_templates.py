@@ -0,0 +1,104 @@
+'''
+Block Kit fragments compiled once and rendered by filling named slots.
+
+A template is any JSON-like structure with Slot objects in it. Compiling it splits the
+structure into static parts, which every render shares as is, and the paths leading to
+slots, which are the only dicts and lists rebuilt per render. Key order is kept, so a
+render serialises exactly like the same structure built by hand.
+
+Rendered views share their static parts with the template and with each other, they
+must be treated as read only (json.dumps, the Slack clients and Bolt's `ack` only read them)
+'''
+
+class Slot:
+    '''
+    A hole in a template, filled from the render keyword of the same `name`.
+    `optional` -> the key holding the slot is left out when the value is missing or None
+    `convert` -> applied to the value before it is inserted
+    '''
+    __slots__ = ('name', 'optional', 'convert')
+
+    def __init__(self, name, optional = False, convert = None):
+        self.name = name
+        self.optional = optional
+        self.convert = convert
+
+
+class Template:
+    '''
+    `Template(fragment).render(**values)` -> `fragment` with every Slot replaced by its value.
+    The fragment is compiled into nested builder functions that rebuild the dicts and lists
+    on the way to a slot and return everything else as the shared original
+    '''
+    __slots__ = ('fragment', 'slots', '_render')
+
+    def __init__(self, fragment):
+        self.fragment = fragment
+        self.slots = set()
+        self._render = self._compile(fragment)
+
+    def render(self, **values):
+        return self._render(values)
+
+    def _compile(self, node):
+        '''
+        Function building `node` from the render values. Dicts and lists on the way to a slot
+        are copied from a prebuilt one holding the static parts, only their slots are filled per render
+        '''
+        if not _has_slot(node):
+            return lambda values: node
+        if isinstance(node, Slot):
+            self.slots.add(node.name)
+            name, convert = node.name, node.convert
+            get = (lambda values: values.get(name)) if node.optional else (lambda values: values[name])
+            if convert is None:
+                return get
+            return lambda values: convert(get(values))
+        if isinstance(node, dict):
+            # Every key in place, so filling the copy keeps the key order
+            base = {key: None if _has_slot(value) else value for key, value in node.items()}
+            required, optional, nested = [], [], []
+            for key, value in node.items():
+                if isinstance(value, Slot) and value.optional:
+                    self.slots.add(value.name)
+                    optional.append((key, value.name, value.convert))
+                elif isinstance(value, Slot) and value.convert is None:
+                    self.slots.add(value.name)
+                    required.append((key, value.name))
+                elif _has_slot(value):
+                    nested.append((key, self._compile(value)))
+
+            def build(values):
+                out = base.copy()
+                for key, name in required:
+                    out[key] = values[name]
+                for key, name, convert in optional:
+                    value = values.get(name)
+                    if value is None:
+                        del out[key]
+                    else:
+                        out[key] = value if convert is None else convert(value)
+                for key, part in nested:
+                    out[key] = part(values)
+                return out
+            return build
+        base = [None if _has_slot(value) else value for value in node]
+        nested = [(index, self._compile(value)) for index, value in enumerate(node) if _has_slot(value)]
+
+        def build(values):
+            out = base.copy()
+            for index, part in nested:
+                out[index] = part(values)
+            return out
+        return build
+
+
+def _has_slot(node):
+    if isinstance(node, Slot):
+        return True
+    if isinstance(node, dict):
+        return any(_has_slot(value) for value in node.values())
+    if isinstance(node, (list, tuple)):
+        return any(_has_slot(value) for value in node)
+    return False
+
@@ -0,0 +1,244 @@
+import itertools
+import threading
+import time
+from catalog_store import TextFileStore
+from category_index import CategoryIndex, MAX_SUGGESTIONS
+
+_versions = itertools.count(1)
+
+
+def _option(text, value):
+    '''
+    Slack option object, same shape as `create_field` in app.py
+    '''
+    return {
+        "text": {
+            "type": "plain_text",
+            "text": text,
+        },
+        "value": value
+    }
+
+
+class Category:
+    '''
+    An issue category of a department
+    `option` -> ready to send Slack option for this category
+    '''
+    __slots__ = ('name', 'value', 'option', 'department')
+
+    def __init__(self, department, name):
+        self.department = department
+        self.name = name
+        self.value = f'{department}_category_{name}'
+        self.option = _option(name, self.value)
+
+
+class Department:
+    '''
+    A help desk department with its categories
+    `option` -> ready to send Slack option for the department
+    `category_options` -> ready to send Slack options for all its categories
+    '''
+    __slots__ = ('name', 'value', 'option', 'categories', 'category_options', 'by_value', '_index')
+
+    def __init__(self, name, categories, _built = None):
+        self.name = name
+        self.value = f'dept_{name}'
+        self.option = _option(name, self.value)
+        if _built is None:
+            _built = tuple(Category(name, category) for category in categories)
+        self.categories = _built
+        self.category_options = tuple(category.option for category in self.categories)
+        by_value = {}
+        for category in self.categories:
+            by_value.setdefault(category.value, category)
+        self.by_value = by_value
+        self._index = None
+
+    def search(self, query, limit = MAX_SUGGESTIONS):
+        '''
+        Typeahead over the category options, the index is built on first use and
+        lives as long as this (immutable) Department
+        '''
+        if self._index is None:
+            self._index = CategoryIndex((category.name, category.option) for category in self.categories)
+        return self._index.search(query, limit)
+
+    def category_names(self):
+        return [category.name for category in self.categories]
+
+    def with_categories(self, names):
+        '''
+        New Department with `names` appended, existing Category entries are reused
+        '''
+        existing = {category.name for category in self.categories}
+        added = []
+        for name in names:
+            if name not in existing:
+                existing.add(name)
+                added.append(Category(self.name, name))
+        return Department(self.name, None, self.categories + tuple(added))
+
+    def without_category(self, name):
+        '''
+        New Department without the first category called `name`
+        '''
+        for idx, category in enumerate(self.categories):
+            if category.name == name:
+                return Department(self.name, None, self.categories[:idx] + self.categories[idx + 1:])
+        raise KeyError(name)
+
+
+class Catalog:
+    '''
+    Immutable snapshot of all departments and categories.
+    Every option payload is built once when the snapshot is created, handlers only read them.
+
+    `department_options` -> Slack options for the department drop down
+    `department(name)` -> Department by name in O(1)
+    `lookup(value)` -> Department or Category by Slack option `value` in O(1)
+    '''
+    __slots__ = ('version', 'departments', 'department_options', '_dept_by_value')
+
+    def __init__(self, departments, _department_options = None):
+        self.version = next(_versions)
+        self.departments = {dept.name: dept for dept in departments}
+        if _department_options is None:
+            _department_options = tuple(dept.option for dept in self.departments.values())
+        self.department_options = _department_options
+        self._dept_by_value = {dept.value: dept for dept in self.departments.values()}
+
+    @classmethod
+    def load(cls, store):
+        '''
+        Builds a snapshot from everything in `store` (see catalog_store.py)
+        '''
+        return cls(Department(dept_name, categories) for dept_name, categories in store.load())
+
+    def department(self, name):
+        return self.departments[name]
+
+    def lookup(self, value):
+        dept = self._dept_by_value.get(value)
+        if dept is not None:
+            return dept
+        # Category values are `{dept}_category_{name}`
+        idx = value.find('_category_')
+        while idx != -1:
+            dept = self.departments.get(value[:idx])
+            if dept is not None and value in dept.by_value:
+                return dept.by_value[value]
+            idx = value.find('_category_', idx + 1)
+        raise KeyError(value)
+
+    def replace_department(self, dept):
+        '''
+        Copy on write, new snapshot with `dept` swapped in. Other departments and the
+        department option list are shared with this snapshot
+        '''
+        departments = dict(self.departments)
+        departments[dept.name] = dept
+        return Catalog(departments.values(), self.department_options)
+
+    def with_departments(self, names):
+        departments = dict(self.departments)
+        for name in names:
+            if name not in departments:
+                departments[name] = Department(name, ())
+        return Catalog(departments.values())
+
+    def without_department(self, name):
+        departments = dict(self.departments)
+        del departments[name]
+        return Catalog(departments.values())
+
+    def __len__(self):
+        return len(self.departments)
+
+
+class LiveCatalog:
+    '''
+    Holds the current Catalog snapshot and applies admin edits to it.
+
+    Readers just take `live.current`, it is always a complete snapshot. Writers are
+    serialised by a lock, persist the single edit through `store`, build the next
+    snapshot copy on write and then publish it with a single reference swap.
+
+    With `refresh_interval` set and a `shared` store, `current` asks the store at most that
+    often whether another process edited the catalog and reloads it if so, which keeps the
+    workers of a multi-process server (service.py) consistent on the SQLite backend. The
+    check is skipped while a writer holds the lock, a reader never waits for it
+    '''
+    def __init__(self, store = None, refresh_interval = None):
+        self.store = store or TextFileStore()
+        # Only a store other processes can edit needs checking
+        self.refresh_interval = refresh_interval if self.store.shared else None
+        self._lock = threading.Lock()
+        self._current = Catalog.load(self.store)
+        self._next_refresh = 0.0
+
+    @classmethod
+    def from_config(cls, store, configur, section = 'catalog'):
+        return cls(store, refresh_interval = configur.getfloat(section, "REFRESH_SECONDS", fallback = 1.0))
+
+    @property
+    def current(self):
+        if self.refresh_interval is not None and time.monotonic() >= self._next_refresh and self._lock.acquire(blocking = False):
+            try:
+                self._refresh()
+            finally:
+                self._lock.release()
+        return self._current
+
+    def _refresh(self):
+        # Called with the lock held
+        self._next_refresh = time.monotonic() + (self.refresh_interval or 0)
+        if self.store.changed():
+            self._current = Catalog.load(self.store)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self.store.after_fork()
+
+    def add_departments(self, names):
+        with self._lock:
+            self._refresh()
+            old = self._current
+            new_names = [name for name in dict.fromkeys(names) if name not in old.departments]
+            if not new_names:
+                return old
+            catalog = old.with_departments(new_names)
+            self.store.add_departments(new_names)
+            self._current = catalog
+            return catalog
+
+    def remove_department(self, name):
+        with self._lock:
+            self._refresh()
+            catalog = self._current.without_department(name)
+            self.store.remove_department(name)
+            self._current = catalog
+            return catalog
+
+    def add_categories(self, dept_name, names):
+        with self._lock:
+            self._refresh()
+            old = self._current
+            before = old.department(dept_name)
+            dept = before.with_categories(names)
+            added = [category.name for category in dept.categories[len(before.categories):]]
+            if not added:
+                return old
+            self.store.add_categories(dept_name, added)
+            self._current = old.replace_department(dept)
+            return self._current
+
+    def remove_category(self, dept_name, name):
+        with self._lock:
+            self._refresh()
+            old = self._current
+            dept = old.department(dept_name).without_category(name)
+            self.store.remove_category(dept_name, name)
+            self._current = old.replace_department(dept)
+            return self._current
@@ -0,0 +1,274 @@
+'''
+Persistent storage backends for the department/category catalog.
+
+    python catalog_store.py migrate --base-dir . --db data/catalog.db
+'''
+import abc
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+
+def write_atomic(path, lines):
+    '''
+    Writes `lines` to a temp file next to `path` and renames it over `path`,
+    readers see either the old or the new file, never a half written one
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir = directory, prefix = '.tmp_', suffix = '.txt')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            for line in lines:
+                fp.write(line + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CatalogStore(abc.ABC):
+    '''
+    Interface of a catalog backend. `load` returns [(department, [categories])] in display order,
+    the other methods persist a single edit. `shared` backends can be edited by other processes,
+    LiveCatalog only polls those for changes
+    '''
+    shared = False
+
+    @abc.abstractmethod
+    def load(self):
+        pass
+
+    @abc.abstractmethod
+    def add_departments(self, names):
+        '''
+        Appends the departments not in the catalog yet, the ones already there keep their categories
+        '''
+
+    @abc.abstractmethod
+    def remove_department(self, name):
+        pass
+
+    @abc.abstractmethod
+    def add_categories(self, dept_name, names):
+        pass
+
+    @abc.abstractmethod
+    def remove_category(self, dept_name, name):
+        pass
+
+    def changed(self):
+        '''
+        True when another process edited the catalog since the last call
+        '''
+        return False
+
+    def after_fork(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TextFileStore(CatalogStore):
+    '''
+    The original layout, `departments.txt` plus one `{dept}_categories.txt` per department
+    '''
+    def __init__(self, base_dir = '.'):
+        self.base_dir = base_dir
+
+    def _path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    def _read(self, name):
+        with open(self._path(name), 'r') as fp:
+            return fp.read().splitlines()
+
+    def load(self):
+        return [
+            (dept_name, self._read(f'{dept_name}_categories.txt'))
+            for dept_name in self._read('departments.txt')
+        ]
+
+    def add_departments(self, names):
+        departments = self._read('departments.txt')
+        added = [name for name in dict.fromkeys(names) if name not in departments]
+        for name in added:
+            # A file left from an earlier department of the same name is kept, as its categories
+            if not os.path.exists(self._path(f'{name}_categories.txt')):
+                write_atomic(self._path(f'{name}_categories.txt'), [])
+        write_atomic(self._path('departments.txt'), departments + added)
+
+    def remove_department(self, name):
+        departments = self._read('departments.txt')
+        departments.remove(name)
+        write_atomic(self._path('departments.txt'), departments)
+        os.remove(self._path(f'{name}_categories.txt'))
+
+    def add_categories(self, dept_name, names):
+        file_name = f'{dept_name}_categories.txt'
+        write_atomic(self._path(file_name), self._read(file_name) + list(names))
+
+    def remove_category(self, dept_name, name):
+        file_name = f'{dept_name}_categories.txt'
+        categories = self._read(file_name)
+        categories.remove(name)
+        write_atomic(self._path(file_name), categories)
+
+
+class SQLiteStore(CatalogStore):
+    '''
+    Indexed SQLite backend in WAL mode. Every edit is one small transaction, so several
+    processes can share the file without rewriting it
+    '''
+    shared = True
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS departments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            department_id INTEGER NOT NULL REFERENCES departments(id) ON DELETE CASCADE,
+            name TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS categories_by_department ON categories (department_id, name);
+    '''
+
+    def __init__(self, path = 'data/catalog.db'):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok = True)
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread = False, isolation_level = None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA foreign_keys=ON')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.executescript(self.SCHEMA)
+        self._data_version = self._read_data_version()
+
+    def _read_data_version(self):
+        # Changes whenever another connection commits, our own writes leave it alone
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _transaction(self, statements):
+        '''
+        Runs [(sql, params)] in one IMMEDIATE transaction
+        '''
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                for sql, params in statements:
+                    cur.execute(sql, params)
+                cur.execute('COMMIT')
+            except BaseException:
+                # A failed COMMIT (busy, disk full) leaves the transaction open on the shared connection
+                if self.conn.in_transaction:
+                    cur.execute('ROLLBACK')
+                raise
+
+    def load(self):
+        with self._lock:
+            departments = self.conn.execute('SELECT id, name FROM departments ORDER BY id').fetchall()
+            rows = self.conn.execute('SELECT department_id, name FROM categories ORDER BY id').fetchall()
+        categories = {dept_id: [] for dept_id, _ in departments}
+        for dept_id, name in rows:
+            categories[dept_id].append(name)
+        return [(name, categories[dept_id]) for dept_id, name in departments]
+
+    def add_departments(self, names):
+        self._transaction([
+            ('INSERT OR IGNORE INTO departments (name) VALUES (?)', (name,))
+            for name in names
+        ])
+
+    def remove_department(self, name):
+        self._transaction([('DELETE FROM departments WHERE name = ?', (name,))])
+
+    def add_categories(self, dept_name, names):
+        self._transaction([
+            ('INSERT INTO categories (department_id, name) SELECT id, ? FROM departments WHERE name = ?', (name, dept_name))
+            for name in names
+        ])
+
+    def remove_category(self, dept_name, name):
+        # Only the first match, same as `list.remove` on the text files
+        self._transaction([(
+            '''DELETE FROM categories WHERE id = (
+                SELECT categories.id FROM categories JOIN departments ON departments.id = categories.department_id
+                WHERE departments.name = ? AND categories.name = ? ORDER BY categories.id LIMIT 1
+            )''',
+            (dept_name, name)
+        )])
+
+    def changed(self):
+        with self._lock:
+            version = self._read_data_version()
+            changed = version != self._data_version
+            self._data_version = version
+        return changed
+
+    def after_fork(self):
+        '''
+        SQLite connections must not be used across fork, the child opens its own.
+        The inherited one is left unclosed on purpose, closing it could release the parent's locks
+        '''
+        self._lock = threading.Lock()
+        self._connect()
+
+    def close(self):
+        self.conn.close()
+
+
+def open_store(configur, section = 'catalog'):
+    '''
+    Picks the backend from the `[catalog]` section of config.ini, text files by default
+    '''
+    backend = configur.get(section, "BACKEND", fallback = 'text')
+    if backend == 'sqlite':
+        return SQLiteStore(configur.get(section, "SQLITE_PATH", fallback = 'data/catalog.db'))
+    return TextFileStore(configur.get(section, "BASE_DIR", fallback = '.'))
+
+
+def migrate(source, target):
+    '''
+    One shot copy of every department and category from `source` into `target`
+    '''
+    for dept_name, categories in source.load():
+        target.add_departments([dept_name])
+        target.add_categories(dept_name, categories)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Catalog store tools')
+    parser.add_argument('command', choices = ['migrate'])
+    parser.add_argument('--base-dir', default = '.', help = 'directory with departments.txt')
+    parser.add_argument('--db', default = 'data/catalog.db', help = 'SQLite file to create')
+    args = parser.parse_args(argv)
+    target = SQLiteStore(args.db)
+    try:
+        if target.load():
+            raise SystemExit(f'{args.db} already has a catalog, refusing to migrate twice')
+        migrate(TextFileStore(args.base_dir), target)
+        print(f'Migrated {len(target.load())} departments into {args.db}')
+    finally:
+        target.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import heapq
+import re
+from bisect import bisect_left
+
+# Slack accepts at most 100 options in an `external_select` answer
+MAX_SUGGESTIONS = 50
+# Fuzzy word matches below this trigram similarity are noise
+MIN_FUZZY_SCORE = 0.4
+
+_words = re.compile(r'\w+')
+
+
+def _trigrams(text):
+    text = f'  {text} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CategoryIndex:
+    '''
+    Typeahead index over the categories of one department.
+
+    Prefix queries are answered from sorted (key, id) arrays with a binary search, one
+    for whole names and one for every later word of a name. Fuzzy matches (typos) go
+    through a trigram index over the distinct words, which stays small however many
+    categories share them.
+    `items` -> iterable of (name, payload), `search` returns the payloads
+    '''
+    def __init__(self, items):
+        self.payloads = []
+        name_keys = []
+        word_keys = []
+        postings = {}
+        for idx, (name, payload) in enumerate(items):
+            lowered = name.lower()
+            self.payloads.append(payload)
+            name_keys.append((lowered, idx))
+            words = _words.findall(lowered)
+            for word in words[1:]:
+                word_keys.append((word, idx))
+            for word in set(words):
+                postings.setdefault(word, []).append(idx)
+        name_keys.sort()
+        word_keys.sort()
+        self.name_keys = name_keys
+        self.word_keys = word_keys
+        self.postings = postings
+        grams = {}
+        for word in postings:
+            for gram in _trigrams(word):
+                grams.setdefault(gram, []).append(word)
+        self.grams = grams
+
+    @staticmethod
+    def _prefix(keys, query, limit, seen, out):
+        pos = bisect_left(keys, (query,))
+        while pos < len(keys) and len(out) < limit:
+            key, idx = keys[pos]
+            if not key.startswith(query):
+                break
+            if idx not in seen:
+                seen.add(idx)
+                out.append(idx)
+            pos += 1
+
+    def _similar_words(self, token):
+        '''
+        {word: score} for the indexed words close to `token`
+        '''
+        grams = _trigrams(token)
+        shared = {}
+        for gram in grams:
+            for word in self.grams.get(gram, ()):
+                shared[word] = shared.get(word, 0) + 1
+        similar = {}
+        for word, count in shared.items():
+            # Dice coefficient over the trigram sets
+            score = 2 * count / (len(grams) + len(word) + 1)
+            if score >= MIN_FUZZY_SCORE:
+                similar[word] = score
+        return similar
+
+    def _fuzzy(self, query, limit, seen, out):
+        scores = {}
+        for token in _words.findall(query):
+            best = {}
+            for word, score in self._similar_words(token).items():
+                for idx in self.postings[word]:
+                    if score > best.get(idx, 0):
+                        best[idx] = score
+            for idx, score in best.items():
+                scores[idx] = scores.get(idx, 0) + score
+        ranked = heapq.nsmallest(
+            limit - len(out),
+            ((-score, idx) for idx, score in scores.items() if idx not in seen),
+        )
+        out.extend(idx for _, idx in ranked)
+
+    def search(self, query, limit = MAX_SUGGESTIONS):
+        '''
+        Top `limit` payloads for `query`, whole name prefixes first, then word prefixes, then fuzzy matches
+        '''
+        query = query.strip().lower()
+        if not query:
+            return self.payloads[:limit]
+        seen = set()
+        out = []
+        self._prefix(self.name_keys, query, limit, seen, out)
+        self._prefix(self.word_keys, query, limit, seen, out)
+        if len(out) < limit:
+            self._fuzzy(query, limit, seen, out)
+        return [self.payloads[idx] for idx in out]
@@ -0,0 +1,313 @@
+'''
+Drops Slack events that were already handled, before any listener runs.
+
+Slack redelivers an event it got no answer to within 3 seconds (`X-Slack-Retry-Num` header)
+and, with both user and bot event subscriptions, can deliver the same message twice under two
+event ids. Every event is recorded by its `event_id` and, for messages, its `client_msg_id`;
+a later event matching either is acknowledged and dropped.
+
+An event is only claimed for `LEASE_SECONDS` when it arrives, and remembered for `TTL_MINUTES`
+once the app answered Slack. When handling it fails the claim is dropped, when the process
+dies the claim lapses: either way Slack's next retry is handled instead of dropped.
+
+    # config.ini, optional
+    [events]
+    DEDUP = yes
+    # How long an event is remembered, Slack retries within minutes
+    TTL_MINUTES = 60
+    LEASE_SECONDS = 30
+    MAX_ENTRIES = 100000
+    # sqlite: one seen-set for every worker process (service.py) in SEEN_PATH
+    BACKEND = memory
+    SEEN_PATH = data/events.db
+'''
+import asyncio
+import collections
+import functools
+import math
+import os
+import sqlite3
+import threading
+import time
+from slack_bolt import BoltResponse
+import metrics
+
+checked = metrics.counter('slack_events_checked_total', 'Events looked up in the seen-set', labels = ('app',))
+dropped = metrics.counter('slack_events_dropped_total', 'Events dropped as already handled', labels = ('app', 'reason'))
+
+RETRY_HEADER = 'x-slack-retry-num'
+# Seconds an event being handled stays claimed, Slack retries after 3 seconds, then 1 and 5 minutes
+LEASE = 30
+
+
+def event_keys(name, body):
+    '''
+    Keys identifying the event in `body`, () for requests that are not events.
+    `name` keeps the apps apart, both can be sent the same message
+    '''
+    if body.get('type') != 'event_callback':
+        return ()
+    keys = []
+    if body.get('event_id'):
+        keys.append(f"{name}:ev:{body['event_id']}")
+    event = body.get('event') or {}
+    if event.get('type') == 'message' and event.get('client_msg_id'):
+        keys.append(f"{name}:msg:{body.get('team_id')}:{event['client_msg_id']}")
+    return keys
+
+
+def is_retry(headers):
+    # Bolt lower cases the header names, every value is a list
+    return bool(headers.get(RETRY_HEADER))
+
+
+class SeenEvents:
+    '''
+    Keys seen within the last `ttl` seconds, at most `max_entries` of them, oldest evicted first.
+    first() claims new keys for `lease` seconds only, handled() keeps them for `ttl` and
+    release() forgets them. A claim is stored as seen `ttl - lease` seconds ago
+    '''
+    def __init__(self, ttl = 3600, max_entries = 100000, lease = LEASE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lease = min(lease, ttl)
+        # key -> monotonic time seen, claims backdated, least recently recorded first
+        self._seen = collections.OrderedDict()
+        self._lock = threading.Lock()
+        metrics.gauge('slack_events_seen', 'Event keys remembered for deduplication', lambda: len(self))
+
+    def __len__(self):
+        return len(self._seen)
+
+    def first(self, keys):
+        '''
+        Claims `keys`, returns False when one of them was seen or is claimed already
+        '''
+        now = time.monotonic()
+        with self._lock:
+            while self._seen and now - next(iter(self._seen.values())) >= self.ttl:
+                self._seen.popitem(last = False)
+            # Claims are not in time order, a lapsed one can sit behind live entries
+            if any(now - self._seen.get(key, -math.inf) < self.ttl for key in keys):
+                return False
+            self._record(keys, now - self.ttl + self.lease)
+        return True
+
+    def _record(self, keys, at):
+        for key in keys:
+            self._seen[key] = at
+            self._seen.move_to_end(key)
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last = False)
+
+    def handled(self, keys):
+        '''
+        Slack got its answer for the event claimed under `keys`, repeats are dropped for `ttl`
+        '''
+        with self._lock:
+            self._record(keys, time.monotonic())
+
+    def release(self, keys):
+        '''
+        Handling the event claimed under `keys` failed, Slack's retry of it gets handled
+        '''
+        with self._lock:
+            for key in keys:
+                self._seen.pop(key, None)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+
+class SharedSeenEvents(SeenEvents):
+    '''
+    SeenEvents in a SQLite file (WAL), every worker process drops what another one handled.
+    Times are wall clock, expired keys are purged once a minute by whichever worker records one
+    '''
+    def __init__(self, path = 'data/events.db', ttl = 3600, max_entries = 100000, lease = LEASE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lease = min(lease, ttl)
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        self._connect()
+        metrics.gauge('slack_events_seen', 'Event keys remembered for deduplication', lambda: len(self))
+
+    def _connect(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread = False, isolation_level = None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS seen (
+                key TEXT PRIMARY KEY,
+                at REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS seen_at ON seen (at)')
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def first(self, keys):
+        now = time.time()
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                marks = ','.join('?' * len(keys))
+                if cur.execute(f'SELECT 1 FROM seen WHERE key IN ({marks}) AND at > ?', (*keys, now - self.ttl)).fetchone():
+                    cur.execute('ROLLBACK')
+                    return False
+                claimed = now - self.ttl + self.lease
+                cur.executemany('INSERT OR REPLACE INTO seen (key, at) VALUES (?, ?)', [(key, claimed) for key in keys])
+                if now - self._purged_at >= 60:
+                    self._purged_at = now
+                    cur.execute('DELETE FROM seen WHERE at <= ?', (now - self.ttl,))
+                    cur.execute('DELETE FROM seen WHERE key IN (SELECT key FROM seen ORDER BY at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+                cur.execute('COMMIT')
+            except BaseException:
+                if self.conn.in_transaction:
+                    cur.execute('ROLLBACK')
+                raise
+        return True
+
+    def handled(self, keys):
+        now = time.time()
+        with self._lock:
+            self.conn.executemany('INSERT OR REPLACE INTO seen (key, at) VALUES (?, ?)', [(key, now) for key in keys])
+
+    def release(self, keys):
+        with self._lock:
+            self.conn.executemany('DELETE FROM seen WHERE key = ?', [(key,) for key in keys])
+
+    def after_fork(self):
+        '''
+        SQLite connections must not be used across fork, the child opens its own
+        '''
+        self._lock = threading.Lock()
+        self._connect()
+
+
+# One seen-set per process, app.py and app_autoresp.py share it when both run in service.py
+_seen = None
+
+
+def open_seen(configur, section = 'events'):
+    '''
+    Seen-set from the `[events]` section of config.ini, None when `DEDUP` is off
+    '''
+    global _seen
+    if not configur.getboolean(section, "DEDUP", fallback = True):
+        return None
+    if _seen is None:
+        ttl = configur.getfloat(section, "TTL_MINUTES", fallback = 60) * 60
+        max_entries = configur.getint(section, "MAX_ENTRIES", fallback = 100000)
+        lease = configur.getfloat(section, "LEASE_SECONDS", fallback = LEASE)
+        if configur.get(section, "BACKEND", fallback = 'memory') == 'sqlite':
+            _seen = SharedSeenEvents(configur.get(section, "SEEN_PATH", fallback = 'data/events.db'), ttl, max_entries, lease)
+        else:
+            _seen = SeenEvents(ttl, max_entries, lease)
+    return _seen
+
+
+def after_fork():
+    if _seen is not None:
+        _seen.after_fork()
+
+
+def _drop(name, seen, req):
+    '''
+    True when the request is an event handled before, counted by why it came again.
+    Otherwise the event is claimed, its keys are kept in the request context for _finish()
+    '''
+    keys = event_keys(name, req.body)
+    if not keys:
+        return False
+    checked.labels(name).inc()
+    if seen.first(keys):
+        req.context['event_keys'] = keys
+        return False
+    dropped.labels(name, 'retry' if is_retry(req.headers) else 'duplicate').inc()
+    return True
+
+
+def _finish(seen, req, resp):
+    '''
+    Keeps the event claimed by `req` once Slack is answered with `resp`, releases it when
+    dispatching failed so Slack's retry is handled
+    '''
+    keys = req.context.get('event_keys')
+    if not keys:
+        return
+    if resp is not None and resp.status < 500:
+        seen.handled(keys)
+    else:
+        seen.release(keys)
+
+
+def dedupe(app, name, configur):
+    '''
+    Acknowledges and drops events `app` handled already, unless `[events] DEDUP` is off.
+    `name` keeps the events of the apps apart in a shared seen-set
+    '''
+    seen = open_seen(configur)
+    if seen is None:
+        return None
+
+    @app.middleware
+    def drop_duplicate_events(req, next):
+        if _drop(name, seen, req):
+            # Slack only needs the 200, no listener runs
+            return BoltResponse(status = 200, body = "")
+        next()
+
+    # Bolt's middleware cannot see the response, the claim is settled once dispatch returns it
+    dispatch = app.dispatch
+
+    @functools.wraps(dispatch)
+    def dispatch_once(req):
+        resp = None
+        try:
+            resp = dispatch(req)
+            return resp
+        finally:
+            _finish(seen, req, resp)
+
+    app.dispatch = dispatch_once
+    return seen
+
+
+def async_dedupe(app, name, configur):
+    seen = open_seen(configur)
+    if seen is None:
+        return None
+    # The SQLite seen-set is read off the event loop
+    shared = isinstance(seen, SharedSeenEvents)
+
+    @app.middleware
+    async def drop_duplicate_events(req, next):
+        duplicate = await asyncio.to_thread(_drop, name, seen, req) if shared else _drop(name, seen, req)
+        if duplicate:
+            return BoltResponse(status = 200, body = "")
+        await next()
+
+    dispatch = app.async_dispatch
+
+    @functools.wraps(dispatch)
+    async def dispatch_once(req):
+        resp = None
+        try:
+            resp = await dispatch(req)
+            return resp
+        finally:
+            if shared:
+                await asyncio.to_thread(_finish, seen, req, resp)
+            else:
+                _finish(seen, req, resp)
+
+    app.async_dispatch = dispatch_once
+    return seen
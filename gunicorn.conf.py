@@ -0,0 +1,45 @@
+# gunicorn -c gunicorn.conf.py service:flask_app
+# Settings come from the `[service]` section of config.ini
+import multiprocessing
+from configparser import ConfigParser
+
+configur = ConfigParser()
+configur.read('config.ini')
+
+def per_process_stores(configur):
+    '''
+    `[section] BACKEND` of the stores kept in memory or in local files, each worker would have its own
+    '''
+    defaults = {"catalog": "text", "autoresp": "memory"}
+    if configur.getboolean("events", "DEDUP", fallback = True):
+        defaults["events"] = "memory"
+    backends = {section: configur.get(section, "BACKEND", fallback = default) for section, default in defaults.items()}
+    return [f"[{section}] BACKEND = {backend}" for section, backend in backends.items() if backend != "sqlite"]
+
+per_process = per_process_stores(configur)
+
+bind = configur.get("service", "BIND", fallback = "0.0.0.0:3000")
+# One worker until every store is shared, then 2 per CPU
+workers = configur.getint("service", "WORKERS", fallback = 1 if per_process else multiprocessing.cpu_count() * 2 + 1)
+# Bolt acks first and runs the listener in its own thread pool, a few threads per worker cover the acks
+worker_class = "gthread"
+threads = configur.getint("service", "THREADS", fallback = 4)
+timeout = configur.getint("service", "TIMEOUT", fallback = 30)
+# Load service.py (both apps, the catalog, the Slack clients) once in the master before forking.
+# It also checks the Jira create screens, a missing field stops the master once instead of every worker
+preload_app = True
+
+def on_starting(server):
+    # Checked on the final worker count, `--workers` on the command line included
+    if server.cfg.workers > 1 and per_process:
+        raise SystemExit(f"{server.cfg.workers} workers need stores shared between processes, set BACKEND = sqlite for: {', '.join(per_process)}")
+    import service
+    service.clear_worker_metrics()
+
+def post_fork(server, worker):
+    import service
+    service.post_fork()
+
+def child_exit(server, worker):
+    import service
+    service.worker_exit(worker.pid)
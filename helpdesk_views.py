@@ -0,0 +1,444 @@
+'''
+Block Kit views of the help desk and admin modals.
+
+Every builder is a plain function of the Slack payload (and the catalog snapshot), so the
+sync (app.py) and asyncio (async_app.py) apps render exactly the same views.
+
+The multi step modals are rendered from their ModalSession (modal_state.py) out of
+block templates compiled once (block_templates.py), instead of patching the blocks Slack
+echoes back. `block_template` takes the same arguments as `create_block`, tests/test_views.py
+checks the views still serialise byte for byte as the hand-built ones did
+'''
+from block_templates import Slot, Template
+from catalog import Category, Department
+from modal_state import ADMIN, HELP_DESK
+from ticket_routing import DEFAULT_ROUTE
+
+def create_field(text, value):
+    '''
+    Creates the options in the required format
+    '''
+    data = {
+        "text": {
+            "type": "plain_text",
+            "text": text,
+        },
+        "value": value
+    }
+    return data
+
+def create_options(vals_list):
+    '''
+    Creates the options in the required format 
+    Accepts List of tuple including name,value
+    '''
+    options = []
+    for val in vals_list:
+        options.append(
+            {
+                "text": {
+                    "type": "plain_text",
+                    "text": f"{val[0]}",
+                },
+                "value": val[1]
+            }
+        )
+    return options
+
+# blocks with action_id calls `@app.action` decorator with the defined name
+# eg. "action_id": 'demo_action' will execute @app.action('demo_action')
+def create_block(text1, options = None, action = None, initial_option = None, text2 = None, type1 = None, block_id = None, type2 = 'section'):
+    '''
+    To generate block, 
+    type ->
+        For Dropdown send `static_select`
+        For Radio send `radio_buttons`
+        For Typeahead send `external_select`, options then come from the `@app.options` handler of `action`
+    `initial_option` -> set the default option. -> {
+        'value': 'value1',
+        'text': 'dummy_text'
+    }
+    Options -> The options you want to display
+    action -> the function to call on user interaction with this block
+    '''
+    # Block Pre Meta
+    if type2 == 'section':
+        elem_or_acc = 'accessory'
+        text_or_labl = 'text'
+    else:
+        elem_or_acc = 'element'
+        text_or_labl = 'label'
+    data={
+        'type': type2,
+        text_or_labl: {
+            'type': "plain_text",
+            'text': text1
+        }
+    }
+    if type1 == 'external_select':
+        data[elem_or_acc] =  {
+            'type': type1,
+            'action_id': action,
+            'min_query_length': 0,
+        }
+    elif type1:
+        data[elem_or_acc] =  {
+            'type': type1,
+            'options': options,
+            'action_id': action,
+        }
+    if initial_option:
+        data[elem_or_acc]['initial_option'] = {
+            "value": initial_option['value'],
+            "text": {
+                "type": "plain_text",
+                "text": initial_option['text']
+            }
+        }
+    if type1 in ('static_select', 'external_select'):
+        data[elem_or_acc]['placeholder'] = {
+            "type": "plain_text",
+            "text": text2,
+        }
+    if block_id:
+        data['block_id'] = block_id
+    return data
+
+def block_template(text1, options = None, action = None, text2 = None, type1 = None, block_id = None, type2 = 'section'):
+    '''
+    Compiled `create_block`. Any argument can be a Slot, `initial_option` is always an optional
+    slot taking a ready Slack option. It goes last in the element, where the views have always had it
+    '''
+    fragment = create_block(text1, options = options, action = action, text2 = text2, type1 = type1,
+                            block_id = block_id, type2 = type2)
+    if type1:
+        key = 'accessory' if type2 == 'section' else 'element'
+        fragment[key]['initial_option'] = Slot('initial_option', optional = True)
+    return Template(fragment)
+
+def modal(callback_id, blocks, close = True, submit = False):
+    view = {
+        "type": "modal",
+        "callback_id": callback_id,
+        "title": {"type": "plain_text", "text": "Stealth Mode"},
+    }
+    if close:
+        view["close"] = {"type": "plain_text", "text": "Close"}
+    if submit:
+        view["submit"] = {"type": "plain_text", "text": "Submit"}
+    view["blocks"] = blocks
+    return view
+
+def text_input_block(block_id, label):
+    return {
+        "type": "input",
+        "block_id": block_id,
+        "element": {
+            "type": "plain_text_input",
+            "multiline": True,
+            "action_id": "plain_text_input_action"
+        },
+        "label": {
+            "type": "plain_text",
+            "text": label,
+            "emoji": True
+        }
+    }
+
+MESSAGE_VIEW = Template(modal("add_dept_view", [create_block(Slot('message'))]))
+
+def message_view(message):
+    '''
+    Single line result modal
+    '''
+    return MESSAGE_VIEW.render(message = message)
+
+def update_args(body, view, with_hash = True):
+    '''
+    Keyword arguments for `client.views_update` replacing the modal of `body`
+    '''
+    args = {"view_id": body["view"]["id"], "view": view}
+    if with_hash:
+        # String that represents view state to protect against race conditions
+        args["hash"] = body["view"]["hash"]
+    return args
+
+# Admin shortcut
+
+ADMIN_DESCRIPTION = create_block(
+    '"Hi, Here you can add new departments for Help Desk or Update any existing ones."',
+    block_id = "description_block"
+)
+DIVIDER = {
+    "type": "divider",
+    "block_id": "divider_block"
+}
+ADMIN_CHOICES = create_options(
+    [
+        ("Update Existing Department","value-0"),
+        ("Add New Department","value-1")
+    ]
+)
+ADMIN_CHOICE = block_template(
+    "Select",
+    block_id = "add_update_radio_block",
+    options = ADMIN_CHOICES,
+    action = "add_update_radio_buttons_action",
+    type1 = 'radio_buttons'
+)
+ADMIN_NEW_DEPARTMENTS = text_input_block("enter_dept_text_block", "Enter departments, separated by commas")
+ADMIN_ADD_DELETE_CHOICES = create_options(
+    [
+        ("Add New Category","add_cat"),
+        ("Delete a Category","del_cat")
+    ]
+)
+ADMIN_ADD_DELETE = block_template(
+    "Select",
+    block_id = "add_delete_category_block",
+    options = ADMIN_ADD_DELETE_CHOICES,
+    action = "add_delete_category_action",
+    type1 = 'radio_buttons'
+)
+ADMIN_DELETE_CATEGORY = create_block(
+    "Select the category you want to delete",
+    text2 = "Category",
+    type2 = 'input',
+    block_id = 'dept_category_list_drop_down_block',
+    type1 = 'external_select',
+    action = 'dept_category_list_drop_down_action',
+)
+ADMIN_NEW_CATEGORIES = text_input_block("enter_category_text_block", "Enter Categories, separated by commas")
+DEPARTMENT_SELECT = block_template(
+    "Select the Relevant Department",
+    text2 = "Select an item",
+    block_id = Slot('block_id'),
+    type1 = 'static_select',
+    action = Slot('action'),
+    options = Slot('options'),
+)
+
+def choice_option(options, value):
+    for option in options:
+        if option['value'] == value:
+            return option
+    return None
+
+def catalog_option(catalog, value, kind):
+    '''
+    The snapshot's own option for a department / category `value`, None when it is gone
+    '''
+    item = catalog.lookup(value) if value else None
+    return item.option if isinstance(item, kind) else None
+
+def admin_view(is_admin):
+    if not is_admin:
+        return message_view('Only Admins are allowed to use this feature!!!')
+    # https://app.slack.com/block-kit-builder
+    return modal("add_dept_view", [ADMIN_DESCRIPTION, DIVIDER, ADMIN_CHOICE.render()])
+
+def admin_step(session, catalog):
+    '''
+    Admin modal for the choices made so far:
+    "Add New Department" -> text box
+    "Update Existing Department" -> department list, then add / delete, then the category field
+    '''
+    choice = session.get('add_update_radio_buttons_action')
+    blocks = [ADMIN_DESCRIPTION, DIVIDER, ADMIN_CHOICE.render(initial_option = choice_option(ADMIN_CHOICES, choice))]
+    if choice is None:
+        return modal("add_dept_view", blocks)
+    if choice == 'value-1':
+        #Adding new departments from Admin Shortcuts
+        blocks.append(ADMIN_NEW_DEPARTMENTS)
+        return modal("update_files_department", blocks, submit = True)
+    dept = catalog_option(catalog, session.get('admin_dept_drop_down_action'), Department)
+    blocks.append(DEPARTMENT_SELECT.render(
+        block_id = 'dept_list_drop_down_block',
+        action = 'admin_dept_drop_down_action',
+        options = catalog.department_options,
+        initial_option = dept,
+    ))
+    if dept is None:
+        return modal("dept_category_selection2", blocks, close = False)
+    action = session.get('add_delete_category_action')
+    blocks.append(ADMIN_ADD_DELETE.render(initial_option = choice_option(ADMIN_ADD_DELETE_CHOICES, action)))
+    if action == 'del_cat':
+        blocks.append(ADMIN_DELETE_CATEGORY)
+    elif action == 'add_cat':
+        blocks.append(ADMIN_NEW_CATEGORIES)
+    return modal("update_files", blocks, submit = True)
+
+def admin_update(body, sessions, catalog):
+    '''
+    `views.update` arguments after a choice in the admin modal
+    '''
+    view = admin_step(sessions.select(body, ADMIN), catalog)
+    return update_args(body, view, with_hash = view["callback_id"] != "update_files_department")
+
+def department_added_view():
+    return {
+        "type": "modal",
+        "title": {"type": "plain_text", "text": "Stealth Mode"},
+        "close": {"type": "plain_text", "text": "Close"},
+        "blocks": [
+            {
+                "type": "header",
+                "text": {
+                    "type": "plain_text",
+                    "text": "Department added successfully!",
+                    "emoji": True
+                }
+            }
+        ]
+    }
+
+def split_names(text):
+    return [name.strip() for name in text.split(',') if len(name.strip()) > 0]
+
+def apply_department_submission(body, catalogs):
+    '''
+    Adds the departments typed in the admin modal, persisting through the catalog store
+    '''
+    new_dept = body['view']['state']['values']['enter_dept_text_block']['plain_text_input_action']['value']
+    catalogs.add_departments(split_names(new_dept))
+
+def apply_category_submission(body, catalogs):
+    '''
+    Adds or deletes categories as chosen in the admin modal, returns the message to show
+    '''
+    values = body['view']['state']['values']
+    dept = values['dept_list_drop_down_block']['admin_dept_drop_down_action']['selected_option']['text']['text']
+    if values['add_delete_category_block']['add_delete_category_action']['selected_option']['value'] == 'del_cat':
+        catg = values['dept_category_list_drop_down_block']['dept_category_list_drop_down_action']['selected_option']['text']['text']
+        catalogs.remove_category(dept, catg)
+        return 'Category deleted Successfully!!!'
+    catgs = values['enter_category_text_block']['plain_text_input_action']['value']
+    catalogs.add_categories(dept, split_names(catgs))
+    return 'Category added Successfully!!!'
+
+def category_suggestions(body, catalog, block_name, block_action):
+    '''
+    Top matches for what the user typed, within the department selected in the same modal
+    '''
+    try:
+        dept = body['view']['state']['values'][block_name][block_action]['selected_option']['text']['text']
+        return catalog.department(dept).search(body.get('value', ''))
+    except (KeyError, TypeError):
+        return []
+
+# Help desk shortcut
+
+HELP_DESK_DESCRIPTION = create_block(
+    'Your Personal Help Desk',
+    block_id = "help_desk_description_block"
+)
+HELP_DESK_CATEGORY = block_template(
+    "Select the issue category",
+    text2 = "Category",
+    block_id = 'help_desk_dept_category_list_drop_down_block',
+    type1 = 'external_select',
+    action = 'help_desk_dept_category_list_drop_down_action',
+)
+HELP_DESK_ISSUE = text_input_block("issue_description", "Describe your Issue")
+
+def help_desk_view(catalog):
+    # First Page
+    return help_desk_step(None, catalog)
+
+def help_desk_step(session, catalog):
+    '''
+    First Page -> department, Second Page -> + category, Third Page -> + description and Submit
+    '''
+    selected = session.selected if session else {}
+    dept = catalog_option(catalog, selected.get('help_desk_dept_drop_down_action'), Department)
+    blocks = [
+        HELP_DESK_DESCRIPTION,
+        DIVIDER,
+        DEPARTMENT_SELECT.render(
+            block_id = 'help_desk_dept_list_drop_down_block',
+            action = 'help_desk_dept_drop_down_action',
+            options = catalog.department_options,
+            initial_option = dept,
+        ),
+    ]
+    if dept is None:
+        return modal("dept_selection_view", blocks)
+    category = catalog_option(catalog, selected.get('help_desk_dept_category_list_drop_down_action'), Category)
+    blocks.append(HELP_DESK_CATEGORY.render(initial_option = category))
+    if category is None:
+        return modal("dept_category_selection", blocks, close = False)
+    blocks.append(HELP_DESK_ISSUE)
+    return modal("create_ticket", blocks, submit = True)
+
+def help_desk_update(body, sessions, catalog):
+    '''
+    `views.update` arguments after a choice in the help desk modal
+    '''
+    return update_args(body, help_desk_step(sessions.select(body, HELP_DESK), catalog))
+
+# Starts the submitter's own words in a ticket description
+DETAILS = "\nDetails:\n"
+
+def ticket_topic(values):
+    '''
+    (department, category) picked in a help desk submission, category None when none was picked
+    '''
+    dept = values['help_desk_dept_list_drop_down_block']['help_desk_dept_drop_down_action']['selected_option']['text']['text']
+    try:
+        category = values['help_desk_dept_category_list_drop_down_block']['help_desk_dept_category_list_drop_down_action']['selected_option']['text']['text']
+    except (KeyError, TypeError):
+        return dept, None
+    return dept, category
+
+def ticket_summary(values):
+    '''
+    "Department: Category" of a help desk submission, the department alone when no category was picked
+    '''
+    dept, category = ticket_topic(values)
+    return f"{dept}: {category}" if category else dept
+
+def ticket_data(body, routes = None):
+    '''
+    Jira payload for a `create_ticket` submission, in the project, issue type and priority
+    `routes` (ticket_routing.py) gives its department and category, TEST / Task without
+    https://developer.atlassian.com/server/jira/platform/jira-rest-api-examples/
+    '''
+    values = body['view']['state']['values']
+    route = routes.route(*ticket_topic(values)) if routes is not None else DEFAULT_ROUTE
+    return {
+        "fields": {
+            **route.fields(),
+            "summary": ticket_summary(values),
+            "description": f"Issue created by: <@{body['user']['id']}>\nhttps://{body['team']['domain']}.slack.com/team/{body['user']['id']}{DETAILS}{ values['issue_description']['plain_text_input_action']['value'] }",
+        }
+    }
+
+def ticket_details(ticket_data):
+    '''
+    What the submitter wrote, without the "Issue created by" header duplicate detection would match on
+    '''
+    return ticket_data['fields'].get('description', '').partition(DETAILS)[2]
+
+def ticket_key(body):
+    '''
+    Idempotency key of a `create_ticket` submission, one per modal
+    '''
+    return f"{body['team']['id']}-{body['view']['id']}".lower()
+
+def ticket_submitted_view(queued):
+    if queued:
+        return message_view("Ticket queued! You will receive the reference id in a DM shortly.")
+    return message_view("Failed to Create Ticket!!! PLease try again or Contact I.T")
+
+def ticket_invalid_errors(problems):
+    '''
+    `errors` of a `create_ticket` ack refusing a ticket Jira would reject, shown under the description
+    '''
+    return {"issue_description": f"This ticket cannot be created, please contact I.T: {'; '.join(problems)}"}
+
+def ticket_done_text(issue, error):
+    if error:
+        return "Failed to Create Ticket!!! PLease try again or Contact I.T"
+    if issue.get('duplicate'):
+        return f"This issue was already reported, your request was added to ticket {issue['key'] + ': ' + issue['id']}!"
+    return f"Ticket Created Successfully with reference id {issue['key'] + ': ' + issue['id']}!"
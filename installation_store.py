@@ -0,0 +1,215 @@
+import copy
+import logging
+import os
+from slack_bolt.authorization.authorize import InstallationStoreAuthorize
+from slack_sdk.oauth.installation_store import FileInstallationStore, InstallationStore
+from slack_sdk.oauth.installation_store.async_installation_store import AsyncInstallationStore
+from slack_sdk.oauth.installation_store.sqlite3 import SQLite3InstallationStore
+from user_cache import TTLCache
+
+
+class CachedInstallationStore(InstallationStore, AsyncInstallationStore):
+    '''
+    Read-through cache in front of another installation store.
+
+    `find_installation` / `find_bot` answers are kept per (enterprise_id, team_id, user_id)
+    so the per-message lookups and Bolt's authorize step stop reading the backing store.
+    Installs and uninstalls (`save*` / `delete*`, which Bolt also calls on
+    `tokens_revoked` / `app_uninstalled`) drop the cached entries.
+    The `async_*` methods serve AsyncApp from the same cache. Every lookup returns its own copy,
+    Bolt's authorize step edits the installations it is given.
+
+    `stamp` -> file touched on every install and uninstall. Each lookup compares its mtime,
+    so the caches of the other processes (service.py workers) drop a revoked token right away
+    instead of after `ttl`
+    '''
+    def __init__(self, store, ttl = 3600, maxsize = 10000, stamp = None):
+        self.store = store
+        self.cache = TTLCache('installations', ttl, maxsize)
+        self.stamp = stamp
+        self._version = self._stamp_version()
+
+    def _stamp_version(self):
+        if self.stamp is None:
+            return None
+        try:
+            return os.stat(self.stamp).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _check(self):
+        # Another process saved or deleted an installation since our last lookup
+        version = self._stamp_version()
+        if version != self._version:
+            self._version = version
+            self.cache.clear()
+
+    def cached(self, key):
+        '''
+        The entry under `key`, None when missing or expired. Also holds CachedAuthorize's results
+        '''
+        self._check()
+        return self.cache.get(key)
+
+    def _changed(self):
+        if self.stamp is not None:
+            with open(self.stamp, 'a'):
+                os.utime(self.stamp)
+            self._version = self._stamp_version()
+        self.cache.clear()
+
+    @property
+    def logger(self):
+        return getattr(self.store, 'logger', logging.getLogger(__name__))
+
+    def save(self, installation):
+        self.store.save(installation)
+        self._changed()
+
+    def save_bot(self, bot):
+        self.store.save_bot(bot)
+        self._changed()
+
+    def find_installation(self, *, enterprise_id, team_id, user_id = None, is_enterprise_install = False):
+        key = ('installation', enterprise_id, team_id, user_id, is_enterprise_install)
+        installation = self.cached(key)
+        if installation is None:
+            installation = self.store.find_installation(
+                enterprise_id = enterprise_id,
+                team_id = team_id,
+                user_id = user_id,
+                is_enterprise_install = is_enterprise_install,
+            )
+            # Misses are not cached, a fresh install must be visible right away
+            if installation is not None:
+                self.cache.set(key, installation)
+        return copy.copy(installation)
+
+    def find_bot(self, *, enterprise_id, team_id, is_enterprise_install = False):
+        key = ('bot', enterprise_id, team_id, is_enterprise_install)
+        bot = self.cached(key)
+        if bot is None:
+            bot = self.store.find_bot(
+                enterprise_id = enterprise_id,
+                team_id = team_id,
+                is_enterprise_install = is_enterprise_install,
+            )
+            if bot is not None:
+                self.cache.set(key, bot)
+        return copy.copy(bot)
+
+    def delete_bot(self, *, enterprise_id, team_id):
+        self.store.delete_bot(enterprise_id = enterprise_id, team_id = team_id)
+        self._changed()
+
+    def delete_installation(self, *, enterprise_id, team_id, user_id = None):
+        self.store.delete_installation(enterprise_id = enterprise_id, team_id = team_id, user_id = user_id)
+        self._changed()
+
+    def delete_all(self, *, enterprise_id, team_id):
+        self.store.delete_all(enterprise_id = enterprise_id, team_id = team_id)
+        self._changed()
+
+    async def async_save(self, installation):
+        await self.store.async_save(installation)
+        self._changed()
+
+    async def async_save_bot(self, bot):
+        await self.store.async_save_bot(bot)
+        self._changed()
+
+    async def async_find_installation(self, *, enterprise_id, team_id, user_id = None, is_enterprise_install = False):
+        key = ('installation', enterprise_id, team_id, user_id, is_enterprise_install)
+        installation = self.cached(key)
+        if installation is None:
+            installation = await self.store.async_find_installation(
+                enterprise_id = enterprise_id,
+                team_id = team_id,
+                user_id = user_id,
+                is_enterprise_install = is_enterprise_install,
+            )
+            if installation is not None:
+                self.cache.set(key, installation)
+        return copy.copy(installation)
+
+    async def async_find_bot(self, *, enterprise_id, team_id, is_enterprise_install = False):
+        key = ('bot', enterprise_id, team_id, is_enterprise_install)
+        bot = self.cached(key)
+        if bot is None:
+            bot = await self.store.async_find_bot(
+                enterprise_id = enterprise_id,
+                team_id = team_id,
+                is_enterprise_install = is_enterprise_install,
+            )
+            if bot is not None:
+                self.cache.set(key, bot)
+        return copy.copy(bot)
+
+    async def async_delete_bot(self, *, enterprise_id, team_id):
+        await self.store.async_delete_bot(enterprise_id = enterprise_id, team_id = team_id)
+        self._changed()
+
+    async def async_delete_installation(self, *, enterprise_id, team_id, user_id = None):
+        await self.store.async_delete_installation(enterprise_id = enterprise_id, team_id = team_id, user_id = user_id)
+        self._changed()
+
+    async def async_delete_all(self, *, enterprise_id, team_id):
+        await self.store.async_delete_all(enterprise_id = enterprise_id, team_id = team_id)
+        self._changed()
+
+
+class CachedAuthorize(InstallationStoreAuthorize):
+    '''
+    Bolt's authorize step with its result kept in the CachedInstallationStore per
+    (enterprise_id, team_id, user_id), so acking an event takes no `auth.test` round trip.
+    Results leave the cache with the installations: on install, uninstall and `tokens_revoked`,
+    in every process. Bolt's own `cache_enabled` keys them by bot token alone, handing the first
+    user's token to everyone in the team, and never drops them
+    '''
+    def __call__(self, *, context, enterprise_id, team_id, user_id):
+        key = ('authorize', enterprise_id, team_id, user_id, context.is_enterprise_install)
+        result = self.installation_store.cached(key)
+        if result is None:
+            result = super().__call__(context = context, enterprise_id = enterprise_id, team_id = team_id, user_id = user_id)
+            if result is not None:
+                self.installation_store.cache.set(key, result)
+        return result
+
+
+def cache_authorize(oauth_settings):
+    '''
+    Swaps the authorize step of `oauth_settings` for a CachedAuthorize on its installation store
+    '''
+    oauth_settings.authorize = CachedAuthorize(
+        logger = oauth_settings.authorize.logger,
+        client_id = oauth_settings.client_id,
+        client_secret = oauth_settings.client_secret,
+        token_rotation_expiration_minutes = oauth_settings.token_rotation_expiration_minutes,
+        installation_store = oauth_settings.installation_store,
+        bot_only = oauth_settings.installation_store_bot_only,
+    )
+    return oauth_settings
+
+
+def open_installation_store(configur, client_id, section = 'installations'):
+    '''
+    Cached installation store from the `[installations]` section of config.ini.
+    `BACKEND = sqlite` keeps all teams in one SQLite file instead of a directory tree of JSON files
+    '''
+    backend = configur.get(section, "BACKEND", fallback = 'file')
+    if backend == 'sqlite':
+        path = configur.get(section, "SQLITE_PATH", fallback = 'data/installations.db')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        store = SQLite3InstallationStore(database = path, client_id = client_id)
+        stamp = path + '.changed'
+    else:
+        base_dir = configur.get(section, "BASE_DIR", fallback = './data/installations')
+        store = FileInstallationStore(base_dir = base_dir)
+        os.makedirs(base_dir, exist_ok = True)
+        stamp = os.path.join(base_dir, '.changed')
+    return CachedInstallationStore(
+        store,
+        ttl = configur.getfloat(section, "CACHE_TTL", fallback = 3600),
+        maxsize = configur.getint(section, "CACHE_MAX_ENTRIES", fallback = 10000),
+        stamp = stamp,
+    )
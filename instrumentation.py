@@ -0,0 +1,222 @@
+'''
+Per listener timings of the Bolt apps, exported with the rest of metrics.py.
+
+    listener_ack_seconds{listener}          request dispatched -> ack() called
+    ack_deadline_missed_total{listener}     acks later than Slack's 3 second deadline
+    listener_queue_seconds{listener}        waiting for a free listener thread (sync apps)
+    listener_seconds{listener}              listener function run time (sync apps)
+    slack_api_seconds{method}               outbound Web API calls, app.client and the per request clients
+    slack_api_errors_total{method}          Web API calls that raised
+
+`listener` is the kind and id the listener is registered on, eg. `action:help_desk_dept_drop_down_action`.
+Timing starts in the global middleware, which Bolt runs after authorize
+'''
+import contextvars
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from slack_bolt.context.ack import Ack
+from slack_bolt.context.ack.async_ack import AsyncAck
+import metrics
+
+ACK_DEADLINE = 3.0
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2, 3, 5, 10)
+
+ack_latency = metrics.histogram('listener_ack_seconds', 'Request dispatch to ack() per listener', LATENCY_BUCKETS, labels = ('listener',))
+ack_missed = metrics.counter('ack_deadline_missed_total', f'Acks later than {ACK_DEADLINE:g}s per listener', labels = ('listener',))
+queue_wait = metrics.histogram('listener_queue_seconds', 'Wait for a listener thread per listener', LATENCY_BUCKETS, labels = ('listener',))
+run_time = metrics.histogram('listener_seconds', 'Listener run time per listener', LATENCY_BUCKETS, labels = ('listener',))
+slack_latency = metrics.histogram('slack_api_seconds', 'Slack Web API calls per method', LATENCY_BUCKETS, labels = ('method',))
+slack_errors = metrics.counter('slack_api_errors_total', 'Slack Web API calls that raised per method', labels = ('method',))
+
+# (listener key, perf_counter at dispatch) of the request being handled, read by InstrumentedExecutor
+current = contextvars.ContextVar('listener', default = None)
+
+
+def listener_key(body):
+    '''
+    `kind:id` of the listener a request body is routed to
+    '''
+    kind = body.get('type')
+    if kind == 'event_callback':
+        return f"event:{body.get('event', {}).get('type')}"
+    if kind == 'block_actions':
+        actions = body.get('actions') or [{}]
+        return f"action:{actions[0].get('action_id')}"
+    if kind in ('view_submission', 'view_closed'):
+        return f"view:{body.get('view', {}).get('callback_id')}"
+    if kind in ('shortcut', 'message_action'):
+        return f"shortcut:{body.get('callback_id')}"
+    if kind == 'block_suggestion':
+        return f"options:{body.get('action_id')}"
+    if 'command' in body:
+        return f"command:{body['command']}"
+    return str(kind)
+
+
+def _observe_ack(key, started):
+    elapsed = time.perf_counter() - started
+    ack_latency.labels(key).observe(elapsed)
+    if elapsed > ACK_DEADLINE:
+        ack_missed.labels(key).inc()
+
+
+class TimedAck(Ack):
+    '''
+    Ack recording the time from dispatch to its first call
+    '''
+    def __init__(self, key, started):
+        super().__init__()
+        self.key = key
+        self.started = started
+
+    def __call__(self, *args, **kwargs):
+        if self.response is None:
+            _observe_ack(self.key, self.started)
+        return super().__call__(*args, **kwargs)
+
+
+class AsyncTimedAck(AsyncAck):
+    def __init__(self, key, started):
+        super().__init__()
+        self.key = key
+        self.started = started
+
+    async def __call__(self, *args, **kwargs):
+        if self.response is None:
+            _observe_ack(self.key, self.started)
+        return await super().__call__(*args, **kwargs)
+
+
+def timed_client(client):
+    '''
+    Times every Web API call made through `client`, WebClient methods all go through `api_call`.
+    Single token apps hand the same `app.client` to every request, it is only wrapped once
+    '''
+    if 'api_call' in vars(client):
+        return client
+    api_call = client.api_call
+
+    @functools.wraps(api_call)
+    def timed(api_method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return api_call(api_method, *args, **kwargs)
+        except Exception:
+            slack_errors.labels(api_method).inc()
+            raise
+        finally:
+            slack_latency.labels(api_method).observe(time.perf_counter() - start)
+
+    client.api_call = timed
+    return client
+
+
+def async_timed_client(client):
+    if 'api_call' in vars(client):
+        return client
+    api_call = client.api_call
+
+    @functools.wraps(api_call)
+    async def timed(api_method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await api_call(api_method, *args, **kwargs)
+        except Exception:
+            slack_errors.labels(api_method).inc()
+            raise
+        finally:
+            slack_latency.labels(api_method).observe(time.perf_counter() - start)
+
+    client.api_call = timed
+    return client
+
+
+def timed_listener(fn, *args, **kwargs):
+    '''
+    `fn(*args, **kwargs)` as a callable recording its queue wait and run time, called where
+    Bolt submits a listener. Outside a request it is returned untimed
+    '''
+    request = current.get()
+    if request is None:
+        return functools.partial(fn, *args, **kwargs)
+    key = request[0]
+    submitted = time.perf_counter()
+
+    def run():
+        start = time.perf_counter()
+        queue_wait.labels(key).observe(start - submitted)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            run_time.labels(key).observe(time.perf_counter() - start)
+
+    return run
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    '''
+    Bolt's `listener_executor` timing queue wait and run time of every listener it runs.
+    Bolt submits from the request thread, the listener key is taken from its context
+    '''
+    def __init__(self, max_workers = None):
+        # Bolt's own default pool size
+        super().__init__(max_workers = max_workers or (os.cpu_count() or 1) * 5)
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(timed_listener(fn, *args, **kwargs))
+
+
+def instrument(app):
+    '''
+    Adds the timing middleware to a Bolt App, and times the calls made through `app.client`.
+    Pass `listener_executor = InstrumentedExecutor()` to App() for the listener run times
+    '''
+    timed_client(app.client)
+
+    @app.middleware
+    def time_listener(req, next):
+        key = listener_key(req.body)
+        started = time.perf_counter()
+        current.set((key, started))
+        req.context['ack'] = TimedAck(key, started)
+        if req.context.client is not None:
+            timed_client(req.context.client)
+        next()
+
+    return app
+
+
+def async_instrument(app):
+    '''
+    instrument() for AsyncApp. Listeners run as tasks there, not on an executor, so
+    only the ack latency and outbound calls are recorded
+    '''
+    async_timed_client(app.client)
+
+    @app.middleware
+    async def time_listener(req, next):
+        key = listener_key(req.body)
+        started = time.perf_counter()
+        current.set((key, started))
+        req.context['ack'] = AsyncTimedAck(key, started)
+        if req.context.client is not None:
+            async_timed_client(req.context.client)
+        await next()
+
+    return app
+
+
+def serve_from_config(configur, section = 'metrics'):
+    '''
+    Starts the /metrics endpoint when `[metrics] PORT` is set
+    '''
+    port = configur.getint(section, "PORT", fallback = None)
+    if port is None:
+        return None
+    addr = configur.get(section, "ADDR", fallback = '127.0.0.1')
+    server = metrics.serve(port, addr)
+    print(f'Metrics on http://{addr}:{port}/metrics')
+    return server
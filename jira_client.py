@@ -0,0 +1,446 @@
+import asyncio
+import base64
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
+import metrics
+from jira_schema import CreateMeta, MissingFields, createmeta_params
+
+# Statuses Jira answers with when it is overloaded or rate limiting us
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Statuses after which a POST is sent again, only when they carry Retry-After: Jira turned it away unprocessed
+POST_RETRY_STATUSES = (429, 503)
+# Longest sleep between two retries, as urllib3
+BACKOFF_MAX = 120
+# Max issues Jira accepts in one `/issue/bulk` call
+BULK_LIMIT = 50
+
+# Time of each Jira REST call, retries included
+jira_latency = metrics.histogram('jira_request_seconds', 'Jira REST calls per operation', labels = ('operation',))
+
+
+def config_kwargs(configur, section = 'jira'):
+    '''
+    Client settings from the `[jira]` section of config.ini
+    '''
+    return dict(
+        issue_url = configur.get(section, "JIRA_URL"),
+        username = configur.get(section, "JIRA_USERNAME"),
+        token = configur.get(section, "JIRA_TOKEN"),
+        pool_size = configur.getint(section, "JIRA_POOL_SIZE", fallback = 10),
+        connect_timeout = configur.getfloat(section, "JIRA_CONNECT_TIMEOUT", fallback = 3.05),
+        read_timeout = configur.getfloat(section, "JIRA_READ_TIMEOUT", fallback = 10),
+        retries = configur.getint(section, "JIRA_RETRIES", fallback = 3),
+        backoff = configur.getfloat(section, "JIRA_BACKOFF", fallback = 0.5),
+        validate = configur.getboolean(section, "JIRA_VALIDATE", fallback = True),
+        createmeta_ttl = configur.getfloat(section, "JIRA_CREATEMETA_TTL", fallback = 3600),
+    )
+
+
+class JiraRejected(Exception):
+    '''
+    Jira refused the issue itself (validation, permissions), sending it again will not help
+    '''
+
+
+def search_url(issue_url):
+    # `/rest/api/2/issue/` -> `/rest/api/2/search`
+    return issue_url.rstrip('/').rsplit('/', 1)[0] + '/search'
+
+
+def label_query(label):
+    return {'jql': f'labels = "{label}"', 'fields': 'summary', 'maxResults': 1}
+
+
+def issue_update(comment, labels = ()):
+    # Edit of an existing issue: https://docs.atlassian.com/software/jira/docs/api/REST/latest/#api/2/issue-editIssue
+    update = {'comment': [{'add': {'body': comment}}]}
+    if labels:
+        update['labels'] = [{'add': name} for name in labels]
+    return {'update': update}
+
+
+def invalid(problems):
+    return JiraRejected(f"Jira would reject the issue: {'; '.join(problems)}")
+
+
+def project_of(ticket_data):
+    return ticket_data.get('fields', {}).get('project', {}).get('key')
+
+
+def merge_checked(checked, results):
+    '''
+    (issue, error) tuples aligned with every ticket checked, from the `results` of the valid ones sent
+    '''
+    sent = iter(results)
+    return [(None, invalid(problems)) if problems else next(sent) for problems in checked]
+
+
+def check_required(meta, require):
+    lacking = meta.lacking(require)
+    if lacking:
+        raise MissingFields('add these fields to the Jira create screens: ' + ', '.join(
+            f"'{field}' of {project} / {issuetype}" for project, issuetype, field in lacking
+        ))
+
+
+def backoff_delay(backoff, retry):
+    '''
+    Seconds before the `retry`th retry (from 1), urllib3's formula: the first retry is immediate,
+    then `backoff` * 2 ** (retry - 1), capped at BACKOFF_MAX
+    '''
+    if retry <= 1:
+        return 0
+    return min(BACKOFF_MAX, backoff * (2 ** (retry - 1)))
+
+
+def resend_post(status, retry_after):
+    # A POST answered with anything else may have created the issue, the caller decides
+    return status in POST_RETRY_STATUSES and bool(retry_after)
+
+
+class PostSafeRetry(Retry):
+    '''
+    urllib3 Retry that never sends a POST twice when Jira may have processed it: a POST is resent
+    after a connection that could not be opened and after 429/503 with Retry-After, never after
+    a read timeout, a dropped connection or a 5xx. Other verbs are idempotent and retried as usual
+    '''
+    def is_retry(self, method, status_code, has_retry_after = False):
+        if method.upper() == 'POST':
+            return bool(self.total) and self.respect_retry_after_header and resend_post(status_code, has_retry_after)
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def bulk_results(count, data):
+    '''
+    Maps Jira's `/issue/bulk` answer back onto the `count` tickets sent, as (issue, error) tuples
+    '''
+    results = [None] * count
+    for err in data.get('errors', []):
+        idx = err['failedElementNumber']
+        results[idx] = (None, JiraRejected(f"Jira rejected the issue: {err.get('elementErrors')}"))
+    # Created issues come back in request order, skipping the failed ones
+    created = iter(data.get('issues', []))
+    for idx, result in enumerate(results):
+        if result is None:
+            issue = next(created, None)
+            if issue is None:
+                results[idx] = (None, Exception('Jira returned no issue for this ticket'))
+            else:
+                results[idx] = (issue, None)
+    return results
+
+
+class JiraClient:
+    '''
+    Thin Jira REST client sharing one pooled, keep-alive `requests.Session`
+    between all Bolt listener threads.
+
+    `issue_url` -> the `/rest/api/2/issue/` endpoint (same as `JIRA_URL` in config.ini)
+    `pool_size` -> max keep-alive connections kept open to Jira
+    `connect_timeout`, `read_timeout` -> seconds, passed to every request
+    `retries` -> how many times a 429/5xx or connection error is retried. Issue creation (POST) is
+        only retried when Jira cannot have created it, see PostSafeRetry
+    `backoff` -> backoff factor, see backoff_delay
+    `validate` -> check every issue against the project's createmeta before sending it (jira_schema.py)
+    `createmeta_ttl` -> seconds a project's createmeta is kept
+    '''
+    def __init__(self, issue_url, username, token, pool_size = 10, connect_timeout = 3.05, read_timeout = 10, retries = 3, backoff = 0.5,
+                 validate = True, createmeta_ttl = 3600):
+        self.issue_url = issue_url.rstrip('/') + '/'
+        self.meta = CreateMeta(createmeta_ttl) if validate else None
+        self.timeout = (connect_timeout, read_timeout)
+        self._auth = HTTPBasicAuth(username, token)
+        self._retry = PostSafeRetry(
+            total = retries,
+            connect = retries,
+            read = retries,
+            status = retries,
+            backoff_factor = backoff,
+            status_forcelist = RETRY_STATUSES,
+            # Read timeouts and 5xx are retried for the idempotent verbs only, POST is left out here
+            allowed_methods = Retry.DEFAULT_ALLOWED_METHODS,
+            respect_retry_after_header = True,
+            raise_on_status = False,
+        )
+        self._pool_size = pool_size
+        # urllib3's pool is thread safe, so one session is shared by every listener thread
+        self.session = self._new_session()
+
+    @classmethod
+    def from_config(cls, configur, section = 'jira'):
+        '''
+        Builds the client from the `[jira]` section of config.ini
+        '''
+        return cls(**config_kwargs(configur, section))
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections = 1,
+            pool_maxsize = self._pool_size,
+            pool_block = True,
+            max_retries = self._retry,
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.auth = self._auth
+        session.headers.update({
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+        })
+        return session
+
+    def after_fork(self):
+        '''
+        Gives a pre-fork server worker its own connection pool, the sockets of the parent's must not be shared
+        '''
+        self.session = self._new_session()
+
+    def request(self, method, url, **kwargs):
+        '''
+        Sends a request through the shared connection pool and raises on a non 2xx answer
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        resp = self.session.request(method, url, **kwargs)
+        resp.raise_for_status()
+        return resp
+
+    def load_meta(self, projects, require = ()):
+        '''
+        Fetches the createmeta of the `projects` not cached yet, in one call.
+        `require` -> (project, issue type, field) that must be on the create screen, MissingFields is raised otherwise
+        '''
+        if self.meta is None:
+            return
+        missing = self.meta.missing(projects)
+        if missing:
+            try:
+                with jira_latency.labels('createmeta').time():
+                    data = self.request('GET', self.issue_url + 'createmeta', params = createmeta_params(missing)).json()
+            except requests.RequestException:
+                self.meta.failed(missing)
+                raise
+            self.meta.store(missing, data)
+        check_required(self.meta, require)
+
+    def known_problems(self, ticket_data):
+        '''
+        Why Jira would refuse `ticket_data` going by the createmeta cached so far, never a request.
+        Empty when its project was not fetched yet
+        '''
+        return (self.meta.problems(ticket_data) if self.meta is not None else None) or []
+
+    def problems(self, ticket_data):
+        '''
+        Why Jira would refuse `ticket_data`, fetching its project's createmeta the first time.
+        Nothing is checked when validation is off or the createmeta cannot be fetched (nor is it fetched
+        again for a while), Jira has the last word
+        '''
+        if self.meta is None:
+            return []
+        problems = self.meta.problems(ticket_data)
+        if problems is None:
+            try:
+                self.load_meta([project_of(ticket_data)])
+            except requests.RequestException as err:
+                print(f'Jira createmeta unavailable, not validating: {err}')
+                return []
+            problems = self.meta.problems(ticket_data) or []
+        return problems
+
+    def create_issue(self, ticket_data):
+        '''
+        Creates a single issue, `ticket_data` -> {"fields": {...}}
+        Returns the created issue eg. {"id": "10000", "key": "TEST-24", "self": "..."}
+        Raises JiraRejected without any request when the createmeta tells Jira would refuse it
+        '''
+        problems = self.problems(ticket_data)
+        if problems:
+            raise invalid(problems)
+        with jira_latency.labels('create_issue').time():
+            return self.request('POST', self.issue_url, json = ticket_data).json()
+
+    def find_issue_by_label(self, label):
+        '''
+        The issue carrying `label`, or None. Tells whether an earlier attempt already created a ticket
+        '''
+        with jira_latency.labels('search').time():
+            data = self.request('GET', search_url(self.issue_url), params = label_query(label)).json()
+        issues = data.get('issues') or []
+        return {key: issues[0][key] for key in ('id', 'key', 'self') if key in issues[0]} if issues else None
+
+    def comment_issue(self, issue_key, comment, labels = ()):
+        '''
+        Adds `comment` and `labels` to an existing issue in one edit, eg. a duplicate report (ticket_dedup.py)
+        '''
+        with jira_latency.labels('comment_issue').time():
+            self.request('PUT', self.issue_url + issue_key, json = issue_update(comment, labels))
+
+    def create_issues_bulk(self, tickets):
+        '''
+        Creates many issues with one call to `/rest/api/2/issue/bulk`
+        `tickets` -> list of {"fields": {...}} payloads
+        Returns a list aligned with `tickets` of (issue, error) tuples, one of them is None.
+        Tickets the createmeta tells Jira would refuse are not sent, they come back as JiraRejected
+        '''
+        checked = [self.problems(ticket) for ticket in tickets]
+        valid = [ticket for ticket, problems in zip(tickets, checked) if not problems]
+        return merge_checked(checked, self._post_bulk(valid) if valid else [])
+
+    def _post_bulk(self, tickets):
+        with jira_latency.labels('create_issues_bulk').time():
+            resp = self.session.post(
+                self.issue_url + 'bulk',
+                json = {"issueUpdates": tickets},
+                timeout = self.timeout,
+            )
+        # Jira answers 400 when some of the issues failed, the rest are still created
+        if resp.status_code not in (200, 201, 400):
+            resp.raise_for_status()
+        data = resp.json()
+        if resp.status_code == 400 and not data.get('issues') and not data.get('errors'):
+            resp.raise_for_status()
+        return bulk_results(len(tickets), data)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncJiraClient:
+    '''
+    asyncio counterpart of JiraClient for async_app.py, one pooled keep-alive aiohttp session
+    with the same timeouts and the same retries and backoff as PostSafeRetry.
+    The session is created on first use, inside the running event loop.
+    aiohttp is imported by the methods, the threaded apps importing this module never load it
+    '''
+    def __init__(self, issue_url, username, token, pool_size = 10, connect_timeout = 3.05, read_timeout = 10, retries = 3, backoff = 0.5,
+                 validate = True, createmeta_ttl = 3600):
+        self.issue_url = issue_url.rstrip('/') + '/'
+        self.meta = CreateMeta(createmeta_ttl) if validate else None
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        # The header itself, aiohttp.BasicAuth is deprecated
+        credentials = base64.b64encode(f'{username}:{token}'.encode('utf-8')).decode('ascii')
+        self._authorization = f'Basic {credentials}'
+        self._session = None
+
+    @classmethod
+    def from_config(cls, configur, section = 'jira'):
+        return cls(**config_kwargs(configur, section))
+
+    def _get_session(self):
+        import aiohttp
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit = self.pool_size),
+                headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Authorization': self._authorization},
+                timeout = aiohttp.ClientTimeout(sock_connect = self.connect_timeout, sock_read = self.read_timeout),
+            )
+        return self._session
+
+    def _delay(self, retry, retry_after = None):
+        if retry_after:
+            try:
+                return max(0, float(retry_after))
+            except ValueError:
+                pass
+        return backoff_delay(self.backoff, retry)
+
+    async def request(self, method, url, ok_statuses = (), **kwargs):
+        '''
+        Returns (status, json) and raises on a non 2xx answer that is not in `ok_statuses`.
+        A POST is only sent again when Jira cannot have processed it, as PostSafeRetry
+        '''
+        import aiohttp
+        session = self._get_session()
+        post = method.upper() == 'POST'
+        # A POST that may have reached Jira is not retried
+        retried = aiohttp.ClientConnectorError if post else (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+        for retry in range(1, self.retries + 2):
+            last = retry > self.retries
+            try:
+                async with session.request(method, url, **kwargs) as resp:
+                    retry_after = resp.headers.get('Retry-After')
+                    again = resend_post(resp.status, retry_after) if post else resp.status in RETRY_STATUSES
+                    if again and not last:
+                        await asyncio.sleep(self._delay(retry, retry_after))
+                        continue
+                    if resp.status not in ok_statuses:
+                        resp.raise_for_status()
+                    return resp.status, await resp.json(content_type = None)
+            except retried:
+                if last:
+                    raise
+                await asyncio.sleep(self._delay(retry))
+
+    async def load_meta(self, projects, require = ()):
+        import aiohttp
+        if self.meta is None:
+            return
+        missing = self.meta.missing(projects)
+        if missing:
+            try:
+                with jira_latency.labels('createmeta').time():
+                    _, data = await self.request('GET', self.issue_url + 'createmeta', params = createmeta_params(missing))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.meta.failed(missing)
+                raise
+            self.meta.store(missing, data)
+        check_required(self.meta, require)
+
+    def known_problems(self, ticket_data):
+        return (self.meta.problems(ticket_data) if self.meta is not None else None) or []
+
+    async def problems(self, ticket_data):
+        import aiohttp
+        if self.meta is None:
+            return []
+        problems = self.meta.problems(ticket_data)
+        if problems is None:
+            try:
+                await self.load_meta([project_of(ticket_data)])
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                print(f'Jira createmeta unavailable, not validating: {err}')
+                return []
+            problems = self.meta.problems(ticket_data) or []
+        return problems
+
+    async def create_issue(self, ticket_data):
+        problems = await self.problems(ticket_data)
+        if problems:
+            raise invalid(problems)
+        with jira_latency.labels('create_issue').time():
+            _, issue = await self.request('POST', self.issue_url, json = ticket_data)
+        return issue
+
+    async def find_issue_by_label(self, label):
+        with jira_latency.labels('search').time():
+            _, data = await self.request('GET', search_url(self.issue_url), params = label_query(label))
+        issues = data.get('issues') or []
+        return {key: issues[0][key] for key in ('id', 'key', 'self') if key in issues[0]} if issues else None
+
+    async def comment_issue(self, issue_key, comment, labels = ()):
+        with jira_latency.labels('comment_issue').time():
+            await self.request('PUT', self.issue_url + issue_key, json = issue_update(comment, labels))
+
+    async def create_issues_bulk(self, tickets):
+        checked = [await self.problems(ticket) for ticket in tickets]
+        valid = [ticket for ticket, problems in zip(tickets, checked) if not problems]
+        return merge_checked(checked, await self._post_bulk(valid) if valid else [])
+
+    async def _post_bulk(self, tickets):
+        with jira_latency.labels('create_issues_bulk').time():
+            status, data = await self.request('POST', self.issue_url + 'bulk', ok_statuses = (400,), json = {"issueUpdates": tickets})
+        if status == 400 and not data.get('issues') and not data.get('errors'):
+            raise JiraRejected(f'Jira rejected the bulk request: {data}')
+        return bulk_results(len(tickets), data)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,161 @@
+'''
+Local validation of Jira issue payloads against the project's create screen.
+
+Jira's `createmeta` lists, per project and issue type, the fields an issue can be created with:
+whether each is required, its type and, for priorities, options and the like, its allowed values.
+It is fetched once per project and kept for `ttl` seconds, so a payload Jira would refuse
+(unknown project or issue type, a field not on the screen, a missing required field, a value
+that is not allowed) is caught before any request is sent.
+https://docs.atlassian.com/software/jira/docs/api/REST/latest/#api/2/issue-getCreateIssueMeta
+'''
+import threading
+import time
+import metrics
+
+invalid = metrics.counter('jira_tickets_invalid_total', 'Tickets refused locally against the cached createmeta')
+
+# Fields Jira sets itself or that the issue type and project already identify
+IMPLIED = frozenset(('project', 'issuetype'))
+
+# Python types a value of each createmeta schema type can have
+SCHEMA_TYPES = {
+    'string': (str,),
+    'number': (int, float),
+    'array': (list, tuple),
+    'date': (str,),
+    'datetime': (str,),
+}
+
+
+class MissingFields(RuntimeError):
+    '''
+    Create screens lack fields the app sets on every issue, eg. `labels` for the ticket outbox
+    '''
+
+
+def createmeta_params(projects):
+    return {'projectKeys': ','.join(projects), 'expand': 'projects.issuetypes.fields'}
+
+
+def parse_createmeta(data):
+    '''
+    `createmeta` answer -> {project key: {issue type name: {field id: field meta}}}
+    '''
+    return {
+        project['key']: {issuetype['name']: issuetype.get('fields', {}) for issuetype in project.get('issuetypes', [])}
+        for project in data.get('projects', [])
+    }
+
+
+def _allowed(value, allowed):
+    # Options are referenced by id, name or value depending on the field
+    if not isinstance(value, dict):
+        return False
+    return any(
+        key in value and value[key] == option.get(key)
+        for option in allowed for key in ('id', 'name', 'value')
+    )
+
+
+def field_problems(fields, meta):
+    '''
+    Why Jira would refuse the issue `fields` against the `meta` of its issue type, empty when it would not
+    '''
+    problems = []
+    for field_id, value in fields.items():
+        if field_id in IMPLIED:
+            continue
+        spec = meta.get(field_id)
+        if spec is None:
+            problems.append(f"field '{field_id}' is not on the create screen")
+            continue
+        expected = SCHEMA_TYPES.get(spec.get('schema', {}).get('type'))
+        if expected is not None and not isinstance(value, expected):
+            problems.append(f"field '{field_id}' must be a {spec['schema']['type']}")
+        elif spec.get('allowedValues') and expected is None and not _allowed(value, spec['allowedValues']):
+            problems.append(f"'{field_id}' value {value!r} is not allowed")
+    for field_id, spec in meta.items():
+        if spec.get('required') and not spec.get('hasDefaultValue') and field_id not in IMPLIED and not fields.get(field_id):
+            problems.append(f"required field '{field_id}' is missing")
+    return problems
+
+
+class CreateMeta:
+    '''
+    `createmeta` per project, each kept `ttl` seconds after it was fetched. Thread safe,
+    lookups are dict reads; the Jira clients fetch and store() what is missing. A project whose
+    fetch failed() is not fetched again for `retry_after` seconds, tickets go unchecked meanwhile
+    '''
+    def __init__(self, ttl = 3600, retry_after = 30):
+        self.ttl = ttl
+        self.retry_after = retry_after
+        # project key -> monotonic time its fetch last failed
+        self._failed = {}
+        # project key -> (monotonic time fetched, {issue type name: fields}), None when Jira does not know it
+        self._projects = {}
+        self._lock = threading.Lock()
+
+    def missing(self, projects):
+        '''
+        Projects of `projects` not cached or expired, that did not fail to fetch lately
+        '''
+        now = time.monotonic()
+        return [
+            key for key in projects
+            if (key not in self._projects or now - self._projects[key][0] >= self.ttl)
+            and now - self._failed.get(key, -self.retry_after) >= self.retry_after
+        ]
+
+    def failed(self, projects):
+        now = time.monotonic()
+        with self._lock:
+            for key in projects:
+                self._failed[key] = now
+
+    def store(self, projects, data):
+        '''
+        Caches the `createmeta` answer `data` for the `projects` asked for, a project it leaves out does not exist
+        (or cannot be created in with these credentials)
+        '''
+        parsed = parse_createmeta(data)
+        now = time.monotonic()
+        with self._lock:
+            for key in projects:
+                self._projects[key] = (now, parsed.get(key))
+                self._failed.pop(key, None)
+
+    def lacking(self, required):
+        '''
+        The (project, issue type, field) of `required` whose cached create screen does not have the field.
+        Projects not cached and unknown projects or issue types are left to problems()
+        '''
+        lacking = []
+        for project, issuetype, field in required:
+            cached = self._projects.get(project)
+            meta = cached[1].get(issuetype) if cached is not None and cached[1] is not None else None
+            if meta is not None and field not in meta:
+                lacking.append((project, issuetype, field))
+        return lacking
+
+    def problems(self, ticket_data):
+        '''
+        Why Jira would refuse `ticket_data`, an empty list when it would not, None when its project is not cached
+        '''
+        fields = ticket_data.get('fields', {})
+        project = fields.get('project', {}).get('key')
+        cached = self._projects.get(project)
+        if cached is None or time.monotonic() - cached[0] >= self.ttl:
+            return None
+        issuetypes = cached[1]
+        if issuetypes is None:
+            problems = [f"project '{project}' does not exist or issues cannot be created in it"]
+        else:
+            issuetype = fields.get('issuetype', {}).get('name')
+            meta = issuetypes.get(issuetype)
+            if meta is None:
+                problems = [f"issue type '{issuetype}' is not available in project '{project}'"]
+            else:
+                problems = field_problems(fields, meta)
+        if problems:
+            invalid.inc()
+        return problems
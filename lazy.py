@@ -0,0 +1,31 @@
+import threading
+
+
+class lazy:
+    '''
+    functools.cached_property built under a lock: listener threads racing on the first use
+    of a client or cache all get the one instance. Once built it is a plain instance attribute
+    '''
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+        self._lock = threading.RLock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner = None):
+        if obj is None:
+            return self
+        with self._lock:
+            if self.name not in obj.__dict__:
+                obj.__dict__[self.name] = self.func(obj)
+        return obj.__dict__[self.name]
+
+
+def built(obj, name):
+    '''
+    The lazy attribute `name` of `obj` when it was built already, else None
+    '''
+    return obj.__dict__.get(name)
@@ -0,0 +1,218 @@
+'''
+Bounded listener thread pool for the auto responder, shared fairly between teams.
+
+Bolt hands every listener and lazy listener to its `listener_executor`. A ThreadPoolExecutor
+queues them without limit in arrival order, so one busy workspace delays every other one and
+a burst piles up unbounded. FairExecutor keeps a queue per team and its workers take turns
+between the teams with work. A request finding the pool full (`MAX_QUEUE`, or `MAX_PER_TEAM`
+for its team) holds its thread up to `MAX_WAIT` seconds for room; its work is then dropped,
+logged, and the callback the request registered with when_shed() undoes what expected it to run.
+
+    # config.ini, optional
+    [listeners]
+    WORKERS = 16
+    MAX_QUEUE = 1000
+    MAX_PER_TEAM = 250
+    MAX_WAIT = 0.5
+
+    listener_pool_depth                     listeners waiting for a worker
+    listener_pool_busy                      workers running a listener
+    listener_pool_submit_wait_seconds       requests held for room in the queue
+    listener_pool_shed_total{listener}      listeners dropped, the queue stayed full
+'''
+import collections
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Executor, Future
+import metrics
+from instrumentation import current, timed_listener
+
+submit_wait = metrics.histogram('listener_pool_submit_wait_seconds', 'Requests held for room in the listener queue',
+                                buckets = (.001, .005, .01, .05, .1, .25, .5, 1, 2))
+shed = metrics.counter('listener_pool_shed_total', 'Listeners dropped as the queue stayed full', labels = ('listener',))
+
+logger = logging.getLogger(__name__)
+
+# Team (or Enterprise Grid org) of the request being dispatched on this thread, set by by_team()
+current_team = contextvars.ContextVar('team', default = None)
+# Called when a listener of the request being dispatched is shed, set by when_shed()
+current_on_shed = contextvars.ContextVar('on_shed', default = None)
+
+
+class PoolFull(RuntimeError):
+    pass
+
+
+class FairExecutor(Executor):
+    '''
+    `workers` threads serving one FIFO queue per team round robin, at most `max_queue` listeners
+    waiting and `max_per_team` of one team. Bolt submits from the request thread, the team is
+    taken from its context. Workers start with the first submission
+    '''
+    def __init__(self, workers = 16, max_queue = 1000, max_per_team = 250, max_wait = 0.5):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_per_team = min(max_per_team, max_queue)
+        self.max_wait = max_wait
+        self._setup()
+        metrics.gauge('listener_pool_depth', 'Listeners waiting for a worker', lambda: self.depth)
+        metrics.gauge('listener_pool_busy', 'Workers running a listener', lambda: self.busy)
+
+    def _setup(self):
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._room = threading.Condition(self._lock)
+        # team -> deque of (future, fn), teams in the order they get their next turn
+        self._queues = collections.OrderedDict()
+        self._threads = []
+        self._stopping = False
+        self.depth = 0
+        self.busy = 0
+
+    @classmethod
+    def from_config(cls, configur, section = 'listeners'):
+        return cls(
+            workers = configur.getint(section, "WORKERS", fallback = 16),
+            max_queue = configur.getint(section, "MAX_QUEUE", fallback = 1000),
+            max_per_team = configur.getint(section, "MAX_PER_TEAM", fallback = 250),
+            max_wait = configur.getfloat(section, "MAX_WAIT", fallback = 0.5),
+        )
+
+    def _full(self, team):
+        queue = self._queues.get(team)
+        return self.depth >= self.max_queue or (queue is not None and len(queue) >= self.max_per_team)
+
+    def submit(self, fn, *args, **kwargs):
+        team = current_team.get()
+        future = Future()
+        job = (future, timed_listener(fn, *args, **kwargs))
+        dropped = None
+        with self._lock:
+            if self._stopping:
+                raise RuntimeError('cannot submit after shutdown')
+            if not self._threads:
+                self._start()
+            if self._full(team):
+                start = time.perf_counter()
+                deadline = time.monotonic() + self.max_wait
+                while self._full(team):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._room.wait(remaining)
+                submit_wait.observe(time.perf_counter() - start)
+                if self._full(team):
+                    request = current.get()
+                    listener = request[0] if request else 'other'
+                    shed.labels(listener).inc()
+                    future.set_exception(PoolFull(f'listener queue full for team {team}'))
+                    dropped = listener
+            if dropped is None:
+                self._queues.setdefault(team, collections.deque()).append(job)
+                self.depth += 1
+                self._work.notify()
+        if dropped is not None:
+            self._shed(dropped, team)
+        return future
+
+    def _shed(self, listener, team):
+        # Bolt drops the future of a lazy listener unread, this is the only trace of it
+        logger.warning('listener %s of team %s dropped, the queue stayed full for %ss', listener, team, self.max_wait)
+        on_shed = current_on_shed.get()
+        if on_shed is not None:
+            try:
+                on_shed()
+            except Exception:
+                logger.exception('on shed callback of listener %s failed', listener)
+
+    def _start(self):
+        self._threads = [
+            threading.Thread(target = self._worker, name = f'listener-{idx}', daemon = True)
+            for idx in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _next(self):
+        '''
+        Next job, the team it came from waits for every other team's turn. None once shut down
+        '''
+        with self._lock:
+            while not self._queues and not self._stopping:
+                self._work.wait()
+            if not self._queues:
+                return None
+            team, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(team)
+            else:
+                del self._queues[team]
+            self.depth -= 1
+            self.busy += 1
+            self._room.notify_all()
+            return job
+
+    def _worker(self):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            future, fn = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn()
+                except BaseException as err:
+                    future.set_exception(err)
+                else:
+                    future.set_result(result)
+            with self._lock:
+                self.busy -= 1
+
+    def shutdown(self, wait = True, *, cancel_futures = False):
+        '''
+        Workers finish what is queued, `cancel_futures` drops it instead
+        '''
+        with self._lock:
+            self._stopping = True
+            if cancel_futures:
+                for queue in self._queues.values():
+                    for future, _ in queue:
+                        future.cancel()
+                self._queues.clear()
+                self.depth = 0
+            self._work.notify_all()
+            self._room.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def after_fork(self):
+        '''
+        Threads do not survive a fork, the child starts its own with an empty queue
+        '''
+        self._setup()
+
+
+def when_shed(callback):
+    '''
+    `callback()` runs if a listener of the request being dispatched is dropped, eg. to forget
+    what the request recorded for a reply that will not be sent
+    '''
+    current_on_shed.set(callback)
+
+
+def by_team(app):
+    '''
+    Tags every request `app` dispatches with its team, for FairExecutor
+    '''
+    @app.middleware
+    def tag_team(context, next):
+        current_team.set(context.enterprise_id if context.is_enterprise_install else context.team_id)
+        # Request threads are reused, the callback of an earlier request must not fire for this one
+        current_on_shed.set(None)
+        next()
+
+    return app
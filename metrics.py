@@ -0,0 +1,309 @@
+import bisect
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, good enough for Slack acks (3s deadline) and Jira round trips
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+registry = {}
+_lock = threading.Lock()
+
+
+class Counter:
+    '''
+    Monotonic counter, eg. tickets submitted
+    '''
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount = 1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+def _source(func):
+    # A bound method does not keep its object registered once it is gone, eg. a cache rebuilt in a test
+    if hasattr(func, '__self__') and hasattr(func, '__func__'):
+        return weakref.WeakMethod(func)
+    return lambda: func
+
+
+class Gauge:
+    '''
+    Value read at collection time from `func`, eg. the current queue depth.
+    Every `func` registered under the same name is added up, eg. the size of one cache per app
+    '''
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help = help_text
+        self.sources = [_source(func)]
+        self._lock = threading.Lock()
+
+    def add(self, func):
+        with self._lock:
+            self.sources.append(_source(func))
+
+    def snapshot(self):
+        with self._lock:
+            funcs = [source() for source in self.sources]
+            self.sources = [source for source, func in zip(self.sources, funcs) if func is not None]
+        return sum(func() for func in funcs if func is not None)
+
+
+class Histogram:
+    '''
+    Cumulative histogram of observed values with fixed `buckets`
+    '''
+    def __init__(self, name, help_text, buckets = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        # First bucket whose upper bound is >= value, the last slot is +Inf
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        '''
+        Context manager observing the seconds spent in its block
+        '''
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'sum': self.sum,
+                'buckets': dict(zip(self.buckets + (float('inf'),), self.counts)),
+            }
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Family:
+    '''
+    One Counter / Histogram per combination of label values, eg. Slack API latency per method.
+    `family.labels('views.update')` returns the child metric, created on first use
+    '''
+    def __init__(self, kind, name, help_text, label_names, **kwargs):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.kwargs = kwargs
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.get(values)
+                if child is None:
+                    child = self.children[values] = self.kind(self.name, self.help, **self.kwargs)
+        return child
+
+    def snapshot(self):
+        return {values: child.snapshot() for values, child in list(self.children.items())}
+
+
+def register(metric):
+    '''
+    Adds `metric` to the process wide registry, returns the already registered one on name clash
+    '''
+    with _lock:
+        return registry.setdefault(metric.name, metric)
+
+
+def counter(name, help_text, labels = ()):
+    if labels:
+        return register(Family(Counter, name, help_text, labels))
+    return register(Counter(name, help_text))
+
+
+def gauge(name, help_text, func):
+    '''
+    Registers `func` as a source of the gauge `name`, sources registered again under it are summed
+    '''
+    with _lock:
+        metric = registry.get(name)
+        if isinstance(metric, Gauge):
+            metric.add(func)
+            return metric
+        return registry.setdefault(name, Gauge(name, help_text, func))
+
+
+def histogram(name, help_text, buckets = DEFAULT_BUCKETS, labels = ()):
+    if labels:
+        return register(Family(Histogram, name, help_text, labels, buckets = buckets))
+    return register(Histogram(name, help_text, buckets))
+
+
+def snapshot():
+    '''
+    Returns {name: value} for every registered metric
+    '''
+    with _lock:
+        metrics = list(registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _samples(name, metric, pairs, samples):
+    if isinstance(metric, Histogram):
+        data = metric.snapshot()
+        cumulative = 0
+        for bound, count in data['buckets'].items():
+            cumulative += count
+            samples.append((f'{name}_bucket', pairs + [('le', _number(bound))], cumulative))
+        samples.append((f'{name}_sum', pairs, data['sum']))
+        samples.append((f'{name}_count', pairs, data['count']))
+    else:
+        samples.append((name, pairs, metric.snapshot()))
+
+
+def families():
+    '''
+    Every registered metric as (name, help, type, [(sample name, [(label, value)], value)])
+    '''
+    with _lock:
+        metrics = list(registry.values())
+    result = []
+    for metric in metrics:
+        kind = metric.kind if isinstance(metric, Family) else type(metric)
+        samples = []
+        if isinstance(metric, Family):
+            for values, child in list(metric.children.items()):
+                _samples(metric.name, child, list(zip(metric.label_names, values)), samples)
+        else:
+            _samples(metric.name, metric, [], samples)
+        result.append((metric.name, metric.help, kind.__name__.lower(), samples))
+    return result
+
+
+def render(families):
+    '''
+    `families` in the Prometheus text format (version 0.0.4)
+    '''
+    lines = []
+    for name, help_text, kind, samples in families:
+        lines.append(f'# HELP {name} {_escape(help_text)}')
+        lines.append(f'# TYPE {name} {kind}')
+        for sample, pairs, value in samples:
+            lines.append(f'{sample}{_labels(pairs)} {_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def exposition():
+    '''
+    Every registered metric in the Prometheus text format (version 0.0.4)
+    '''
+    return render(families())
+
+
+def dump(path):
+    '''
+    Writes families() to `path` as JSON, replaced atomically so a reader never sees half of it
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir = directory, prefix = '.tmp_', suffix = '.json')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(families(), fp)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def merged(paths, label = 'worker'):
+    '''
+    The families dumped to `paths` ({label value: path}) in one list, each sample labelled with
+    the process it came from. Files gone or half written (a worker exiting) are skipped
+    '''
+    merged = {}
+    for worker, path in paths.items():
+        try:
+            with open(path) as fp:
+                dumped = json.load(fp)
+        except (OSError, ValueError):
+            continue
+        for name, help_text, kind, samples in dumped:
+            family = merged.setdefault(name, (name, help_text, kind, []))
+            family[3].extend((sample, [(label, str(worker))] + [tuple(pair) for pair in pairs], value)
+                             for sample, pairs, value in samples)
+    return list(merged.values())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port, addr = '127.0.0.1'):
+    '''
+    Serves `exposition()` on http://addr:port/metrics from a daemon thread, returns the server
+    '''
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, name = 'metrics-http', daemon = True).start()
+    return server
@@ -0,0 +1,91 @@
+from user_cache import TTLCache
+
+HELP_DESK = 'help_desk'
+ADMIN = 'admin'
+
+# (block_id, action_id) of every select whose choice drives the next step, per flow
+INPUTS = {
+    HELP_DESK: (
+        ('help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action'),
+        ('help_desk_dept_category_list_drop_down_block', 'help_desk_dept_category_list_drop_down_action'),
+    ),
+    ADMIN: (
+        ('add_update_radio_block', 'add_update_radio_buttons_action'),
+        ('dept_list_drop_down_block', 'admin_dept_drop_down_action'),
+        ('add_delete_category_block', 'add_delete_category_action'),
+    ),
+}
+
+
+class ModalSession:
+    '''
+    Where one open modal is in its flow
+    `selected` -> action_id -> value of the chosen option, in the order of INPUTS[flow].
+    Choosing an option forgets every later choice, the steps after it depend on it
+    '''
+    __slots__ = ('flow', 'selected')
+
+    def __init__(self, flow, selected = None):
+        self.flow = flow
+        self.selected = selected or {}
+
+    def select(self, action_id, value):
+        actions = [action for _, action in INPUTS[self.flow]]
+        later = actions[actions.index(action_id) + 1:]
+        for action in later:
+            self.selected.pop(action, None)
+        self.selected[action_id] = value
+
+    def get(self, action_id):
+        return self.selected.get(action_id)
+
+
+class ModalSessions:
+    '''
+    ModalSession per Slack `view_id`, bounded and evicted `ttl` seconds after the modal opened.
+
+    A view we hold no session for (evicted, restarted, or opened through another worker
+    process of service.py) gets one rebuilt from the view state Slack sends with every action
+    '''
+    def __init__(self, ttl = 3600, maxsize = 10000):
+        self.cache = TTLCache('modal_sessions', ttl, maxsize)
+
+    @classmethod
+    def from_config(cls, configur, section = 'modals'):
+        return cls(
+            ttl = configur.getfloat(section, "TTL", fallback = 3600),
+            maxsize = configur.getint(section, "MAX_ENTRIES", fallback = 10000),
+        )
+
+    def start(self, view_id, flow):
+        '''
+        Registers a modal just opened with `views.open`
+        '''
+        session = ModalSession(flow)
+        self.cache.set(view_id, session)
+        return session
+
+    def select(self, body, flow):
+        '''
+        Records the option chosen in the `block_actions` payload `body`, returns the session
+        '''
+        view_id = body['view']['id']
+        session = self.cache.get(view_id)
+        if session is None or session.flow != flow:
+            session = ModalSession(flow, _from_state(body['view'].get('state', {}).get('values', {}), flow))
+            self.cache.set(view_id, session)
+        action = body['actions'][0]
+        session.select(action['action_id'], action['selected_option']['value'])
+        return session
+
+    def close(self, view_id):
+        self.cache.invalidate(view_id)
+
+
+def _from_state(values, flow):
+    selected = {}
+    for block_id, action_id in INPUTS[flow]:
+        option = values.get(block_id, {}).get(action_id, {}).get('selected_option')
+        if option:
+            selected[action_id] = option['value']
+    return selected
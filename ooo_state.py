@@ -0,0 +1,244 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+
+OOO_STATUS = "Out of Office"
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def reply_text(sender, state):
+    '''
+    The auto reply sent to `sender` on behalf of an Out of Office receiver
+    '''
+    expiration = state.status_expiration
+    if not expiration == 0:
+        dt = datetime.datetime.fromtimestamp(expiration)
+        return f"Hi, <@{ sender }>!!!\nI am Out of Office and will be back on {dt}"
+    # add career manager instead of U032ATMNLVC or any other profile field that may exist.
+    return f"Hi, <@{ sender }>!!!\nI'll be Out of Office for a while.\nIn case of emergency please reach out to <@U032ATMNLVC>.\nThanks"
+
+
+class UserState:
+    '''
+    What the auto responder needs to know about one user, kept current from events
+    '''
+    __slots__ = ('user_id', 'team_id', 'enterprise_id', 'status_text', 'status_expiration', 'presence', 'presence_at')
+
+    def __init__(self, user_id, team_id = None, enterprise_id = None, status_text = '', status_expiration = 0):
+        self.user_id = user_id
+        self.team_id = team_id
+        self.enterprise_id = enterprise_id
+        self.status_text = status_text
+        self.status_expiration = status_expiration
+        self.presence = None
+        self.presence_at = 0.0
+
+    @classmethod
+    def from_user(cls, user):
+        '''
+        From a Slack user object (`users.info`, `user_change`, `user_status_changed`)
+        '''
+        profile = user.get("profile", {})
+        return cls(
+            user["id"],
+            team_id = user.get("team_id"),
+            enterprise_id = user.get("enterprise_id"),
+            status_text = profile.get("status_text", ''),
+            status_expiration = profile.get("status_expiration", 0) or 0,
+        )
+
+    def is_ooo(self, now = None):
+        if self.status_text != OOO_STATUS:
+            return False
+        if self.status_expiration:
+            return self.status_expiration > (now or time.time())
+        return True
+
+    def to_dict(self):
+        return {
+            'team_id': self.team_id,
+            'enterprise_id': self.enterprise_id,
+            'status_text': self.status_text,
+            'status_expiration': self.status_expiration,
+        }
+
+
+def connect(path):
+    '''
+    SQLite connection to the `statuses` table at `path`, created when missing
+    '''
+    conn = sqlite3.connect(path, check_same_thread = False, isolation_level = None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA busy_timeout=5000')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS statuses (
+            user_id TEXT PRIMARY KEY,
+            team_id TEXT,
+            enterprise_id TEXT,
+            status_text TEXT NOT NULL,
+            status_expiration INTEGER NOT NULL,
+            presence TEXT,
+            presence_at REAL NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    return conn
+
+
+def legacy_statuses(path):
+    '''
+    {user_id: status} of the JSON file earlier versions kept at `path`, the file is moved to `path`.bak
+    '''
+    try:
+        with open(path, 'rb') as fp:
+            header = fp.read(len(SQLITE_HEADER))
+    except FileNotFoundError:
+        return {}
+    if not header or header == SQLITE_HEADER:
+        return {}
+    with open(path, 'r') as fp:
+        data = json.load(fp)
+    os.replace(path, path + '.bak')
+    return data
+
+
+class OOOStateTable:
+    '''
+    Per user Out of Office state, updated by `user_status_changed` / `user_change` and presence events.
+
+    Lookups are plain dict reads. When `path` is set each status change (not presence, which goes
+    stale quickly) is written through to its row of a SQLite table, loaded back on start
+    '''
+    def __init__(self, path = None):
+        self.path = path
+        self._users = {}
+        self._lock = threading.Lock()
+        self.conn = None
+        if not path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        legacy = legacy_statuses(path)
+        self.conn = connect(path)
+        for user_id, data in legacy.items():
+            self._save(UserState(user_id, **data))
+        rows = self.conn.execute('SELECT user_id, team_id, enterprise_id, status_text, status_expiration FROM statuses')
+        for row in rows:
+            self._users[row[0]] = UserState(*row)
+
+    @classmethod
+    def from_config(cls, configur, section = 'autoresp'):
+        '''
+        `BACKEND = sqlite` in `[autoresp]` picks SharedOOOStateTable, for several worker processes
+        '''
+        if configur.get(section, "BACKEND", fallback = 'memory') == 'sqlite':
+            return SharedOOOStateTable(configur.get(section, "STATE_PATH", fallback = 'data/ooo_state.db'))
+        return cls(configur.get(section, "STATE_PATH", fallback = None))
+
+    def after_fork(self):
+        '''
+        SQLite connections must not be used across fork, the child opens its own
+        '''
+        self._lock = threading.Lock()
+        if self.conn is not None:
+            self.conn = connect(self.path)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+    def get(self, user_id):
+        return self._users.get(user_id)
+
+    def update_user(self, user):
+        '''
+        Records the status carried by a Slack user object, returns the new UserState
+        '''
+        state = UserState.from_user(user)
+        with self._lock:
+            old = self._users.get(state.user_id)
+            if old is not None:
+                state.presence, state.presence_at = old.presence, old.presence_at
+            self._users[state.user_id] = state
+            if old is None or old.to_dict() != state.to_dict():
+                self._save(state)
+        return state
+
+    def update_presence(self, user_id, presence):
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is not None:
+                state.presence, state.presence_at = presence, time.monotonic()
+
+    def presence(self, user_id, max_age):
+        '''
+        Presence seen from an event within the last `max_age` seconds, else None
+        '''
+        state = self._users.get(user_id)
+        if state is None or state.presence is None or time.monotonic() - state.presence_at > max_age:
+            return None
+        return state.presence
+
+    def _save(self, state):
+        # Called with the lock held (or before the table is shared), writes the one row
+        if self.conn is None:
+            return
+        self.conn.execute(
+            '''INSERT OR REPLACE INTO statuses (user_id, team_id, enterprise_id, status_text, status_expiration)
+            VALUES (?, ?, ?, ?, ?)''',
+            (state.user_id, state.team_id, state.enterprise_id, state.status_text, state.status_expiration)
+        )
+
+
+class SharedOOOStateTable(OOOStateTable):
+    '''
+    OOOStateTable kept in a SQLite file (WAL) instead of process memory, so an event handled
+    by one worker process is seen by the others. Presence is stored with a wall clock
+    timestamp since the monotonic clock is not comparable across processes
+    '''
+    COLUMNS = ('team_id', 'enterprise_id', 'status_text', 'status_expiration', 'presence', 'presence_at')
+
+    def __init__(self, path = 'data/ooo_state.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        self.conn = connect(path)
+
+    def get(self, user_id):
+        with self._lock:
+            row = self.conn.execute(
+                f'SELECT {", ".join(self.COLUMNS)} FROM statuses WHERE user_id = ?', (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        state = UserState(user_id, *row[:4])
+        state.presence, state.presence_at = row[4], row[5]
+        return state
+
+    def update_user(self, user):
+        state = UserState.from_user(user)
+        with self._lock:
+            # Keeps the presence columns of an existing row
+            self.conn.execute(
+                '''INSERT INTO statuses (user_id, team_id, enterprise_id, status_text, status_expiration) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET team_id = excluded.team_id, enterprise_id = excluded.enterprise_id,
+                status_text = excluded.status_text, status_expiration = excluded.status_expiration''',
+                (state.user_id, state.team_id, state.enterprise_id, state.status_text, state.status_expiration)
+            )
+        return state
+
+    def update_presence(self, user_id, presence):
+        with self._lock:
+            self.conn.execute(
+                'UPDATE statuses SET presence = ?, presence_at = ? WHERE user_id = ?',
+                (presence, time.time(), user_id)
+            )
+
+    def presence(self, user_id, max_age):
+        state = self.get(user_id)
+        if state is None or state.presence is None or time.time() - state.presence_at > max_age:
+            return None
+        return state.presence
+
@@ -0,0 +1,437 @@
+'''
+Client side rate limiting of the Slack Web API calls, shared by every client of the process.
+
+Each (token, method) pair gets a token bucket refilled at the method's tier rate, chat.postMessage
+is limited per channel instead (1 per second, short bursts). Slack counts every method separately,
+so buckets never compete: the callers of one bucket are served in arrival order, each sleeping on
+its bucket's own condition. A method's wait class bounds how long its calls may wait: views.* give
+up first (their trigger_id expires 3 seconds after the click), background messages like the Out of
+Office replies and ticket DMs wait longest. A 429 answer blocks its bucket for `Retry-After` seconds
+and the call is retried when that fits in its wait.
+
+    # config.ini, optional
+    [ratelimit]
+    ENABLED = yes
+    # Tier rates are Slack's documented minimums, scale them up if the workspace gets more
+    SCALE = 1.0
+    # Seconds a call waits for its bucket at most, then it is sent anyway
+    MAX_WAIT_INTERACTIVE = 2
+    MAX_WAIT = 10
+    MAX_WAIT_BACKGROUND = 60
+    RETRIES = 2
+
+    slack_ratelimit_wait_seconds{method}      wait for a bucket before sending
+    slack_ratelimit_waiting                   calls waiting for a bucket right now
+    slack_ratelimit_queued_total{wait_class}  calls that had to wait
+    slack_ratelimit_overrun_total{method}     calls sent after waiting MAX_WAIT without a free slot
+    slack_ratelimited_total{method}           429 answers from Slack
+'''
+import asyncio
+import collections
+import functools
+import threading
+import time
+from slack_sdk.errors import SlackApiError
+import metrics
+from instrumentation import LATENCY_BUCKETS
+
+# (calls per minute, burst) of Slack's tiers, https://api.slack.com/apis/rate-limits
+TIER_1 = (1, 1)
+TIER_2 = (20, 5)
+TIER_3 = (50, 10)
+TIER_4 = (100, 20)
+PER_CHANNEL = (60, 3)
+
+TIERS = {
+    'views.open': TIER_4,
+    'views.update': TIER_4,
+    'views.push': TIER_4,
+    'views.publish': TIER_4,
+    'users.info': TIER_4,
+    'users.getPresence': TIER_3,
+    'users.setPresence': TIER_2,
+    'users.list': TIER_2,
+    'conversations.info': TIER_3,
+    'conversations.history': TIER_3,
+    'conversations.open': TIER_3,
+    'chat.postEphemeral': TIER_4,
+    'chat.update': TIER_3,
+    'chat.delete': TIER_3,
+    'chat.postMessage': PER_CHANNEL,
+}
+# Limited per channel rather than per method
+CHANNEL_METHODS = frozenset(('chat.postMessage',))
+
+# How long a call may wait for its bucket, indexes `max_wait`
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+WAIT_CLASS_NAMES = ('interactive', 'normal', 'background')
+
+WAIT_CLASSES = {
+    'views.open': INTERACTIVE,
+    'views.update': INTERACTIVE,
+    'views.push': INTERACTIVE,
+    'chat.postMessage': BACKGROUND,
+    'users.setPresence': BACKGROUND,
+}
+
+# Idle buckets are dropped past this many, chat.postMessage makes one per DM channel
+MAX_BUCKETS = 10000
+
+wait_time = metrics.histogram('slack_ratelimit_wait_seconds', 'Wait for a rate limit slot per Slack method', LATENCY_BUCKETS, labels = ('method',))
+queued = metrics.counter('slack_ratelimit_queued_total', 'Slack calls that waited for a rate limit slot per wait class', labels = ('wait_class',))
+overruns = metrics.counter('slack_ratelimit_overrun_total', 'Slack calls sent after waiting the most allowed without a slot', labels = ('method',))
+limited = metrics.counter('slack_ratelimited_total', '429 answers from Slack per method', labels = ('method',))
+
+
+class Bucket:
+    '''
+    Token bucket of `burst` calls refilled at `rate` per second, unlimited when `rate` is None.
+    `blocked_until` is set from a 429's Retry-After, `ready` -> the condition its callers wait on
+    '''
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp', 'blocked_until', 'waiters', 'ready')
+
+    def __init__(self, rate, burst, now, ready = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+        self.blocked_until = 0.0
+        # The callers waiting in arrival order, the first one takes the next slot
+        self.waiters = collections.deque()
+        self.ready = ready
+
+    def delay(self, now):
+        '''
+        Seconds until a call can go out, 0 when it can now
+        '''
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.rate is None:
+            return 0
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate is not None:
+            self.tokens -= 1
+
+    def block(self, now, seconds):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+        self.stamp = max(self.stamp, self.blocked_until)
+
+    def idle(self, now):
+        return not self.waiters and now >= self.blocked_until and (self.rate is None or self.delay(now) == 0 and self.tokens >= self.burst)
+
+
+def request_token(client, kwargs):
+    '''
+    Token a call is made with, a `token` argument wins over the client's own
+    '''
+    for args in (kwargs.get('params'), kwargs.get('json'), kwargs.get('data')):
+        if isinstance(args, dict) and args.get('token'):
+            return args['token']
+    return client.token
+
+
+def _channel(kwargs):
+    for args in (kwargs.get('json'), kwargs.get('data'), kwargs.get('params')):
+        if isinstance(args, dict) and args.get('channel'):
+            return args['channel']
+    return None
+
+
+def retry_after(error):
+    '''
+    Seconds Slack asked to wait in a 429 SlackApiError, None for any other error
+    '''
+    response = getattr(error, 'response', None)
+    if response is None or response.status_code != 429:
+        return None
+    for name, value in (response.headers or {}).items():
+        if name.lower() == 'retry-after':
+            try:
+                return float(value[0] if isinstance(value, list) else value)
+            except ValueError:
+                break
+    return 1.0
+
+
+class _Limits:
+    def __init__(self, scale = 1.0, max_wait = (2.0, 10.0, 60.0), retries = 2):
+        self.scale = scale
+        self.max_wait = max_wait
+        self.retries = retries
+        self.buckets = {}
+        self.waiting = 0
+        metrics.gauge('slack_ratelimit_waiting', 'Slack calls waiting for a rate limit slot', lambda: self.waiting)
+
+    def _bucket(self, key, method, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= MAX_BUCKETS:
+                self._prune(now)
+            per_minute, burst = TIERS.get(method, (None, 1))
+            rate = per_minute * self.scale / 60 if per_minute else None
+            bucket = self.buckets[key] = Bucket(rate, burst, now, self._condition())
+        return bucket
+
+    def _condition(self):
+        raise NotImplementedError
+
+    def _prune(self, now):
+        for key in [key for key, bucket in self.buckets.items() if bucket.idle(now)]:
+            del self.buckets[key]
+
+    def _key(self, client, api_method, kwargs):
+        token = request_token(client, kwargs)
+        if api_method in CHANNEL_METHODS:
+            return (token, api_method, _channel(kwargs))
+        return (token, api_method)
+
+    def _enter(self, bucket):
+        entry = object()
+        bucket.waiters.append(entry)
+        self.waiting += 1
+        return entry
+
+    def _leave(self, bucket, entry):
+        if bucket.waiters[0] is entry:
+            bucket.waiters.popleft()
+        else:
+            bucket.waiters.remove(entry)
+        self.waiting -= 1
+
+    def _next_wait(self, bucket, entry, now, deadline):
+        '''
+        0 when the call `entry` can go now, None past its deadline, otherwise seconds to sleep
+        '''
+        if bucket.waiters[0] is entry:
+            delay = bucket.delay(now)
+            if delay == 0:
+                bucket.take()
+                return 0
+        else:
+            delay = deadline - now
+        if now >= deadline:
+            return None
+        return min(delay, deadline - now)
+
+    def _waited(self, api_method, wait_class, started, granted):
+        elapsed = time.monotonic() - started
+        wait_time.labels(api_method).observe(elapsed)
+        if elapsed > 0.001:
+            queued.labels(WAIT_CLASS_NAMES[wait_class]).inc()
+        if not granted:
+            overruns.labels(api_method).inc()
+
+
+class RateLimiter(_Limits):
+    '''
+    Rate limits the calls of the WebClients passed to wrap(), callers wait on their bucket in the calling thread.
+    The buckets' conditions share one lock, held only while a bucket is looked at
+    '''
+    def __init__(self, scale = 1.0, max_wait = (2.0, 10.0, 60.0), retries = 2):
+        super().__init__(scale, max_wait, retries)
+        self._lock = threading.Lock()
+
+    def _condition(self):
+        return threading.Condition(self._lock)
+
+    def acquire(self, key, api_method, wait_class, deadline):
+        '''
+        Waits for a slot of `key`'s bucket, returns False when `deadline` (monotonic) passed first
+        '''
+        started = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(key, api_method, started)
+            entry = self._enter(bucket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._next_wait(bucket, entry, now, deadline)
+                    if not wait:
+                        break
+                    bucket.ready.wait(wait)
+            finally:
+                self._leave(bucket, entry)
+                # Only this bucket's callers can go next
+                bucket.ready.notify_all()
+        self._waited(api_method, wait_class, started, wait == 0)
+        return wait == 0
+
+    def block(self, key, api_method, seconds):
+        with self._lock:
+            now = time.monotonic()
+            self._bucket(key, api_method, now).block(now, seconds)
+
+    def wrap(self, client):
+        '''
+        Routes `client`'s calls through the limiter, WebClient methods all go through `api_call`.
+        Clients already wrapped are left as they are
+        '''
+        api_call = client.api_call
+        if getattr(api_call, 'rate_limited', False):
+            return client
+
+        @functools.wraps(api_call)
+        def call(api_method, *args, **kwargs):
+            key = self._key(client, api_method, kwargs)
+            wait_class = WAIT_CLASSES.get(api_method, NORMAL)
+            deadline = time.monotonic() + self.max_wait[wait_class]
+            error = None
+            for _ in range(self.retries + 1):
+                if not self.acquire(key, api_method, wait_class, deadline) and error is not None:
+                    raise error
+                try:
+                    return api_call(api_method, *args, **kwargs)
+                except SlackApiError as e:
+                    seconds = retry_after(e)
+                    if seconds is None:
+                        raise
+                    limited.labels(api_method).inc()
+                    self.block(key, api_method, seconds)
+                    if time.monotonic() + seconds > deadline:
+                        raise
+                    error = e
+            raise error
+
+        call.rate_limited = True
+        client.api_call = call
+        return client
+
+
+class AsyncRateLimiter(_Limits):
+    '''
+    RateLimiter for AsyncWebClients, callers wait as tasks on the event loop
+    '''
+    def _condition(self):
+        # Buckets are made inside the running loop, by the first call that needs them
+        return asyncio.Condition()
+
+    async def acquire(self, key, api_method, wait_class, deadline):
+        started = time.monotonic()
+        bucket = self._bucket(key, api_method, started)
+        async with bucket.ready:
+            entry = self._enter(bucket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._next_wait(bucket, entry, now, deadline)
+                    if not wait:
+                        break
+                    try:
+                        await asyncio.wait_for(bucket.ready.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._leave(bucket, entry)
+                bucket.ready.notify_all()
+        self._waited(api_method, wait_class, started, wait == 0)
+        return wait == 0
+
+    def block(self, key, api_method, seconds):
+        now = time.monotonic()
+        self._bucket(key, api_method, now).block(now, seconds)
+
+    def wrap(self, client):
+        api_call = client.api_call
+        if getattr(api_call, 'rate_limited', False):
+            return client
+
+        @functools.wraps(api_call)
+        async def call(api_method, *args, **kwargs):
+            key = self._key(client, api_method, kwargs)
+            wait_class = WAIT_CLASSES.get(api_method, NORMAL)
+            deadline = time.monotonic() + self.max_wait[wait_class]
+            error = None
+            for _ in range(self.retries + 1):
+                if not await self.acquire(key, api_method, wait_class, deadline) and error is not None:
+                    raise error
+                try:
+                    return await api_call(api_method, *args, **kwargs)
+                except SlackApiError as e:
+                    seconds = retry_after(e)
+                    if seconds is None:
+                        raise
+                    limited.labels(api_method).inc()
+                    self.block(key, api_method, seconds)
+                    if time.monotonic() + seconds > deadline:
+                        raise
+                    error = e
+            raise error
+
+        call.rate_limited = True
+        client.api_call = call
+        return client
+
+
+# One limiter per process, app.py and app_autoresp.py share it when both run in service.py
+_limiters = {}
+
+
+def _settings(configur, section):
+    return dict(
+        scale = configur.getfloat(section, "SCALE", fallback = 1.0),
+        max_wait = (
+            configur.getfloat(section, "MAX_WAIT_INTERACTIVE", fallback = 2.0),
+            configur.getfloat(section, "MAX_WAIT", fallback = 10.0),
+            configur.getfloat(section, "MAX_WAIT_BACKGROUND", fallback = 60.0),
+        ),
+        retries = configur.getint(section, "RETRIES", fallback = 2),
+    )
+
+
+def open_limiter(configur, section = 'ratelimit'):
+    '''
+    The process' RateLimiter, None when `[ratelimit] ENABLED` is off
+    '''
+    if not configur.getboolean(section, "ENABLED", fallback = True):
+        return None
+    if 'sync' not in _limiters:
+        _limiters['sync'] = RateLimiter(**_settings(configur, section))
+    return _limiters['sync']
+
+
+def open_async_limiter(configur, section = 'ratelimit'):
+    if not configur.getboolean(section, "ENABLED", fallback = True):
+        return None
+    if 'async' not in _limiters:
+        _limiters['async'] = AsyncRateLimiter(**_settings(configur, section))
+    return _limiters['async']
+
+
+def limit(app, configur):
+    '''
+    Rate limits `app.client` and the per request clients Bolt hands to the listeners
+    '''
+    limiter = open_limiter(configur)
+    if limiter is None:
+        return None
+    limiter.wrap(app.client)
+
+    @app.middleware
+    def rate_limit_client(context, next):
+        if context.client is not None:
+            limiter.wrap(context.client)
+        next()
+
+    return limiter
+
+
+def async_limit(app, configur):
+    limiter = open_async_limiter(configur)
+    if limiter is None:
+        return None
+    limiter.wrap(app.client)
+
+    @app.middleware
+    async def rate_limit_client(context, next):
+        if context.client is not None:
+            limiter.wrap(context.client)
+        await next()
+
+    return limiter
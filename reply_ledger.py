@@ -0,0 +1,195 @@
+import collections
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+# Seconds a reply we posted is remembered, Slack delivers its own message event within seconds
+SENT_TTL = 600
+SENT_MAX = 100000
+
+
+def app_message(event, body):
+    '''
+    True when `event` is a message our app posted, Slack tags those with the app id
+    '''
+    return bool(event.get("app_id")) and event.get("app_id") == body.get("api_app_id")
+
+
+class ReplyLedger:
+    '''
+    Remembers, per (receiver, channel), the day we last auto replied and how many messages
+    arrived unanswered since, so the reply policy needs no `conversations.history` scan.
+
+    Policy: reply to the first message of the day, then once every `reply_every`
+    unresponded messages. A message from the receiver in the channel starts over.
+    Our reply is posted with the receiver's token, so Slack sends it back as the receiver's
+    message: replies being posted and the ts of the ones sent are kept, is_reply() tells them apart.
+
+    The ledger lives in memory and is written through to a small SQLite table at `path`
+    (":memory:" keeps it in process only). With `shared` every lookup reads the table inside
+    an IMMEDIATE transaction instead, so several worker processes (service.py) agree on it.
+    Only today's entries matter, earlier days are deleted on load and with the first message of each day
+    '''
+    def __init__(self, path = 'data/replies.db', reply_every = 10, shared = False):
+        self.path = path
+        self.reply_every = reply_every
+        self.shared = shared
+        self._lock = threading.Lock()
+        # (receiver, channel) -> replies being posted, their event can come before their ts is known
+        self._posting = collections.Counter()
+        # (channel, ts) -> monotonic time posted, oldest first
+        self._sent = collections.OrderedDict()
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        self._connect()
+        self._day = datetime.date.today().isoformat()
+        self.conn.execute('DELETE FROM replies WHERE day < ?', (self._day,))
+        self._entries = {} if shared else {
+            (receiver, channel): [day, unanswered]
+            for receiver, channel, day, unanswered in self.conn.execute('SELECT receiver, channel, day, unanswered FROM replies')
+        }
+
+    def _connect(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread = False, isolation_level = None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS replies (
+                receiver TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                day TEXT NOT NULL,
+                unanswered INTEGER NOT NULL,
+                PRIMARY KEY (receiver, channel)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS sent (
+                channel TEXT NOT NULL,
+                ts TEXT NOT NULL,
+                at REAL NOT NULL,
+                PRIMARY KEY (channel, ts)
+            ) WITHOUT ROWID
+        ''')
+
+    @classmethod
+    def from_config(cls, configur, section = 'autoresp'):
+        return cls(
+            path = configur.get(section, "LEDGER_PATH", fallback = 'data/replies.db'),
+            reply_every = configur.getint(section, "REPLY_EVERY", fallback = 10),
+            shared = configur.get(section, "BACKEND", fallback = 'memory') == 'sqlite',
+        )
+
+    def _next(self, entry, today):
+        '''
+        Applies the reply policy to a stored [day, unanswered], returns (entry, reply)
+        '''
+        if entry is None or entry[0] != today:
+            return [today, 0], True
+        entry[1] += 1
+        if entry[1] >= self.reply_every:
+            entry[1] = 0
+            return entry, True
+        return entry, False
+
+    def _rollover(self, today):
+        # First message of a new day, the entries of the days before can only restart the count
+        self._day = today
+        self._entries = {key: entry for key, entry in self._entries.items() if entry[0] >= today}
+        self.conn.execute('DELETE FROM replies WHERE day < ?', (today,))
+
+    def record_inbound(self, receiver, channel, today = None):
+        '''
+        Counts a message to an Out of Office `receiver`, returns True when it should get a reply
+        '''
+        today = (today or datetime.date.today()).isoformat()
+        key = (receiver, channel)
+        with self._lock:
+            if today > self._day:
+                self._rollover(today)
+            if self.shared:
+                cur = self.conn.cursor()
+                cur.execute('BEGIN IMMEDIATE')
+                try:
+                    row = cur.execute('SELECT day, unanswered FROM replies WHERE receiver = ? AND channel = ?', key).fetchone()
+                    entry, reply = self._next(list(row) if row else None, today)
+                    cur.execute(
+                        'INSERT OR REPLACE INTO replies (receiver, channel, day, unanswered) VALUES (?, ?, ?, ?)',
+                        (receiver, channel, entry[0], entry[1])
+                    )
+                    cur.execute('COMMIT')
+                except BaseException:
+                    if self.conn.in_transaction:
+                        cur.execute('ROLLBACK')
+                    raise
+                return reply
+            entry, reply = self._next(self._entries.get(key), today)
+            self._entries[key] = entry
+            self.conn.execute(
+                'INSERT OR REPLACE INTO replies (receiver, channel, day, unanswered) VALUES (?, ?, ?, ?)',
+                (receiver, channel, entry[0], entry[1])
+            )
+        return reply
+
+    def forget(self, receiver, channel):
+        '''
+        Drops the entry, the next message gets a reply. Used when the receiver answers
+        themselves or when sending our reply failed
+        '''
+        key = (receiver, channel)
+        with self._lock:
+            if self._entries.pop(key, None) is not None or self.shared:
+                self.conn.execute('DELETE FROM replies WHERE receiver = ? AND channel = ?', key)
+
+    def posting(self, receiver, channel):
+        '''
+        Marks a reply to `channel` as being posted, call posted() once Slack answered
+        '''
+        with self._lock:
+            self._posting[(receiver, channel)] += 1
+
+    def posted(self, receiver, channel, ts = None):
+        '''
+        The reply marked by posting() is message `ts` of `channel`, None when posting it failed
+        '''
+        now = time.monotonic()
+        key = (receiver, channel)
+        with self._lock:
+            self._posting[key] -= 1
+            if self._posting[key] <= 0:
+                del self._posting[key]
+            if ts is None:
+                return
+            if self.shared:
+                # Wall clock, the other worker processes read it
+                self.conn.execute('INSERT OR REPLACE INTO sent (channel, ts, at) VALUES (?, ?, ?)', (channel, ts, time.time()))
+                self.conn.execute('DELETE FROM sent WHERE at <= ?', (time.time() - SENT_TTL,))
+                return
+            self._sent[(channel, ts)] = now
+            while self._sent and (len(self._sent) > SENT_MAX or now - next(iter(self._sent.values())) >= SENT_TTL):
+                self._sent.popitem(last = False)
+
+    def is_reply(self, receiver, channel, ts):
+        '''
+        True when the receiver's message `ts` in `channel` is a reply we posted, not the receiver answering.
+        While a reply to the channel is being posted every message of the receiver there counts as it
+        '''
+        with self._lock:
+            if self._posting.get((receiver, channel)):
+                return True
+            if self.shared:
+                return self.conn.execute('SELECT 1 FROM sent WHERE channel = ? AND ts = ?', (channel, ts)).fetchone() is not None
+            return self._sent.pop((channel, ts), None) is not None
+
+    def after_fork(self):
+        '''
+        SQLite connections must not be used across fork, the child opens its own
+        '''
+        self._lock = threading.Lock()
+        if self.path != ':memory:':
+            self._connect()
+
+    def close(self):
+        self.conn.close()
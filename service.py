@@ -0,0 +1,116 @@
+'''
+One WSGI app serving both the help desk (app.py) and the auto responder (app_autoresp.py)
+over HTTP, meant to run under gunicorn with several workers (see gunicorn.conf.py):
+
+    gunicorn -c gunicorn.conf.py service:flask_app
+
+Both apps are built once in the gunicorn master (`preload_app`), so config parsing, the
+catalog snapshot, the Jira createmeta check and the imports are done before forking and
+shared copy on write. The rest is built on first use in the workers (see `HelpDesk` in app.py),
+and `post_fork` gives each worker its own SQLite and Jira connections and starts its ticket
+worker threads.
+
+State shared between workers lives in SQLite files: `[catalog] BACKEND = sqlite`,
+`[autoresp] BACKEND = sqlite` and `[events] BACKEND = sqlite`, gunicorn.conf.py refuses more
+than one worker without them. The user cache stays per worker, bounded by its TTL, the
+installation caches drop their entries when any worker saves or deletes an installation.
+Every worker writes its metrics to `[service] METRICS_DIR`, /metrics serves them all
+'''
+import glob
+import os
+import threading
+import time
+from flask import Flask, Response, request
+from slack_bolt.adapter.flask import SlackRequestHandler
+import app as helpdesk
+import app_autoresp as autoresp
+import metrics
+import traffic_capture
+import event_dedup
+
+flask_app = Flask(__name__)
+helpdesk_handler = SlackRequestHandler(helpdesk.app)
+autoresp_handler = SlackRequestHandler(autoresp.app)
+# Read in the master, the workers share the snapshot
+helpdesk.catalogs
+# A create screen without the fields the pipeline needs raises MissingFields here, stopping the master once
+helpdesk.helpdesk().load_meta()
+
+configur = helpdesk.helpdesk().configur
+METRICS_DIR = configur.get("service", "METRICS_DIR", fallback = "data/metrics")
+# Seconds between two writes of a worker's metrics, a scrape reaching another worker sees them this late at most
+METRICS_INTERVAL = configur.getfloat("service", "METRICS_INTERVAL", fallback = 5)
+
+# Help desk: Event Subscriptions, Interactivity and Select Menus (options load) URL
+@flask_app.route("/slack/helpdesk/events", methods=["POST"])
+def helpdesk_events():
+    return helpdesk_handler.handle(request)
+
+# Auto responder, same paths as a standalone app_autoresp.py
+@flask_app.route("/slack/events", methods=["POST"])
+def slack_events():
+    return autoresp_handler.handle(request)
+
+@flask_app.route("/slack/install", methods=["GET"])
+def install():
+    return autoresp_handler.handle(request)
+
+@flask_app.route("/slack/oauth_redirect", methods=["GET"])
+def oauth_redirect():
+    return autoresp_handler.handle(request)
+
+def metrics_path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+# Prometheus scrape target. Every worker keeps its own metrics and writes them to METRICS_DIR,
+# the scrape gets those of every worker, labelled with its pid
+@flask_app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    os.makedirs(METRICS_DIR, exist_ok = True)
+    metrics.dump(metrics_path(os.getpid()))
+    paths = {os.path.basename(path)[:-len(".json")]: path for path in glob.glob(os.path.join(METRICS_DIR, "*.json"))}
+    return Response(metrics.render(metrics.merged(paths)), mimetype="text/plain; version=0.0.4")
+
+def publish_metrics():
+    # Daemon thread of every worker
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        try:
+            metrics.dump(metrics_path(os.getpid()))
+        except OSError as err:
+            print(f'Metrics not written: {err}')
+
+def clear_worker_metrics():
+    '''
+    Called in the gunicorn master on start, drops the metrics files of an earlier run
+    '''
+    os.makedirs(METRICS_DIR, exist_ok = True)
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        os.remove(path)
+
+def worker_exit(pid):
+    '''
+    Called in the gunicorn master when a worker exited, its metrics leave /metrics with it
+    '''
+    try:
+        os.remove(metrics_path(pid))
+    except FileNotFoundError:
+        pass
+
+def post_fork():
+    '''
+    Called in every worker right after the fork, resets what must not be shared with the master
+    '''
+    helpdesk.helpdesk().after_fork()
+    # The createmeta was checked in the master
+    helpdesk.helpdesk().pipeline.start()
+    autoresp.responder().after_fork()
+    traffic_capture.after_fork()
+    event_dedup.after_fork()
+    os.makedirs(METRICS_DIR, exist_ok = True)
+    threading.Thread(target = publish_metrics, name = 'metrics-publish', daemon = True).start()
+
+if __name__ == "__main__":
+    # Single process, for local testing
+    helpdesk.helpdesk().start()
+    flask_app.run(host='0.0.0.0', port=3000)
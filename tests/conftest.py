@@ -0,0 +1,203 @@
+'''
+Shared fixtures: the help desk and auto responder, threaded (App) or asyncio (AsyncApp),
+built by their app factories against the mock Slack and Jira of benchmarks/
+'''
+import asyncio
+import concurrent.futures
+import json
+import os
+import sys
+import threading
+import time
+from configparser import ConfigParser
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from slack_bolt import BoltRequest
+from slack_bolt.request.async_request import AsyncBoltRequest
+from benchmarks.load_test import write_config
+from benchmarks.mock_jira import MockJira
+from benchmarks.mock_slack import MockSlack
+from lazy import built
+
+OOO_RECEIVER = 'UOOO0001'
+
+
+def wait_until(condition, timeout = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out waiting for the listeners')
+        time.sleep(0.01)
+
+
+class SyncDriver:
+    '''
+    Dispatches payloads into a Bolt App as Socket Mode does, settle() waits for the listeners it started
+    '''
+    def __init__(self, app, close = None):
+        self.app = app
+        self._close = close
+        self.futures = []
+        executor = app.listener_runner.listener_executor
+        submit = executor.submit
+
+        def tracked(fn, *args, **kwargs):
+            future = submit(fn, *args, **kwargs)
+            self.futures.append(future)
+            return future
+
+        executor.submit = tracked
+
+    def dispatch(self, body):
+        return self.app.dispatch(BoltRequest(body = json.dumps(body), mode = 'socket_mode'))
+
+    def settle(self):
+        concurrent.futures.wait(self.futures)
+
+    def close(self):
+        if self._close is not None:
+            self._close()
+
+
+class AsyncDriver:
+    '''
+    SyncDriver for an AsyncApp, run on an event loop in its own thread. `background()` -> tasks
+    that never finish (eg. ticket workers), they and the tasks they start are left out of settle()
+    '''
+    def __init__(self, app, background = lambda: (), close = None):
+        self.app = app
+        self.background = background
+        self._close = close
+        self.tasks = set()
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_task_factory(self._track)
+        self.thread = threading.Thread(target = self.loop.run_forever, daemon = True)
+        self.thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout = 30)
+
+    def dispatch(self, body):
+        return self.run(self.app.async_dispatch(AsyncBoltRequest(body = json.dumps(body), mode = 'socket_mode')))
+
+    def _track(self, loop, coro, **kwargs):
+        task = asyncio.Task(coro, loop = loop, **kwargs)
+        if asyncio.current_task(loop) not in set(self.background()):
+            self.tasks.add(task)
+        return task
+
+    async def _settle(self):
+        while True:
+            pending = {task for task in self.tasks if not task.done()} - {asyncio.current_task()} - set(self.background())
+            if not pending:
+                return
+            await asyncio.wait(pending)
+
+    def settle(self):
+        self.run(self._settle())
+
+    def close(self):
+        if self._close is not None:
+            self.run(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class Echo:
+    '''
+    MockSlack `on_post` hook sending every auto reply back to the app as its receiver's message,
+    from another thread and before the app gets Slack's answer, as Slack does
+    '''
+    def __init__(self):
+        self.driver = None
+        self.pool = concurrent.futures.ThreadPoolExecutor(2)
+        self.futures = []
+
+    def __call__(self, token, args, answer):
+        from benchmarks.load_test import message_event
+        # Replies are posted with the receiver's user token, to the sender
+        receiver = token.rpartition('xoxp-')[2]
+        if receiver and self.driver is not None:
+            body = message_event(args['channel'], receiver, 10 ** 8 + len(self.futures), author = receiver,
+                                 ts = answer['ts'], text = args.get('text'))
+            self.futures.append(self.pool.submit(self.driver.dispatch, body))
+
+    def settle(self):
+        # Echoes start listeners, whose replies echo again
+        while True:
+            done = len(self.futures)
+            concurrent.futures.wait(self.futures)
+            self.driver.settle()
+            if len(self.futures) == done:
+                return
+
+
+@pytest.fixture
+def echo():
+    return Echo()
+
+
+@pytest.fixture
+def slack(echo):
+    with MockSlack(ooo_users = [OOO_RECEIVER], on_post = echo) as mock:
+        yield mock
+
+
+@pytest.fixture
+def jira():
+    with MockJira() as mock:
+        yield mock
+
+
+@pytest.fixture
+def configur(tmp_path, monkeypatch, slack, jira):
+    # The apps read the catalog and keep their SQLite files relative to the working directory
+    write_config(str(tmp_path), slack, jira, departments = 3, categories = 5)
+    monkeypatch.chdir(tmp_path)
+    configur = ConfigParser()
+    configur.read('config.ini')
+    # The seen-set of event_dedup.py is per process, every test reuses the same event ids
+    configur.read_dict({'events': {'DEDUP': 'no'}})
+    return configur
+
+
+def helpdesk_driver(kind, configur):
+    if kind == 'sync':
+        import app
+        desk = app.create_app(configur, token_verification = False)
+        return desk, SyncDriver(desk.app, close = lambda: built(desk, 'pipeline') and desk.pipeline.stop())
+    import async_app
+    desk = async_app.create_app(configur)
+    return desk, AsyncDriver(desk.app, background = lambda: desk.pipeline.workers if built(desk, 'pipeline') else (), close = desk.close)
+
+
+def autoresp_driver(kind, configur):
+    if kind == 'sync':
+        import app_autoresp
+        responder = app_autoresp.create_app(configur)
+        return responder, SyncDriver(responder.app)
+    import async_app_autoresp
+    responder = async_app_autoresp.create_app(configur)
+    return responder, AsyncDriver(responder.app)
+
+
+@pytest.fixture(params = ['sync', 'async'])
+def helpdesk(request, configur):
+    desk, driver = helpdesk_driver(request.param, configur)
+    yield desk, driver
+    driver.close()
+
+
+@pytest.fixture(params = ['sync', 'async'])
+def autoresp(request, configur, echo):
+    responder, driver = autoresp_driver(request.param, configur)
+    echo.driver = driver
+    yield responder, driver
+    echo.settle()
+    echo.driver = None
+    driver.close()
@@ -0,0 +1,127 @@
+'''
+The same Slack flows through the threaded (app.py, app_autoresp.py) and asyncio (async_app.py,
+async_app_autoresp.py) apps, against the mock Slack and Jira
+'''
+import asyncio
+import json
+import pytest
+from benchmarks import mock_jira
+from benchmarks.load_test import helpdesk_flow, install_receivers, message_event
+from helpdesk_views import ticket_data, ticket_key
+from jira_schema import MissingFields
+from conftest import OOO_RECEIVER, wait_until
+
+SENDER = 'USEND001'
+ACTIVE_RECEIVER = 'UACT0001'
+
+
+def flow(desk, user_idx = 0):
+    dept = list(desk.catalogs.current.departments.values())[1]
+    return helpdesk_flow(user_idx, dept, dept.categories[2])
+
+
+def resolve(driver, result):
+    # The asyncio apps' methods return coroutines, run on the driver's loop
+    return driver.run(result) if asyncio.iscoroutine(result) else result
+
+
+@pytest.fixture
+def no_labels(monkeypatch):
+    # Create screens without the `labels` field the outbox tags every issue with
+    fields = mock_jira.issue_fields
+    monkeypatch.setattr(mock_jira, 'issue_fields', lambda: {k: v for k, v in fields().items() if k != 'labels'})
+
+
+def test_help_desk_flow_creates_ticket(helpdesk, slack, jira):
+    desk, driver = helpdesk
+    shortcut, dept, suggest, category, submit = flow(desk)
+    resolve(driver, desk.start())
+
+    assert driver.dispatch(shortcut).status == 200
+    driver.settle()
+    assert slack.calls['views.open'] == 1
+
+    assert driver.dispatch(dept).status == 200
+    driver.settle()
+    assert slack.calls['views.update'] == 1
+
+    wanted = category['actions'][0]['selected_option']['value']
+    assert wanted in [option['value'] for option in json.loads(driver.dispatch(suggest).body)['options']]
+
+    assert driver.dispatch(category).status == 200
+    driver.settle()
+    assert slack.calls['views.update'] == 2
+
+    response = json.loads(driver.dispatch(submit).body)
+    assert response['response_action'] == 'update'
+    # The reference id is DMed once the worker created the issue
+    wait_until(lambda: slack.calls['chat.postMessage'] == 1)
+    (_, ticket), = jira.issues
+    assert 'Laptop does not boot' in json.dumps(ticket)
+    assert [label for label in ticket['fields']['labels'] if label.startswith('slackticket-')]
+
+
+def test_ticket_submitted_twice_is_created_once(helpdesk, slack, jira):
+    desk, driver = helpdesk
+    submit = flow(desk)[-1]
+    driver.dispatch(submit)
+    driver.dispatch(submit)
+    wait_until(lambda: slack.calls['chat.postMessage'] >= 1)
+    driver.settle()
+    assert len(jira.issues) == 1
+
+
+def test_start_delivers_tickets_left_in_outbox(helpdesk, slack, jira):
+    desk, driver = helpdesk
+    body = flow(desk)[-1]
+    # Stored by an earlier run that stopped before its workers sent it
+    ticket, key = ticket_data(body, desk.routes), ticket_key(body)
+    desk.pipeline.outbox.append(key, body['user']['id'], desk.pipeline.payload(ticket, key))
+    resolve(driver, desk.start())
+    wait_until(lambda: slack.calls['chat.postMessage'] == 1)
+    assert len(jira.issues) == 1
+
+
+def test_start_refuses_create_screen_without_labels(helpdesk, no_labels):
+    desk, driver = helpdesk
+    with pytest.raises(MissingFields):
+        resolve(driver, desk.start())
+
+
+def test_ticket_refused_in_modal_without_labels(helpdesk, jira, no_labels):
+    desk, driver = helpdesk
+    resolve(driver, desk.jira.load_meta(desk.routes.projects()))
+    response = json.loads(driver.dispatch(flow(desk)[-1]).body)
+    assert response['response_action'] == 'errors'
+    assert 'labels' in response['errors']['issue_description']
+    assert not jira.issues
+
+
+def test_ooo_receiver_replied_once(autoresp, slack, echo):
+    responder, driver = autoresp
+    install_receivers(responder, [OOO_RECEIVER])
+    for seq in range(3):
+        assert driver.dispatch(message_event(SENDER, OOO_RECEIVER, seq)).status == 200
+        # Slack sends the reply back as a message of the receiver, it is not their answer
+        echo.settle()
+    assert slack.calls['chat.postMessage'] == 1
+
+
+def test_receiver_answer_restarts_count(autoresp, slack, echo):
+    responder, driver = autoresp
+    install_receivers(responder, [OOO_RECEIVER])
+    driver.dispatch(message_event(SENDER, OOO_RECEIVER, 0))
+    echo.settle()
+    driver.dispatch(message_event(SENDER, OOO_RECEIVER, 1, author = OOO_RECEIVER, text = 'back in a bit'))
+    echo.settle()
+    driver.dispatch(message_event(SENDER, OOO_RECEIVER, 2))
+    echo.settle()
+    assert slack.calls['chat.postMessage'] == 2
+
+
+def test_active_receiver_not_replied(autoresp, slack, echo):
+    responder, driver = autoresp
+    install_receivers(responder, [ACTIVE_RECEIVER])
+    assert driver.dispatch(message_event(SENDER, ACTIVE_RECEIVER, 0)).status == 200
+    echo.settle()
+    assert slack.calls['chat.postMessage'] == 0
@@ -0,0 +1,85 @@
+'''
+catalog.py: an edit publishes a new snapshot and leaves the old one whole, the store gets
+each edit once, and workers sharing a SQLite catalog see each other's edits
+'''
+import pytest
+from catalog import Catalog, LiveCatalog
+from catalog_store import SQLiteStore, migrate
+from test_catalog_store import CATALOG, text_store
+
+
+def names(catalog):
+    return [(dept.name, dept.category_names()) for dept in catalog.departments.values()]
+
+
+class FailingStore:
+    shared = False
+
+    def __init__(self, store):
+        self.store = store
+
+    def load(self):
+        return self.store.load()
+
+    def __getattr__(self, name):
+        def fail(*args):
+            raise OSError('disk full')
+        return fail
+
+
+def test_edit_publishes_new_snapshot(tmp_path):
+    live = LiveCatalog(text_store(tmp_path))
+    before = live.current
+    live.add_categories('IT', ['Printer'])
+    after = live.current
+    assert after is not before and after.version > before.version
+    # Readers still holding the old snapshot see it unchanged
+    assert names(before) == CATALOG
+    assert after.department('IT').category_names() == ['Laptop', 'VPN', 'Printer']
+    # Copy on write: the untouched departments and the department options are shared
+    assert after.department('HR') is before.department('HR')
+    assert after.department_options is before.department_options
+    assert live.store.load()[0] == ('IT', ['Laptop', 'VPN', 'Printer'])
+
+
+def test_lookup_by_option_value(tmp_path):
+    catalog = Catalog.load(text_store(tmp_path))
+    assert catalog.lookup('dept_HR') is catalog.department('HR')
+    category = catalog.lookup('IT_category_VPN')
+    assert (category.department, category.name) == ('IT', 'VPN')
+    with pytest.raises(KeyError):
+        catalog.lookup('IT_category_Payroll')
+
+
+def test_repeated_edits_leave_store_alone(tmp_path):
+    live = LiveCatalog(text_store(tmp_path))
+    before = live.current
+    assert live.add_departments(['IT', 'HR']) is before
+    assert live.add_categories('IT', ['VPN']) is before
+    assert live.store.load() == CATALOG
+
+
+def test_failed_store_keeps_snapshot(tmp_path):
+    live = LiveCatalog(FailingStore(text_store(tmp_path)))
+    before = live.current
+    for edit, args in ((live.add_departments, (['Legal'],)), (live.remove_department, ('HR',)),
+                       (live.add_categories, ('IT', ['Printer'])), (live.remove_category, ('IT', 'VPN'))):
+        with pytest.raises(OSError):
+            edit(*args)
+        assert live.current is before
+
+
+def test_workers_see_each_others_edits(tmp_path):
+    path = str(tmp_path / 'catalog.db')
+    store = SQLiteStore(path)
+    migrate(text_store(tmp_path), store)
+    store.close()
+    first, second = LiveCatalog(SQLiteStore(path), refresh_interval = 0), LiveCatalog(SQLiteStore(path), refresh_interval = 0)
+    first.add_departments(['Legal'])
+    first.remove_category('IT', 'Laptop')
+    assert names(second.current) == [('IT', ['VPN']), ('HR', ['Payroll']), ('Facilities', []), ('Legal', [])]
+    # An edit in the second worker starts from the first's
+    second.add_categories('Legal', ['Contracts'])
+    assert first.current.department('Legal').category_names() == ['Contracts']
+    first.store.close()
+    second.store.close()
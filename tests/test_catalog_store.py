@@ -0,0 +1,57 @@
+'''
+catalog_store.py: both backends keep the same catalog, and `python catalog_store.py migrate`
+copies the text files into SQLite once
+'''
+import pytest
+from catalog_store import SQLiteStore, TextFileStore, main, migrate, write_atomic
+
+CATALOG = [('IT', ['Laptop', 'VPN']), ('HR', ['Payroll']), ('Facilities', [])]
+
+
+def text_store(base_dir):
+    write_atomic(str(base_dir / 'departments.txt'), [name for name, _ in CATALOG])
+    for name, categories in CATALOG:
+        write_atomic(str(base_dir / f'{name}_categories.txt'), categories)
+    return TextFileStore(str(base_dir))
+
+
+@pytest.fixture(params = ['text', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'text':
+        yield text_store(tmp_path)
+        return
+    store = SQLiteStore(str(tmp_path / 'catalog.db'))
+    migrate(text_store(tmp_path), store)
+    yield store
+    store.close()
+
+
+def test_readding_department_keeps_its_categories(store):
+    store.add_departments(['IT', 'Legal'])
+    assert store.load() == CATALOG + [('Legal', [])]
+
+
+def test_edits(store):
+    store.add_categories('HR', ['Benefits'])
+    store.remove_category('IT', 'Laptop')
+    store.remove_department('Facilities')
+    assert store.load() == [('IT', ['VPN']), ('HR', ['Payroll', 'Benefits'])]
+
+
+def test_migrate(tmp_path):
+    target = SQLiteStore(str(tmp_path / 'catalog.db'))
+    migrate(text_store(tmp_path), target)
+    assert target.load() == CATALOG
+    target.close()
+
+
+def test_cli_migrates_once(tmp_path, capsys):
+    text_store(tmp_path)
+    db = str(tmp_path / 'data' / 'catalog.db')
+    main(['migrate', '--base-dir', str(tmp_path), '--db', db])
+    assert 'Migrated 3 departments' in capsys.readouterr().out
+    with pytest.raises(SystemExit, match = 'refusing to migrate twice'):
+        main(['migrate', '--base-dir', str(tmp_path), '--db', db])
+    target = SQLiteStore(db)
+    assert target.load() == CATALOG
+    target.close()
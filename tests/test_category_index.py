@@ -0,0 +1,38 @@
+'''
+category_index.py: typeahead order (name prefix, word prefix, typos), the result limit and
+the empty query
+'''
+from category_index import CategoryIndex
+
+NAMES = ['Email', 'Laptop', 'Laptop Charger', 'New Laptop Request', 'VPN Access', 'Printer', 'Phone']
+
+
+def index(names = NAMES):
+    return CategoryIndex((name, name) for name in names)
+
+
+def test_name_prefix_before_word_prefix():
+    assert index().search('lap') == ['Laptop', 'Laptop Charger', 'New Laptop Request']
+    assert index().search('  ACC ') == ['VPN Access']
+
+
+def test_typo_matches():
+    assert index().search('labtop')[:3] == ['Laptop', 'Laptop Charger', 'New Laptop Request']
+    assert index().search('printr') == ['Printer']
+
+
+def test_no_match():
+    assert index().search('xyzzy') == []
+
+
+def test_empty_query_lists_in_order():
+    assert index().search('') == NAMES
+    assert index().search('', limit = 2) == NAMES[:2]
+
+
+def test_limit_across_prefix_and_fuzzy():
+    names = [f'Laptop model {idx:03d}' for idx in range(120)] + [f'Loptop spare {idx}' for idx in range(5)]
+    found = index(names).search('laptop', limit = 50)
+    assert found == names[:50]
+    # Fuzzy matches fill what the prefixes left
+    assert index(names).search('laptop', limit = 125)[-5:] == names[-5:]
@@ -0,0 +1,129 @@
+'''
+event_dedup.py: an event is claimed while it is handled and remembered once Slack got its
+answer, a failed or abandoned one is handled again on Slack's retry
+'''
+import asyncio
+import time
+from configparser import ConfigParser
+import pytest
+from slack_bolt import App, BoltRequest
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.authorization import AuthorizeResult
+from slack_bolt.request.async_request import AsyncBoltRequest
+import event_dedup
+from event_dedup import SeenEvents, SharedSeenEvents, async_dedupe, dedupe, event_keys
+from benchmarks.load_test import message_event
+
+
+@pytest.fixture(params = ['memory', 'sqlite'])
+def seen_set(request, tmp_path):
+    def build(**kwargs):
+        if request.param == 'memory':
+            return SeenEvents(**kwargs)
+        return SharedSeenEvents(str(tmp_path / f'events-{time.monotonic_ns()}.db'), **kwargs)
+    return build
+
+
+def test_event_keys():
+    body = message_event('USEND001', 'URECV001', 7)
+    body['event']['client_msg_id'] = 'c0ffee'
+    assert event_keys('autoresp', body) == ['autoresp:ev:Ev000000007', 'autoresp:msg:T0001:c0ffee']
+    assert event_keys('autoresp', {'type': 'block_actions'}) == ()
+
+
+def test_claimed_then_handled(seen_set):
+    seen = seen_set()
+    assert seen.first(['a', 'b'])
+    # Slack's retry while the first delivery is still being handled
+    assert not seen.first(['a'])
+    seen.handled(['a', 'b'])
+    assert not seen.first(['b', 'c'])
+    assert seen.first(['c'])
+
+
+def test_released_claim_handled_again(seen_set):
+    seen = seen_set()
+    assert seen.first(['a'])
+    seen.release(['a'])
+    assert seen.first(['a'])
+
+
+def test_claim_lapses(seen_set):
+    # The worker handling it died, nothing released the claim
+    seen = seen_set(ttl = 60, lease = 0.05)
+    assert seen.first(['a'])
+    time.sleep(0.06)
+    assert seen.first(['a'])
+
+
+def test_handled_expire_after_ttl(seen_set):
+    seen = seen_set(ttl = 0.05, lease = 0.05)
+    assert seen.first(['a'])
+    seen.handled(['a'])
+    assert not seen.first(['a'])
+    time.sleep(0.06)
+    assert seen.first(['a'])
+
+
+def test_oldest_evicted_past_max_entries():
+    seen = SeenEvents(max_entries = 2)
+    for key in 'abc':
+        assert seen.first([key])
+    assert len(seen) == 2
+    assert seen.first(['a']) and not seen.first(['c'])
+
+
+@pytest.fixture
+def configur(monkeypatch):
+    # A seen-set of its own, not the one of the process
+    monkeypatch.setattr(event_dedup, '_seen', None)
+    configur = ConfigParser()
+    configur.read_dict({'events': {'DEDUP': 'yes'}})
+    return configur
+
+
+def authorize(**kwargs):
+    return AuthorizeResult(enterprise_id = None, team_id = 'T0001', bot_token = 'xoxb-1', bot_user_id = 'UBOT0001')
+
+
+async def async_authorize(**kwargs):
+    return authorize()
+
+
+def test_failed_event_handled_on_retry(configur):
+    app = App(signing_secret = 'secret', authorize = authorize, request_verification_enabled = False, process_before_response = True)
+    handled = []
+
+    @app.event('message')
+    def handle(ack, event):
+        ack()
+        handled.append(event['ts'])
+        if len(handled) == 1:
+            raise RuntimeError('worker lost its database')
+
+    dedupe(app, 'test', configur)
+    body = message_event('USEND001', 'URECV001', 1, ts = '1.000001')
+    statuses = [app.dispatch(BoltRequest(body = body, mode = 'socket_mode')).status for _ in range(3)]
+    assert statuses == [500, 200, 200]
+    assert handled == ['1.000001', '1.000001']
+
+
+def test_async_failed_event_handled_on_retry(configur):
+    app = AsyncApp(signing_secret = 'secret', authorize = async_authorize, request_verification_enabled = False, process_before_response = True)
+    handled = []
+
+    @app.event('message')
+    async def handle(ack, event):
+        await ack()
+        handled.append(event['ts'])
+        if len(handled) == 1:
+            raise RuntimeError('worker lost its database')
+
+    async_dedupe(app, 'test', configur)
+    body = message_event('USEND001', 'URECV001', 1, ts = '1.000001')
+
+    async def dispatch():
+        return [(await app.async_dispatch(AsyncBoltRequest(body = body, mode = 'socket_mode'))).status for _ in range(3)]
+
+    assert asyncio.run(dispatch()) == [500, 200, 200]
+    assert handled == ['1.000001', '1.000001']
@@ -0,0 +1,88 @@
+'''
+installation_store.py: installs and uninstalls in one process reach the caches of the others
+'''
+from configparser import ConfigParser
+from slack_bolt import BoltContext
+from slack_bolt.oauth.oauth_settings import OAuthSettings
+from slack_sdk.oauth.installation_store import Installation
+from installation_store import cache_authorize, open_installation_store
+
+TEAM = 'T0001'
+USER = 'U0001'
+OTHER_USER = 'U0002'
+
+
+def installation(token, user_id = USER):
+    return Installation(app_id = 'A0001', team_id = TEAM, user_id = user_id, user_token = token, bot_token = 'xoxb-1',
+                        bot_id = 'B0001', bot_user_id = 'UBOT0001')
+
+
+class AuthTest:
+    '''
+    Client answering auth.test for the bot, counting the calls
+    '''
+    def __init__(self):
+        self.calls = 0
+
+    def auth_test(self, token):
+        self.calls += 1
+        return {'ok': True, 'team_id': TEAM, 'user_id': 'UBOT0001', 'bot_id': 'B0001'}
+
+
+def stores(tmp_path, backend):
+    # Two service.py workers, each with its own cache in front of the same files
+    configur = ConfigParser()
+    configur.read_dict({'installations': {
+        'BACKEND': backend, 'BASE_DIR': str(tmp_path / 'installations'), 'SQLITE_PATH': str(tmp_path / 'installations.db'),
+    }})
+    return open_installation_store(configur, 'client'), open_installation_store(configur, 'client')
+
+
+def find(store):
+    found = store.find_installation(enterprise_id = None, team_id = TEAM, user_id = USER)
+    return found and found.user_token
+
+
+def test_revoked_token_leaves_other_caches(tmp_path):
+    for backend in ('file', 'sqlite'):
+        first, second = stores(tmp_path / backend, backend)
+        first.save(installation('xoxp-1'))
+        assert find(second) == 'xoxp-1'
+        first.delete_installation(enterprise_id = None, team_id = TEAM, user_id = USER)
+        assert find(second) is None
+
+
+def test_reinstall_replaces_cached_token(tmp_path):
+    first, second = stores(tmp_path, 'file')
+    first.save(installation('xoxp-1'))
+    assert find(second) == 'xoxp-1'
+    first.save(installation('xoxp-2'))
+    assert find(second) == 'xoxp-2'
+
+
+def authorize(store, client, user_id):
+    authorize = cache_authorize(OAuthSettings(client_id = 'client', client_secret = 'secret', installation_store = store)).authorize
+    result = authorize(context = BoltContext(client = client), enterprise_id = None, team_id = TEAM, user_id = user_id)
+    return result and result.user_token
+
+
+def test_authorize_cached_per_user(tmp_path):
+    store, _ = stores(tmp_path, 'file')
+    store.save(installation('xoxp-1'))
+    store.save(installation('xoxp-2', user_id = OTHER_USER))
+    client = AuthTest()
+    for _ in range(2):
+        # Each user gets their own token, not the one of whoever was authorized first
+        assert authorize(store, client, USER) == 'xoxp-1'
+        assert authorize(store, client, OTHER_USER) == 'xoxp-2'
+    assert client.calls == 2
+
+
+def test_authorize_result_dropped_on_uninstall(tmp_path):
+    first, second = stores(tmp_path, 'file')
+    first.save(installation('xoxp-1'))
+    client = AuthTest()
+    assert authorize(second, client, USER) == 'xoxp-1'
+    # app_uninstalled handled by the other worker
+    first.delete_all(enterprise_id = None, team_id = TEAM)
+    assert authorize(second, client, USER) is None
@@ -0,0 +1,87 @@
+'''
+listener_pool.py: teams take turns on the workers, and a listener finding the queue full is
+dropped, logged and its request's when_shed() callback run
+'''
+import contextvars
+import logging
+import threading
+import pytest
+from conftest import wait_until
+from listener_pool import FairExecutor, PoolFull, current_team, shed, when_shed
+
+
+def submit(executor, team, fn, on_shed = None):
+    # As Bolt does, from the thread of a request of `team`
+    def dispatch():
+        current_team.set(team)
+        if on_shed is not None:
+            when_shed(on_shed)
+        return executor.submit(fn)
+    return contextvars.copy_context().run(dispatch)
+
+
+def hold(executor, team):
+    '''
+    Runs a listener of `team` holding the only worker until the returned event is set
+    '''
+    held = threading.Event()
+    submit(executor, team, held.wait)
+    wait_until(lambda: executor.busy == 1)
+    return held
+
+
+def test_teams_take_turns():
+    executor = FairExecutor(workers = 1, max_queue = 10, max_per_team = 10)
+    held = hold(executor, 'TBUSY')
+    ran = []
+    futures = [submit(executor, 'TBUSY', lambda idx = idx: ran.append(f'busy{idx}')) for idx in range(3)]
+    futures += [submit(executor, 'TQUIET', lambda idx = idx: ran.append(f'quiet{idx}')) for idx in range(2)]
+    held.set()
+    for future in futures:
+        future.result(timeout = 5)
+    executor.shutdown()
+    # The quiet team is served between the busy team's listeners, not after all of them
+    assert ran == ['busy0', 'quiet0', 'busy1', 'quiet1', 'busy2']
+
+
+def test_full_team_shed_others_queued(caplog):
+    executor = FairExecutor(workers = 1, max_queue = 10, max_per_team = 2, max_wait = 0.05)
+    held = hold(executor, 'TBUSY')
+    queued = [submit(executor, 'TBUSY', lambda: 'busy') for _ in range(2)]
+    forgotten = []
+    before = sum(shed.snapshot().values())
+    with caplog.at_level(logging.WARNING, logger = 'listener_pool'):
+        dropped = submit(executor, 'TBUSY', lambda: 'busy', on_shed = lambda: forgotten.append('TBUSY'))
+    other = submit(executor, 'TQUIET', lambda: 'quiet', on_shed = lambda: forgotten.append('TQUIET'))
+    held.set()
+    with pytest.raises(PoolFull):
+        dropped.result(timeout = 0)
+    assert [future.result(timeout = 5) for future in queued + [other]] == ['busy', 'busy', 'quiet']
+    assert forgotten == ['TBUSY']
+    assert sum(shed.snapshot().values()) == before + 1
+    assert 'TBUSY dropped' in caplog.text
+    executor.shutdown()
+
+
+def test_full_queue_sheds_every_team():
+    executor = FairExecutor(workers = 1, max_queue = 2, max_per_team = 2, max_wait = 0.05)
+    held = hold(executor, 'T1')
+    submit(executor, 'T1', lambda: None)
+    submit(executor, 'T2', lambda: None)
+    forgotten = []
+    dropped = submit(executor, 'T3', lambda: None, on_shed = lambda: forgotten.append('T3'))
+    held.set()
+    with pytest.raises(PoolFull):
+        dropped.result(timeout = 0)
+    assert forgotten == ['T3']
+    executor.shutdown()
+
+
+def test_room_freed_within_max_wait():
+    executor = FairExecutor(workers = 1, max_queue = 1, max_per_team = 1, max_wait = 5)
+    held = hold(executor, 'T1')
+    submit(executor, 'T1', lambda: None)
+    threading.Timer(0.05, held.set).start()
+    # Waits for the worker to take the queued listener instead of dropping this one
+    assert submit(executor, 'T1', lambda: 'late').result(timeout = 5) == 'late'
+    executor.shutdown()
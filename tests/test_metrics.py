@@ -0,0 +1,86 @@
+'''
+metrics.py: the Prometheus text format of each metric kind, gauges summed over their sources,
+and the per worker dumps merged for /metrics
+'''
+import gc
+import urllib.request
+import metrics
+
+
+def exposed(prefix):
+    return metrics.render([family for family in metrics.families() if family[0].startswith(prefix)])
+
+
+def test_counter_and_labels():
+    metrics.counter('test_expo_calls_total', 'Calls made').inc(3)
+    family = metrics.counter('test_expo_errors_total', 'Errors "per" method', labels = ('method',))
+    family.labels('chat.postMessage').inc()
+    family.labels('views.open\n').inc(2)
+    assert exposed('test_expo_') == (
+        '# HELP test_expo_calls_total Calls made\n'
+        '# TYPE test_expo_calls_total counter\n'
+        'test_expo_calls_total 3\n'
+        '# HELP test_expo_errors_total Errors \\"per\\" method\n'
+        '# TYPE test_expo_errors_total counter\n'
+        'test_expo_errors_total{method="chat.postMessage"} 1\n'
+        'test_expo_errors_total{method="views.open\\n"} 2\n'
+    )
+
+
+def test_histogram_buckets_cumulative():
+    histogram = metrics.histogram('test_hist_seconds', 'Latency', buckets = (0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    assert exposed('test_hist_') == (
+        '# HELP test_hist_seconds Latency\n'
+        '# TYPE test_hist_seconds histogram\n'
+        'test_hist_seconds_bucket{le="0.1"} 2\n'
+        'test_hist_seconds_bucket{le="1"} 3\n'
+        'test_hist_seconds_bucket{le="+Inf"} 4\n'
+        'test_hist_seconds_sum 3.65\n'
+        'test_hist_seconds_count 4\n'
+    )
+
+
+class Queue:
+    def __init__(self, depth):
+        self.depth = depth
+
+    def size(self):
+        return self.depth
+
+
+def test_gauge_sums_live_sources():
+    first, second = Queue(2), Queue(5)
+    metrics.gauge('test_gauge_depth', 'Depth', first.size)
+    metrics.gauge('test_gauge_depth', 'Depth', second.size)
+    assert 'test_gauge_depth 7\n' in exposed('test_gauge_')
+    # A source whose object is gone stops counting
+    del second
+    gc.collect()
+    assert 'test_gauge_depth 2\n' in exposed('test_gauge_')
+
+
+def test_registered_once():
+    assert metrics.counter('test_once_total', 'Once') is metrics.counter('test_once_total', 'Once')
+
+
+def test_worker_dumps_merged(tmp_path):
+    metrics.counter('test_merge_total', 'Merged').inc()
+    paths = {101: str(tmp_path / '101.json'), 102: str(tmp_path / '102.json'), 103: str(tmp_path / 'gone.json')}
+    metrics.dump(paths[101])
+    metrics.dump(paths[102])
+    (tmp_path / '102.json').write_text((tmp_path / '102.json').read_text().replace('["test_merge_total", [], 1]', '["test_merge_total", [], 4]'))
+    text = metrics.render([family for family in metrics.merged(paths) if family[0] == 'test_merge_total'])
+    assert text.endswith('test_merge_total{worker="101"} 1\ntest_merge_total{worker="102"} 4\n')
+
+
+def test_served_over_http():
+    metrics.counter('test_http_total', 'Served').inc()
+    server = metrics.serve(0)
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics') as resp:
+            assert resp.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert 'test_http_total 1\n' in resp.read().decode()
+    finally:
+        server.shutdown()
@@ -0,0 +1,100 @@
+'''
+ooo_state.py: Out of Office transitions from user objects and presence events, in memory,
+written through to SQLite, and shared between workers
+'''
+import json
+import time
+import pytest
+from ooo_state import OOO_STATUS, OOOStateTable, SharedOOOStateTable, reply_text
+
+
+def user(user_id = 'U1', status_text = OOO_STATUS, status_expiration = 0):
+    return {'id': user_id, 'team_id': 'T1', 'profile': {'status_text': status_text, 'status_expiration': status_expiration}}
+
+
+@pytest.fixture(params = ['memory', 'file', 'shared'])
+def table(request, tmp_path):
+    path = str(tmp_path / 'ooo_state.db')
+    table = {'memory': lambda: OOOStateTable(), 'file': lambda: OOOStateTable(path), 'shared': lambda: SharedOOOStateTable(path)}[request.param]()
+    yield table
+    table.close()
+
+
+def test_status_transitions(table):
+    assert table.get('U1') is None
+    assert table.update_user(user()).is_ooo()
+    assert table.get('U1').is_ooo() and table.get('U1').team_id == 'T1'
+    table.update_user(user(status_text = 'In a meeting'))
+    assert not table.get('U1').is_ooo()
+    table.update_user(user(status_expiration = int(time.time()) + 3600))
+    assert table.get('U1').is_ooo()
+    # An expired status is no longer Out of Office, without any event
+    assert not table.get('U1').is_ooo(now = time.time() + 7200)
+
+
+def test_presence_from_events(table):
+    table.update_presence('U1', 'away')
+    # Only known users keep a presence
+    assert table.presence('U1', 60) is None
+    table.update_user(user())
+    table.update_presence('U1', 'away')
+    assert table.presence('U1', 60) == 'away'
+    assert table.presence('U1', -1) is None
+    # A status change keeps the presence
+    table.update_user(user(status_text = ''))
+    assert table.presence('U1', 60) == 'away'
+
+
+def test_statuses_survive_restart(tmp_path):
+    path = str(tmp_path / 'ooo_state.db')
+    table = OOOStateTable(path)
+    table.update_user(user())
+    table.update_user(user('U2', status_text = ''))
+    table.update_presence('U1', 'away')
+    table.close()
+    table = OOOStateTable(path)
+    assert table.get('U1').is_ooo() and not table.get('U2').is_ooo()
+    # Presence goes stale quickly and is not kept
+    assert table.presence('U1', 60) is None
+    table.close()
+
+
+def test_only_changed_rows_written(tmp_path):
+    table = OOOStateTable(str(tmp_path / 'ooo_state.db'))
+    table.update_user(user())
+    writes = table.conn.total_changes
+    table.update_user(user())
+    table.update_presence('U1', 'away')
+    assert table.conn.total_changes == writes
+    table.update_user(user('U2'))
+    assert table.conn.total_changes == writes + 1
+    table.close()
+
+
+def test_legacy_json_imported(tmp_path):
+    path = tmp_path / 'ooo_state.json'
+    path.write_text(json.dumps({'U1': {'team_id': 'T1', 'enterprise_id': None, 'status_text': OOO_STATUS, 'status_expiration': 0}}))
+    table = OOOStateTable(str(path))
+    assert table.get('U1').is_ooo()
+    table.close()
+    assert (tmp_path / 'ooo_state.json.bak').exists()
+    table = OOOStateTable(str(path))
+    assert table.get('U1').is_ooo()
+    table.close()
+
+
+def test_workers_share_statuses(tmp_path):
+    path = str(tmp_path / 'ooo_state.db')
+    first, second = SharedOOOStateTable(path), SharedOOOStateTable(path)
+    first.update_user(user())
+    first.update_presence('U1', 'away')
+    assert second.get('U1').is_ooo() and second.presence('U1', 60) == 'away'
+    first.close()
+    second.close()
+
+
+def test_reply_text():
+    state = OOOStateTable().update_user(user())
+    assert reply_text('U2', state).startswith("Hi, <@U2>!!!\nI'll be Out of Office for a while.")
+    state = OOOStateTable().update_user(user(status_expiration = 1700000000))
+    assert 'will be back on 2023-11-' in reply_text('U2', state)
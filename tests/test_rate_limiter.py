@@ -0,0 +1,180 @@
+'''
+rate_limiter.py: bucket refill, callers of a bucket in arrival order, the wait classes and the
+call sent anyway once its wait is over
+'''
+import asyncio
+import threading
+import time
+import pytest
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import SlackResponse
+from conftest import wait_until
+from rate_limiter import AsyncRateLimiter, Bucket, RateLimiter, overruns
+
+SHORT = 0.2
+
+
+class Client:
+    '''
+    Stand in for a WebClient, records the methods called and answers `answers` in turn (an
+    exception is raised), then {"ok": true}
+    '''
+    def __init__(self, token = 'xoxb-1', answers = ()):
+        self.token = token
+        self.answers = list(answers)
+        self.calls = []
+
+    def api_call(self, api_method, **kwargs):
+        self.calls.append(api_method)
+        if self.answers:
+            raise self.answers.pop(0)
+        return {'ok': True}
+
+
+class AsyncClient(Client):
+    async def api_call(self, api_method, **kwargs):
+        return Client.api_call(self, api_method, **kwargs)
+
+
+def rate_limited(retry_after):
+    response = SlackResponse(client = None, http_verb = 'POST', api_url = 'https://slack.com/api/users.info', req_args = {},
+                             data = {'ok': False, 'error': 'ratelimited'}, headers = {'Retry-After': str(retry_after)}, status_code = 429)
+    return SlackApiError('ratelimited', response)
+
+
+def test_bucket_refills_at_rate_up_to_burst():
+    bucket = Bucket(rate = 2.0, burst = 3, now = 0.0)
+    for _ in range(3):
+        assert bucket.delay(0.0) == 0
+        bucket.take()
+    assert bucket.delay(0.0) == pytest.approx(0.5)
+    assert bucket.delay(0.5) == 0
+    bucket.take()
+    # Ten idle seconds refill the burst, no more
+    assert bucket.delay(10.5) == 0
+    assert bucket.tokens == 3
+
+
+def test_bucket_blocked_by_retry_after():
+    bucket = Bucket(rate = 2.0, burst = 3, now = 0.0)
+    bucket.block(0.0, 4)
+    assert bucket.delay(1.0) == pytest.approx(3.0)
+    # No calls bank up while blocked
+    assert bucket.delay(4.0) == pytest.approx(0.5)
+
+
+def test_calls_past_burst_wait_for_refill():
+    # users.setPresence is 20 a minute with bursts of 5, x60 -> 20 a second
+    limiter = RateLimiter(scale = 60)
+    client = limiter.wrap(Client())
+    started = time.monotonic()
+    for _ in range(5):
+        client.api_call('users.setPresence')
+    assert time.monotonic() - started < 0.05
+    for _ in range(4):
+        client.api_call('users.setPresence')
+    assert time.monotonic() - started == pytest.approx(4 / 20, abs = 0.05)
+
+
+def test_methods_and_tokens_do_not_share_buckets():
+    limiter = RateLimiter(max_wait = (SHORT, SHORT, SHORT))
+    limiter.block(('xoxb-1', 'users.info'), 'users.info', 60)
+    started = time.monotonic()
+    limiter.wrap(Client()).api_call('users.getPresence')
+    limiter.wrap(Client(token = 'xoxb-2')).api_call('users.info')
+    assert time.monotonic() - started < SHORT / 2
+
+
+def test_call_sent_anyway_past_its_wait():
+    limiter = RateLimiter(max_wait = (SHORT, SHORT, SHORT))
+    client = limiter.wrap(Client())
+    limiter.block(('xoxb-1', 'users.info'), 'users.info', 60)
+    before = overruns.labels('users.info').value
+    started = time.monotonic()
+    assert client.api_call('users.info') == {'ok': True}
+    assert time.monotonic() - started == pytest.approx(SHORT, abs = 0.1)
+    assert overruns.labels('users.info').value == before + 1
+
+
+def test_wait_class_bounds_the_wait():
+    limiter = RateLimiter(max_wait = (SHORT, 3 * SHORT, 10))
+    client = limiter.wrap(Client())
+    limiter.block(('xoxb-1', 'views.open'), 'views.open', 60)
+    limiter.block(('xoxb-1', 'users.info'), 'users.info', 60)
+    started = time.monotonic()
+    client.api_call('views.open')
+    assert time.monotonic() - started == pytest.approx(SHORT, abs = 0.1)
+    started = time.monotonic()
+    client.api_call('users.info')
+    assert time.monotonic() - started == pytest.approx(3 * SHORT, abs = 0.1)
+
+
+def test_callers_of_a_bucket_served_in_arrival_order():
+    limiter = RateLimiter(scale = 60)
+    key = ('xoxb-1', 'users.info')
+    limiter.block(key, 'users.info', SHORT)
+    served = []
+
+    def call(idx):
+        limiter.acquire(key, 'users.info', 1, time.monotonic() + 10)
+        served.append(idx)
+
+    threads = []
+    for idx in range(5):
+        threads.append(threading.Thread(target = call, args = (idx,)))
+        threads[-1].start()
+        wait_until(lambda: limiter.waiting == idx + 1)
+    for thread in threads:
+        thread.join()
+    assert served == list(range(5))
+
+
+def test_429_retried_after_retry_after():
+    # users.info refills 100 a second, the wait is the Retry-After
+    limiter = RateLimiter(scale = 60)
+    client = limiter.wrap(Client(answers = [rate_limited(SHORT)]))
+    started = time.monotonic()
+    assert client.api_call('users.info') == {'ok': True}
+    assert client.calls == ['users.info', 'users.info']
+    assert time.monotonic() - started == pytest.approx(SHORT, abs = 0.1)
+
+
+def test_429_raised_when_retry_after_exceeds_the_wait():
+    limiter = RateLimiter(max_wait = (SHORT, SHORT, SHORT))
+    client = limiter.wrap(Client(answers = [rate_limited(30)]))
+    with pytest.raises(SlackApiError):
+        client.api_call('users.info')
+    assert client.calls == ['users.info']
+
+
+def test_async_callers_of_a_bucket_served_in_arrival_order():
+    async def run():
+        limiter = AsyncRateLimiter(scale = 60)
+        key = ('xoxb-1', 'users.info')
+        served = []
+
+        async def call(idx):
+            await limiter.acquire(key, 'users.info', 1, time.monotonic() + 10)
+            served.append(idx)
+
+        limiter.block(key, 'users.info', SHORT)
+        tasks = []
+        for idx in range(5):
+            tasks.append(asyncio.create_task(call(idx)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return served
+
+    assert asyncio.run(run()) == list(range(5))
+
+
+def test_async_call_sent_anyway_past_its_wait():
+    async def run():
+        limiter = AsyncRateLimiter(max_wait = (SHORT, SHORT, SHORT))
+        client = limiter.wrap(AsyncClient())
+        limiter.block(('xoxb-1', 'views.open'), 'views.open', 60)
+        started = time.monotonic()
+        assert await client.api_call('views.open') == {'ok': True}
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) == pytest.approx(SHORT, abs = 0.1)
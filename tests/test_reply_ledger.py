@@ -0,0 +1,67 @@
+'''
+reply_ledger.py: first message of the day, then every `reply_every` unanswered ones, and the
+day rollover, in process and shared between workers
+'''
+import datetime
+import sqlite3
+import pytest
+from reply_ledger import ReplyLedger
+
+TODAY = datetime.date.today()
+TOMORROW = TODAY + datetime.timedelta(days = 1)
+
+
+@pytest.fixture(params = ['memory', 'sqlite'])
+def ledger(request, tmp_path):
+    ledger = ReplyLedger(str(tmp_path / 'replies.db'), reply_every = 3, shared = request.param == 'sqlite')
+    yield ledger
+    ledger.close()
+
+
+def replies(ledger, count, today = TODAY, channel = 'D0001'):
+    return [ledger.record_inbound('URECV', channel, today) for _ in range(count)]
+
+
+def rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute('SELECT receiver, channel, day FROM replies ORDER BY channel').fetchall()
+
+
+def test_first_message_then_every_reply_every(ledger):
+    assert replies(ledger, 7) == [True, False, False, True, False, False, True]
+
+
+def test_channels_counted_apart(ledger):
+    assert replies(ledger, 2) == [True, False]
+    assert replies(ledger, 2, channel = 'D0002') == [True, False]
+
+
+def test_receiver_answer_starts_over(ledger):
+    assert replies(ledger, 2) == [True, False]
+    ledger.forget('URECV', 'D0001')
+    assert replies(ledger, 2) == [True, False]
+
+
+def test_new_day_replies_again(ledger):
+    assert replies(ledger, 2) == [True, False]
+    assert replies(ledger, 2, today = TOMORROW) == [True, False]
+
+
+def test_rollover_deletes_earlier_days(ledger):
+    replies(ledger, 1)
+    replies(ledger, 1, today = TOMORROW, channel = 'D0002')
+    assert rows(ledger.path) == [('URECV', 'D0002', TOMORROW.isoformat())]
+    assert list(ledger._entries) == ([] if ledger.shared else [('URECV', 'D0002')])
+
+
+def test_load_skips_earlier_days(tmp_path):
+    path = str(tmp_path / 'replies.db')
+    ledger = ReplyLedger(path, reply_every = 3)
+    replies(ledger, 2)
+    ledger.conn.execute("INSERT INTO replies VALUES ('URECV', 'D0002', '2020-01-01', 1)")
+    ledger.close()
+    ledger = ReplyLedger(path, reply_every = 3)
+    assert rows(path) == [('URECV', 'D0001', TODAY.isoformat())]
+    # Today's count survives a restart, no second reply
+    assert replies(ledger, 1) == [False]
+    ledger.close()
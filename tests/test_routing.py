@@ -0,0 +1,86 @@
+'''
+ticket_routing.py and jira_schema.py: where a ticket is created, and the payloads Jira would
+refuse caught against the cached createmeta before any request
+'''
+from configparser import ConfigParser
+import pytest
+import jira_schema
+from benchmarks.mock_jira import issue_fields
+from jira_schema import CreateMeta, createmeta_params
+from ticket_routing import DEFAULT_ROUTE, Route, Routes
+
+
+def routes(**section):
+    configur = ConfigParser()
+    configur.read_dict({'routing': section})
+    return Routes.from_config(configur)
+
+
+def test_category_over_department_over_default():
+    table = routes(**{'DEFAULT': 'OPS, Task', 'I.T': 'IT, Task', 'I.T / VPN': 'IT, Incident, High'})
+    assert table.route('I.T', 'VPN') == Route('IT', 'Incident', 'High')
+    # Names match case insensitively, an unrouted category takes its department's route
+    assert table.route(' i.t ', 'vpn') == Route('IT', 'Incident', 'High')
+    assert table.route('I.T', 'Laptop') == Route('IT', 'Task', None)
+    assert table.route('HR', 'Payroll') == Route('OPS', 'Task', None)
+    assert table.targets() == [('IT', 'Incident'), ('IT', 'Task'), ('OPS', 'Task')]
+    assert table.projects() == ['IT', 'OPS']
+
+
+def test_without_section_everything_to_test():
+    assert Routes.from_config(ConfigParser()).route('I.T', 'VPN') == DEFAULT_ROUTE
+    assert DEFAULT_ROUTE.fields() == {'project': {'key': 'TEST'}, 'issuetype': {'name': 'Task'}}
+
+
+def test_route_fields_and_parse_errors():
+    assert Route.parse('IT, Incident, High').fields()['priority'] == {'name': 'High'}
+    for text in ('IT', 'IT, ', 'IT, Task, High, Extra'):
+        with pytest.raises(ValueError):
+            Route.parse(text)
+
+
+def ticket(project = 'TEST', issuetype = 'Task', **fields):
+    return {'fields': {'project': {'key': project}, 'issuetype': {'name': issuetype}, 'summary': 'I.T: VPN', **fields}}
+
+
+@pytest.fixture
+def meta():
+    meta = CreateMeta(ttl = 60)
+    meta.store(['TEST', 'GONE'], {'projects': [{'key': 'TEST', 'issuetypes': [{'name': 'Task', 'fields': issue_fields()}]}]})
+    return meta
+
+
+def test_valid_ticket_passes(meta):
+    assert meta.problems(ticket(description = 'VPN down', priority = {'name': 'High'}, labels = ['slackticket-1'])) == []
+
+
+def test_refused_tickets(meta):
+    before = jira_schema.invalid.value
+    assert meta.problems(ticket(project = 'GONE')) == ["project 'GONE' does not exist or issues cannot be created in it"]
+    assert meta.problems(ticket(issuetype = 'Epic')) == ["issue type 'Epic' is not available in project 'TEST'"]
+    assert meta.problems(ticket(priority = {'name': 'Urgent'})) == ["'priority' value {'name': 'Urgent'} is not allowed"]
+    assert meta.problems(ticket(labels = 'slackticket-1')) == ["field 'labels' must be a array"]
+    assert meta.problems(ticket(components = [])) == ["field 'components' is not on the create screen"]
+    assert meta.problems(ticket(summary = '')) == ["required field 'summary' is missing"]
+    assert jira_schema.invalid.value == before + 6
+
+
+def test_unknown_project_unchecked_until_fetched(meta):
+    assert meta.problems(ticket(project = 'OTHER')) is None
+    assert meta.missing(['TEST', 'OTHER']) == ['OTHER']
+    # A failed fetch is not retried right away
+    meta.failed(['OTHER'])
+    assert meta.missing(['OTHER']) == []
+    assert createmeta_params(['TEST', 'OTHER']) == {'projectKeys': 'TEST,OTHER', 'expand': 'projects.issuetypes.fields'}
+
+
+def test_expired_createmeta_fetched_again():
+    meta = CreateMeta(ttl = 0)
+    meta.store(['TEST'], {'projects': [{'key': 'TEST', 'issuetypes': [{'name': 'Task', 'fields': issue_fields()}]}]})
+    assert meta.problems(ticket()) is None
+    assert meta.missing(['TEST']) == ['TEST']
+
+
+def test_lacking_fields(meta):
+    required = [('TEST', 'Task', 'labels'), ('TEST', 'Task', 'customfield_1'), ('OTHER', 'Task', 'labels')]
+    assert meta.lacking(required) == [('TEST', 'Task', 'customfield_1')]
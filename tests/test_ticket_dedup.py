@@ -0,0 +1,96 @@
+'''
+ticket_dedup.py: a report similar enough to a recent one of its topic is a duplicate of it,
+reports leave the index after the window, and banding finds the match among many reports
+'''
+import random
+import string
+import types
+import pytest
+import ticket_dedup
+from ticket_dedup import DuplicateIndex, MinHasher, rows_per_band, similarity
+
+OUTAGE = 'VPN is down, cannot connect from home'
+
+
+def ticket(text, summary = 'I.T: VPN'):
+    return {'fields': {'summary': summary, 'description': text}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    # Only the module's own clock, other threads keep the real one
+    monkeypatch.setattr(ticket_dedup, 'time', types.SimpleNamespace(monotonic = lambda: now[0]))
+    return now
+
+
+def first_report(index, text = OUTAGE, summary = 'I.T: VPN', issue = 'TEST-1'):
+    report, duplicate = index.claim(ticket(text, summary))
+    assert duplicate is None
+    index.resolve(report, issue)
+    return report
+
+
+def test_match_at_threshold():
+    hasher = MinHasher()
+    text = 'The VPN is down and I cannot connect from home'
+    score = similarity(hasher.signature(OUTAGE), hasher.signature(text))
+    assert 0 < score < 1
+    # Just above and just below the estimated similarity of the two wordings
+    matching = DuplicateIndex(threshold = score, hasher = hasher)
+    report = first_report(matching)
+    assert matching.claim(ticket(text)) == (None, report)
+    apart = DuplicateIndex(threshold = score + 1 / len(hasher.params), hasher = hasher)
+    first_report(apart)
+    assert apart.claim(ticket(text))[1] is None
+
+
+def test_topics_apart():
+    index = DuplicateIndex()
+    first_report(index)
+    assert index.claim(ticket(OUTAGE, summary = 'HR: Payroll'))[1] is None
+
+
+def test_expires_after_window(clock):
+    index = DuplicateIndex(window = 60)
+    report = first_report(index)
+    clock[0] += 59
+    # A duplicate keeps the report open for another window
+    assert index.claim(ticket(OUTAGE)) == (None, report)
+    clock[0] += 59
+    assert index.claim(ticket(OUTAGE)) == (None, report)
+    clock[0] += 61
+    new, duplicate = index.claim(ticket(OUTAGE))
+    assert duplicate is None and new is not report
+    assert len(index) == 1
+    assert all(report not in bucket for bucket in index.buckets.values())
+
+
+def test_failed_issue_not_matched():
+    index = DuplicateIndex()
+    report, _ = index.claim(ticket(OUTAGE))
+    index.resolve(report, None)
+    assert len(index) == 0 and not index.buckets
+    assert index.claim(ticket(OUTAGE))[1] is None
+
+
+def test_max_per_topic_drops_oldest():
+    index = DuplicateIndex(max_per_topic = 3)
+    reports = [first_report(index, f'Laptop {idx} of room {idx * 7} does not boot') for idx in range(5)]
+    assert list(index.topics['I.T: VPN']) == reports[2:]
+
+
+def test_match_among_many_reports():
+    index = DuplicateIndex()
+    rng = random.Random(1)
+    for idx in range(300):
+        first_report(index, ''.join(rng.choice(string.ascii_lowercase + ' ') for _ in range(40)), issue = f'TEST-{idx}')
+    report = first_report(index, issue = 'TEST-VPN')
+    assert index.claim(ticket('vpn down - can not connect from home!!')) == (None, report)
+
+
+def test_rows_per_band_keeps_recall():
+    for threshold in (0.3, 0.6, 0.9):
+        rows = rows_per_band(threshold)
+        bands = 64 // rows
+        assert 1 - (1 - threshold ** rows) ** bands >= 0.99
@@ -0,0 +1,91 @@
+'''
+user_cache.py: TTLCache entries expire after `ttl`, the least recently used one goes first
+when full, and UserCache only calls Slack on a miss
+'''
+import types
+import pytest
+import user_cache
+from user_cache import TTLCache, UserCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    # Only the module's own clock, other threads keep the real one
+    monkeypatch.setattr(user_cache, 'time', types.SimpleNamespace(monotonic = lambda: now[0]))
+    return now
+
+
+def test_expires_after_ttl(clock):
+    cache = TTLCache('test', ttl = 10, maxsize = 10)
+    cache.set('U1', 'one')
+    clock[0] += 9.9
+    assert cache.get('U1') == 'one'
+    # A hit does not extend the entry
+    clock[0] += 0.1
+    assert cache.get('U1') is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_evicted(clock):
+    cache = TTLCache('test', ttl = 10, maxsize = 2)
+    cache.set('U1', 'one')
+    cache.set('U2', 'two')
+    cache.get('U1')
+    cache.set('U3', 'three')
+    assert (cache.get('U1'), cache.get('U2'), cache.get('U3')) == ('one', None, 'three')
+
+
+def test_set_again_renews(clock):
+    cache = TTLCache('test', ttl = 10, maxsize = 2)
+    cache.set('U1', 'one')
+    cache.set('U2', 'two')
+    clock[0] += 8
+    cache.set('U1', 'uno')
+    cache.set('U3', 'three')
+    clock[0] += 8
+    assert (cache.get('U1'), cache.get('U2'), cache.get('U3')) == ('uno', None, 'three')
+
+
+def test_hits_and_misses_counted(clock):
+    cache = TTLCache('test_counted', ttl = 10, maxsize = 10)
+    hits, misses = cache.hits.value, cache.misses.value
+    cache.get('U1')
+    cache.set('U1', 'one')
+    cache.get('U1')
+    cache.invalidate('U1')
+    cache.get('U1')
+    assert (cache.hits.value - hits, cache.misses.value - misses) == (1, 2)
+
+
+class Users:
+    def __init__(self):
+        self.calls = []
+
+    def users_info(self, user, token = None):
+        self.calls.append(('users.info', user, token))
+        return {'user': {'id': user, 'name': f'name-{user}'}}
+
+    def users_getPresence(self, user, token = None):
+        self.calls.append(('users.getPresence', user, token))
+        return {'presence': 'away'}
+
+
+def test_user_cache_calls_slack_on_miss(clock):
+    users, client = UserCache(ttl = 300, presence_ttl = 30), Users()
+    for _ in range(2):
+        assert users.info(client, 'U1', token = 'xoxp-1')['name'] == 'name-U1'
+        assert users.presence(client, 'U1') == 'away'
+    # Presence has the shorter TTL
+    clock[0] += 31
+    users.info(client, 'U1')
+    users.presence(client, 'U1')
+    assert client.calls == [('users.info', 'U1', 'xoxp-1'), ('users.getPresence', 'U1', None), ('users.getPresence', 'U1', None)]
+
+
+def test_user_event_replaces_profile(clock):
+    users, client = UserCache(), Users()
+    users.update({'id': 'U1', 'name': 'renamed'})
+    assert users.info(client, 'U1')['name'] == 'renamed'
+    users.invalidate('U1')
+    assert users.info(client, 'U1')['name'] == 'name-U1'
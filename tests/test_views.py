@@ -0,0 +1,120 @@
+'''
+Golden output of the help desk and admin modals. fixtures/views.json holds the views as the
+hand-built create_block() builders rendered them before block_templates.py; the templates must
+keep producing them byte for byte. To regenerate from a checkout of those builders:
+
+    python tests/test_views.py > tests/fixtures/views.json
+'''
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from catalog import Catalog, Department
+from helpdesk_views import admin_update, admin_view, help_desk_update, help_desk_view, message_view
+from modal_state import ADMIN, HELP_DESK, ModalSessions
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'views.json')
+
+
+def slack_echo(value):
+    # Slack returns plain_text objects with "emoji": true added
+    if isinstance(value, dict):
+        echoed = {key: slack_echo(item) for key, item in value.items()}
+        if echoed.get('type') == 'plain_text':
+            echoed.setdefault('emoji', True)
+        return echoed
+    if isinstance(value, (list, tuple)):
+        return [slack_echo(item) for item in value]
+    return value
+
+
+def action_body(view_id, view, values, action_id, option):
+    '''
+    `block_actions` payload as Slack sends it for `view` after choosing `option`
+    '''
+    view = dict(slack_echo(view), id = view_id, hash = '1700000000.abcdef', state = {'values': values})
+    return {
+        'type': 'block_actions', 'user': {'id': 'U0001'}, 'team': {'id': 'T0001', 'domain': 'example'},
+        'view': view, 'actions': [{'action_id': action_id, 'selected_option': slack_echo(option)}],
+    }
+
+
+def selection(block_id, action_id, option):
+    return {block_id: {action_id: {'type': 'static_select', 'selected_option': slack_echo(option)}}}
+
+
+def choice(value, text):
+    return {'text': {'type': 'plain_text', 'text': text}, 'value': value}
+
+
+def render_views():
+    '''
+    Every modal of both flows, step by step, as {name: view or views.update arguments}
+    '''
+    catalog = Catalog([
+        Department('I.T', ['Laptop', 'Printer', 'VPN']),
+        Department('H.R', ['Payroll', 'Leave']),
+        Department('Accounts', []),
+    ])
+    it, hr = catalog.department('I.T'), catalog.department('H.R')
+    sessions = ModalSessions()
+    views = {}
+
+    def step(name, update, view_id, action_id, option, **values):
+        body = action_body(view_id, views[name.rsplit('/', 1)[0]], values, action_id, option)
+        args = update(body, sessions, catalog)
+        views[name] = args['view']
+        views[name + ':args'] = {key: value for key, value in args.items() if key != 'view'}
+
+    dept = lambda option: selection('help_desk_dept_list_drop_down_block', 'help_desk_dept_drop_down_action', option)
+    category = lambda option: selection(
+        'help_desk_dept_category_list_drop_down_block', 'help_desk_dept_category_list_drop_down_action', option
+    )
+
+    sessions.start('VHELP', HELP_DESK)
+    views['help_desk'] = help_desk_view(catalog)
+    step('help_desk/dept', help_desk_update, 'VHELP', 'help_desk_dept_drop_down_action', it.option, **dept(it.option))
+    step('help_desk/dept/category', help_desk_update, 'VHELP', 'help_desk_dept_category_list_drop_down_action',
+         it.categories[1].option, **dept(it.option), **category(it.categories[1].option))
+    # Another department drops the category picked in the first one
+    step('help_desk/dept/category/dept', help_desk_update, 'VHELP', 'help_desk_dept_drop_down_action', hr.option,
+         **dept(hr.option), **category(it.categories[1].option))
+
+    radio = lambda option: selection('add_update_radio_block', 'add_update_radio_buttons_action', option)
+    admin_dept = lambda option: selection('dept_list_drop_down_block', 'admin_dept_drop_down_action', option)
+    add_delete = lambda option: selection('add_delete_category_block', 'add_delete_category_action', option)
+    update_existing, add_new = choice('value-0', 'Update Existing Department'), choice('value-1', 'Add New Department')
+    add_cat, del_cat = choice('add_cat', 'Add New Category'), choice('del_cat', 'Delete a Category')
+
+    sessions.start('VADMIN', ADMIN)
+    views['admin'] = admin_view(True)
+    views['admin_refused'] = admin_view(False)
+    step('admin/add', admin_update, 'VADMIN', 'add_update_radio_buttons_action', add_new, **radio(add_new))
+    step('admin/add/update', admin_update, 'VADMIN', 'add_update_radio_buttons_action', update_existing, **radio(update_existing))
+    step('admin/add/update/dept', admin_update, 'VADMIN', 'admin_dept_drop_down_action', hr.option,
+         **radio(update_existing), **admin_dept(hr.option))
+    step('admin/add/update/dept/delete', admin_update, 'VADMIN', 'add_delete_category_action', del_cat,
+         **radio(update_existing), **admin_dept(hr.option), **add_delete(del_cat))
+    step('admin/add/update/dept/delete/add', admin_update, 'VADMIN', 'add_delete_category_action', add_cat,
+         **radio(update_existing), **admin_dept(hr.option), **add_delete(add_cat))
+
+    views['message'] = message_view('Category added Successfully!!!')
+    return views
+
+
+def test_views_match_golden_output():
+    with open(FIXTURE) as fp:
+        golden = json.load(fp)
+    views = render_views()
+    assert list(views) == list(golden)
+    for name, view in views.items():
+        # Same keys in the same order, so the request bodies serialise identically
+        assert json.dumps(view) == json.dumps(golden[name]), name
+
+
+if __name__ == '__main__':
+    print(json.dumps(render_views(), indent = 1))
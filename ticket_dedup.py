@@ -0,0 +1,256 @@
+'''
+Near-duplicate detection of help desk tickets. When an outage hits, dozens of people report it
+under the same department and category: the first report becomes a Jira issue, the others are
+added to it as comments and their submitters get its key.
+
+Recent tickets are kept per topic (the issue summary: department and category) and drop out
+once no similar ticket came in for `WINDOW_MINUTES`. A ticket's text is reduced to a MinHash
+signature of its character shingles, one whose estimated Jaccard similarity with a recent ticket
+of the same topic reaches `THRESHOLD` is a duplicate of it. Duplicates worded differently enough
+are kept with the first report, so the way people describe an outage can drift from its first
+report. The signatures are split into bands (locality sensitive hashing), only the reports sharing
+a band with the ticket are compared, so a claim costs the same with 5 or 500 reports of a topic.
+The index is in memory, per process
+
+    # config.ini, optional
+    [dedup]
+    ENABLED = yes
+    WINDOW_MINUTES = 30
+    THRESHOLD = 0.6
+    # Seconds a duplicate waits for the issue of the first report while Jira creates it
+    MAX_WAIT = 30
+'''
+import collections
+import hashlib
+import random
+import re
+import threading
+import time
+import metrics
+
+deduplicated = metrics.counter('tickets_deduplicated_total', 'Tickets added to an existing issue as a comment')
+signature_time = metrics.histogram('ticket_signature_seconds', 'MinHash signature of a ticket', buckets = (.0005, .001, .0025, .005, .01, .025, .05))
+
+SHINGLE = 4
+PERMUTATIONS = 64
+# Wordings kept per report, a duplicate closer than SAME to one of them adds nothing
+WORDINGS = 16
+SAME = 0.9
+# Mersenne prime 2 ** 61 - 1, the hash permutations are (a * x + b) mod PRIME
+PRIME = (1 << 61) - 1
+
+
+def shingles(text, k = SHINGLE):
+    '''
+    Character k-grams of `text`, case, punctuation and spacing normalised
+    '''
+    text = ' '.join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+    if len(text) <= k:
+        return {text}
+    return {text[idx:idx + k] for idx in range(len(text) - k + 1)}
+
+
+class MinHasher:
+    '''
+    `permutations` salted hash functions, the same `seed` gives the same signatures in every process
+    '''
+    def __init__(self, permutations = PERMUTATIONS, seed = 1):
+        rng = random.Random(seed)
+        self.params = [(rng.randrange(1, PRIME), rng.randrange(PRIME)) for _ in range(permutations)]
+
+    def signature(self, text):
+        hashes = [int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size = 8).digest(), 'big') for shingle in shingles(text)]
+        return tuple(min((a * value + b) % PRIME for value in hashes) for a, b in self.params)
+
+
+def rows_per_band(threshold, permutations = PERMUTATIONS, recall = 0.99):
+    '''
+    Most signature rows per band that still make a ticket `threshold` similar to a report share
+    a band with it at least `recall` of the time. More rows per band, fewer reports compared
+    '''
+    rows = 1
+    while rows < permutations:
+        bands = permutations // (rows + 1)
+        if 1 - (1 - threshold ** (rows + 1)) ** bands < recall:
+            break
+        rows += 1
+    return rows
+
+
+def similarity(one, other):
+    '''
+    Estimated Jaccard similarity of the shingle sets behind two signatures
+    '''
+    return sum(x == y for x, y in zip(one, other)) / len(one)
+
+
+def summary_topic(ticket_data):
+    return ticket_data['fields'].get('summary', '')
+
+
+def description_text(ticket_data):
+    return ticket_data['fields'].get('description', '')
+
+
+def duplicate_comment(ticket_data):
+    return f"Reported again from Slack:\n{ticket_data['fields'].get('description', '')}"
+
+
+class Report:
+    '''
+    The first ticket of a group of similar ones. `issue` is set and `ready` once Jira created
+    it, `ready` alone when that failed. `signatures` -> the group's distinct wordings
+    '''
+    __slots__ = ('topic', 'signatures', 'seen', 'issue', 'ready')
+
+    def __init__(self, topic, signature, seen, issue = None):
+        self.topic = topic
+        self.signatures = [signature]
+        self.seen = seen
+        self.issue = issue
+        self.ready = threading.Event()
+        if issue is not None:
+            self.ready.set()
+
+
+class DuplicateIndex:
+    '''
+    Recent tickets per topic. A ticket pipeline claim()s every ticket before creating it:
+    a new one is created and resolve()d with its issue, a duplicate waits for its first report's issue.
+
+    `topic(ticket_data)`, `text(ticket_data)` -> what tickets are grouped by and compared on
+    `comment(ticket_data)` -> comment a duplicate adds to the existing issue
+    '''
+    def __init__(self, window = 1800, threshold = 0.6, max_wait = 30, max_per_topic = 500, wordings = WORDINGS,
+                 topic = summary_topic, text = description_text, comment = duplicate_comment, hasher = None):
+        self.window = window
+        self.wordings = wordings
+        self.threshold = threshold
+        self.max_wait = max_wait
+        self.max_per_topic = max_per_topic
+        self.topic = topic
+        self.text = text
+        self.comment = comment
+        self.hasher = hasher or MinHasher()
+        self.rows = rows_per_band(threshold, len(self.hasher.params))
+        # topic -> {Report: None}, least recently seen first
+        self.topics = {}
+        # (topic, band, rows of a signature) -> {Report: None} having a wording with those rows
+        self.buckets = {}
+        self._lock = threading.Lock()
+        metrics.gauge('ticket_dedup_reports', 'Recent tickets kept for duplicate detection', lambda: len(self))
+
+    @classmethod
+    def from_config(cls, configur, section = 'dedup', **kwargs):
+        return cls(
+            window = configur.getfloat(section, "WINDOW_MINUTES", fallback = 30) * 60,
+            threshold = configur.getfloat(section, "THRESHOLD", fallback = 0.6),
+            max_wait = configur.getfloat(section, "MAX_WAIT", fallback = 30),
+            **kwargs,
+        )
+
+    def __len__(self):
+        return sum(len(reports) for reports in list(self.topics.values()))
+
+    def _bands(self, topic, signature):
+        rows = self.rows
+        return [(topic, start, signature[start:start + rows]) for start in range(0, len(signature) - rows + 1, rows)]
+
+    def _index(self, report, signature):
+        for key in self._bands(report.topic, signature):
+            self.buckets.setdefault(key, {})[report] = None
+
+    def _drop(self, report):
+        reports = self.topics.get(report.topic)
+        if reports is None or report not in reports:
+            return
+        del reports[report]
+        if not reports:
+            del self.topics[report.topic]
+        for signature in report.signatures:
+            for key in self._bands(report.topic, signature):
+                bucket = self.buckets.get(key)
+                if bucket is not None:
+                    bucket.pop(report, None)
+                    if not bucket:
+                        del self.buckets[key]
+
+    def _expire(self, topic, now):
+        # Least recently seen first, the scan stops at the first report still in the window
+        reports = self.topics.get(topic)
+        while reports:
+            report = next(iter(reports))
+            if now - report.seen < self.window and len(reports) <= self.max_per_topic:
+                break
+            self._drop(report)
+            reports = self.topics.get(topic)
+
+    def _candidates(self, topic, signature):
+        candidates = {}
+        for key in self._bands(topic, signature):
+            candidates.update(self.buckets.get(key, ()))
+        return candidates
+
+    def claim(self, ticket_data):
+        '''
+        (report, None) for a new ticket, the caller creates its issue and resolve()s the report.
+        (None, report) for a duplicate of `report`
+        '''
+        topic = self.topic(ticket_data)
+        with signature_time.time():
+            signature = self.hasher.signature(self.text(ticket_data))
+        now = time.monotonic()
+        with self._lock:
+            self._expire(topic, now)
+            best, score = None, self.threshold
+            for report in self._candidates(topic, signature):
+                value = max(similarity(signature, known) for known in report.signatures)
+                if value >= score:
+                    best, score = report, value
+            if best is not None:
+                # An ongoing outage keeps its issue open to new reports
+                best.seen = now
+                self.topics[topic].move_to_end(best)
+                if score < SAME and len(best.signatures) < self.wordings:
+                    best.signatures.append(signature)
+                    self._index(best, signature)
+                return None, best
+            report = Report(topic, signature, now)
+            self.topics.setdefault(topic, collections.OrderedDict())[report] = None
+            self._index(report, signature)
+            self._expire(topic, now)
+            return report, None
+
+    def resolve(self, report, issue):
+        '''
+        Records the issue created for `report`, None when creating it failed and it should not be matched
+        '''
+        if issue is None:
+            with self._lock:
+                self._drop(report)
+        report.issue = issue
+        report.ready.set()
+
+    def add(self, ticket_data, issue):
+        '''
+        Indexes a ticket whose issue exists already
+        '''
+        report, _ = self.claim(ticket_data)
+        if report is not None:
+            self.resolve(report, issue)
+
+    def wait(self, report):
+        '''
+        Issue of `report`, None when it could not be created or is still not after `max_wait` seconds
+        '''
+        report.ready.wait(self.max_wait)
+        return report.issue
+
+
+def open_duplicates(configur, section = 'dedup', **kwargs):
+    '''
+    DuplicateIndex from the `[dedup]` section of config.ini, None when `ENABLED` is off
+    '''
+    if not configur.getboolean(section, "ENABLED", fallback = True):
+        return None
+    return DuplicateIndex.from_config(configur, section, **kwargs)
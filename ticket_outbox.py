@@ -0,0 +1,480 @@
+import asyncio
+import contextlib
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import metrics
+from jira_client import JiraRejected
+from ticket_pipeline import AsyncTicketPipeline, TicketJob, TicketPipeline, rejected, submitted
+
+retried = metrics.counter('tickets_retried_total', 'Ticket deliveries postponed after a Jira error')
+recovered = metrics.counter('tickets_recovered_total', 'Tickets a retry found already created in Jira')
+commit_sizes = metrics.histogram('outbox_commit_size', 'Submissions made durable per commit', buckets = (1, 2, 5, 10, 20, 50, 100))
+
+# Jira label carrying the idempotency key of a ticket
+LABEL_PREFIX = 'slackticket-'
+
+# Jira statuses meaning the payload itself is wrong. Auth errors and the rest are retried,
+# a fixed token or a Jira back from maintenance then delivers the backlog
+PERMANENT_STATUSES = (400, 413, 422)
+
+
+def label(key):
+    return LABEL_PREFIX + key
+
+
+def with_label(ticket_data, key):
+    '''
+    Copy of a Jira payload tagged with the label of `key`
+    '''
+    ticket_data = copy.deepcopy(ticket_data)
+    fields = ticket_data.setdefault('fields', {})
+    fields['labels'] = list(fields.get('labels', [])) + [label(key)]
+    return ticket_data
+
+
+def permanent(error):
+    if isinstance(error, JiraRejected):
+        return True
+    # requests.HTTPError carries the response, aiohttp.ClientResponseError the status
+    status = getattr(getattr(error, 'response', None), 'status_code', None) or getattr(error, 'status', None)
+    return status in PERMANENT_STATUSES
+
+
+class _Append:
+    __slots__ = ('key', 'user_id', 'ticket', 'id', 'new', 'error')
+
+    def __init__(self, key, user_id, ticket):
+        self.key = key
+        self.user_id = user_id
+        self.ticket = ticket
+        self.id = None
+        self.new = False
+        self.error = None
+
+
+class TicketOutbox:
+    '''
+    Append-only SQLite log of help desk submissions, written before the modal is acknowledged.
+
+    `append` returns once the submission is on disk. Concurrent appends share one commit, and
+    with it one fsync: whoever gets the commit lock writes every submission queued meanwhile.
+    Workers `claim` due rows with a lease, rows of a worker that died mid delivery become due
+    again after `lease` seconds. Delivered and abandoned rows are kept `keep` seconds
+    '''
+    def __init__(self, path = 'data/outbox.db', lease = 120, keep = 7 * 86400):
+        self.path = path
+        self.lease = lease
+        self.keep = keep
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        self._locks()
+        self._connect()
+
+    def _locks(self):
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._queued = []
+        self._queued_lock = threading.Lock()
+
+    def _connect(self):
+        self.conn = sqlite3.connect(self.path, check_same_thread = False, isolation_level = None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # Every commit is fsynced, appends are grouped so that stays cheap
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.execute('PRAGMA busy_timeout=5000')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE,
+                user_id TEXT NOT NULL,
+                ticket TEXT NOT NULL,
+                created REAL NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                issue TEXT,
+                error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, next_attempt);
+        ''')
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                yield cur
+                cur.execute('COMMIT')
+            except BaseException:
+                # A failed COMMIT (busy, disk full) leaves the transaction open on the shared connection
+                if self.conn.in_transaction:
+                    cur.execute('ROLLBACK')
+                raise
+
+    def append(self, key, user_id, ticket_data):
+        '''
+        Stores a submission, returns (row id, new). A `key` already in the outbox is not stored
+        again, `new` is then False. Raises when the submission could not be written
+        '''
+        entry = _Append(key, user_id, json.dumps(ticket_data))
+        with self._queued_lock:
+            self._queued.append(entry)
+        with self._commit_lock:
+            # An earlier leader may have committed this entry while we waited
+            if entry.id is None and entry.error is None:
+                with self._queued_lock:
+                    group, self._queued = self._queued, []
+                self._commit(group)
+        if entry.error is not None:
+            raise entry.error
+        return entry.id, entry.new
+
+    def _commit(self, group):
+        now = time.time()
+        try:
+            with self._transaction() as cur:
+                for entry in group:
+                    cur.execute(
+                        'INSERT OR IGNORE INTO outbox (key, user_id, ticket, created, next_attempt) VALUES (?, ?, ?, ?, ?)',
+                        (entry.key, entry.user_id, entry.ticket, now, now)
+                    )
+                    entry.new = cur.rowcount == 1
+                    entry.id = cur.lastrowid if entry.new else cur.execute(
+                        'SELECT id FROM outbox WHERE key = ?', (entry.key,)
+                    ).fetchone()[0]
+        except Exception as err:
+            for entry in group:
+                entry.id, entry.error = None, err
+            return
+        commit_sizes.observe(len(group))
+
+    def claim(self, limit):
+        '''
+        Up to `limit` due submissions as TicketJobs, leased to the caller for `lease` seconds.
+        `attempts` of a job counts the earlier deliveries, that may have reached Jira
+        '''
+        now = time.time()
+        with self._transaction() as cur:
+            rows = cur.execute(
+                "SELECT id, key, user_id, ticket, attempts, created FROM outbox WHERE state = 'pending' AND next_attempt <= ? ORDER BY next_attempt, id LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            cur.executemany(
+                'UPDATE outbox SET attempts = attempts + 1, next_attempt = ? WHERE id = ?',
+                [(now + self.lease, row[0]) for row in rows]
+            )
+        monotonic = time.monotonic()
+        return [
+            TicketJob(json.loads(ticket), user_id, id = row_id, key = key, attempts = attempts,
+                      enqueued_at = monotonic - (now - created))
+            for row_id, key, user_id, ticket, attempts, created in rows
+        ]
+
+    def settle(self, done = (), retry = (), abandoned = ()):
+        '''
+        Records one delivery round in a single commit.
+        `done` -> [(job, issue)], `retry` -> [(job, error, delay seconds)], `abandoned` -> [(job, error)]
+        '''
+        now = time.time()
+        with self._transaction() as cur:
+            cur.executemany(
+                "UPDATE outbox SET state = 'done', issue = ?, error = NULL WHERE id = ?",
+                [(json.dumps(issue), job.id) for job, issue in done]
+            )
+            cur.executemany(
+                'UPDATE outbox SET next_attempt = ?, error = ? WHERE id = ?',
+                [(now + delay, str(error), job.id) for job, error, delay in retry]
+            )
+            cur.executemany(
+                "UPDATE outbox SET state = 'failed', error = ? WHERE id = ?",
+                [(str(error), job.id) for job, error in abandoned]
+            )
+
+    def pending(self):
+        with self._lock:
+            return self.conn.execute("SELECT count(*) FROM outbox WHERE state = 'pending'").fetchone()[0]
+
+    def purge(self):
+        '''
+        Drops delivered and abandoned submissions older than `keep` seconds
+        '''
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM outbox WHERE state != 'pending' AND created < ?", (time.time() - self.keep,))
+
+    def after_fork(self):
+        '''
+        SQLite connections must not be used across fork, the child opens its own
+        '''
+        self._locks()
+        if self.path != ':memory:':
+            self._connect()
+
+    def close(self):
+        self.conn.close()
+
+
+class _Durable:
+    '''
+    Outbox handling shared by DurableTicketPipeline and AsyncDurableTicketPipeline
+    '''
+    # The idempotency label, Jira refuses every ticket when `labels` is not on the create screen
+    required_fields = ('labels',)
+
+    def payload(self, ticket_data, key = None):
+        return with_label(ticket_data, key) if key else ticket_data
+
+    def _setup(self, outbox, backoff, max_backoff, max_age, poll):
+        self.outbox = outbox
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_age = max_age
+        self.poll = poll
+        self._purged_at = time.monotonic()
+
+    @classmethod
+    def from_config(cls, configur, jira, on_done, section = 'pipeline', duplicates = None):
+        outbox = TicketOutbox(
+            configur.get(section, "OUTBOX_PATH", fallback = 'data/outbox.db'),
+            lease = configur.getfloat(section, "LEASE_SECONDS", fallback = 120),
+            keep = configur.getfloat(section, "KEEP_DAYS", fallback = 7) * 86400,
+        )
+        return cls(
+            jira,
+            on_done,
+            outbox,
+            workers = configur.getint(section, "WORKERS", fallback = 4),
+            max_batch = configur.getint(section, "MAX_BATCH", fallback = 10),
+            max_linger = configur.getfloat(section, "MAX_LINGER_MS", fallback = 50) / 1000,
+            backoff = configur.getfloat(section, "RETRY_BACKOFF", fallback = 1.0),
+            max_backoff = configur.getfloat(section, "MAX_BACKOFF", fallback = 300),
+            max_age = configur.getfloat(section, "MAX_AGE_HOURS", fallback = 24) * 3600,
+            duplicates = duplicates,
+        )
+
+    def depth(self):
+        return self.outbox.pending()
+
+    def _append(self, ticket_data, user_id, key):
+        key = key or uuid.uuid4().hex
+        try:
+            _, new = self.outbox.append(key, user_id, self.payload(ticket_data, key))
+        except sqlite3.Error as err:
+            print(err)
+            rejected.inc()
+            return False
+        if new:
+            submitted.inc()
+        return True
+
+    def _purge_due(self):
+        # Housekeeping from an idle worker, once an hour
+        if time.monotonic() - self._purged_at < 3600:
+            return False
+        self._purged_at = time.monotonic()
+        return True
+
+    def _sort(self, batch, results):
+        '''
+        Splits a delivery round into outbox updates, returns (done, retry, abandoned)
+        '''
+        now = time.monotonic()
+        done, retry, abandoned = [], [], []
+        for job, (issue, error) in zip(batch, results):
+            if error is None:
+                done.append((job, issue))
+            elif permanent(error) or now - job.enqueued_at >= self.max_age:
+                abandoned.append((job, error))
+            else:
+                retry.append((job, error, min(self.max_backoff, self.backoff * 2 ** job.attempts)))
+        retried.inc(len(retry))
+        return done, retry, abandoned
+
+    def _settle(self, done, retry, abandoned):
+        try:
+            self.outbox.settle(done, retry, abandoned)
+        except sqlite3.Error as err:
+            # The rows stay leased and are delivered again after the lease, the label check
+            # keeps that from creating duplicates
+            print(err)
+
+    @staticmethod
+    def _notify_args(done, abandoned):
+        # Submitters hear about delivered and abandoned tickets, retried ones stay quiet
+        return (
+            [job for job, _ in done + abandoned],
+            [(issue, None) for _, issue in done] + [(None, error) for _, error in abandoned],
+        )
+
+
+class DurableTicketPipeline(_Durable, TicketPipeline):
+    '''
+    TicketPipeline fed from a TicketOutbox instead of an in-memory queue, so a Jira outage or
+    a crash loses no submission: the workers deliver what the outbox holds, oldest first.
+
+    Every ticket carries the Jira label of its key. A job with earlier attempts is first looked
+    up by that label, an attempt that reached Jira before failing is not created twice. Within an
+    attempt the Jira client never resends a POST Jira may have processed (jira_client.PostSafeRetry).
+    Transient errors are retried after `backoff` * 2 ** attempts seconds (at most `max_backoff`),
+    the submitter hears about a failure only once Jira rejects the ticket or it is `max_age` seconds old.
+    Several processes (service.py workers) can drain the same outbox file
+    '''
+    def __init__(self, jira, on_done, outbox, workers = 4, max_batch = 10, max_linger = 0.05,
+                 backoff = 1.0, max_backoff = 300, max_age = 86400, poll = 1.0, duplicates = None):
+        super().__init__(jira, on_done, workers = workers, max_batch = max_batch, max_linger = max_linger, duplicates = duplicates)
+        self._setup(outbox, backoff, max_backoff, max_age, poll)
+        self.ready = threading.Event()
+        self._stopping = threading.Event()
+
+    def after_fork(self):
+        super().after_fork()
+        self.outbox.after_fork()
+        self.ready = threading.Event()
+        self._stopping = threading.Event()
+
+    def submit(self, ticket_data, user_id, key = None):
+        '''
+        Writes the ticket to the outbox, returns False when it could not be stored.
+        A `key` submitted before is accepted again but not stored twice
+        '''
+        if not self.workers:
+            self.start()
+        stored = self._append(ticket_data, user_id, key)
+        self.ready.set()
+        return stored
+
+    def stop(self):
+        '''
+        Stops the workers after their current delivery, undelivered tickets stay in the outbox
+        '''
+        self._stopping.set()
+        self.ready.set()
+        for worker in self.workers:
+            worker.join()
+
+    def _next_batch(self):
+        while not self._stopping.is_set():
+            batch = self.outbox.claim(self.max_batch)
+            if batch:
+                if len(batch) < self.max_batch and self.max_linger:
+                    time.sleep(self.max_linger)
+                    batch += self.outbox.claim(self.max_batch - len(batch))
+                return batch, False
+            self.ready.wait(self.poll)
+            self.ready.clear()
+            if self._purge_due():
+                self.outbox.purge()
+        return [], True
+
+    def _create(self, batch):
+        results = [None] * len(batch)
+        fresh = []
+        for idx, job in enumerate(batch):
+            if job.attempts:
+                try:
+                    issue = self.jira.find_issue_by_label(label(job.key))
+                except Exception as err:
+                    results[idx] = (None, err)
+                    continue
+                if issue is not None:
+                    recovered.inc()
+                    results[idx] = (issue, None)
+                    continue
+            fresh.append(idx)
+        if fresh:
+            for idx, result in zip(fresh, super()._create([batch[idx] for idx in fresh])):
+                results[idx] = result
+        return results
+
+    def _finish(self, batch, results):
+        done, retry, abandoned = self._sort(batch, results)
+        self._settle(done, retry, abandoned)
+        super()._finish(*self._notify_args(done, abandoned))
+
+
+class AsyncDurableTicketPipeline(_Durable, AsyncTicketPipeline):
+    '''
+    DurableTicketPipeline for async_app.py, the outbox is read and written from worker threads
+    so its commits never block the event loop
+    '''
+    def __init__(self, jira, on_done, outbox, workers = 4, max_batch = 10, max_linger = 0.05,
+                 backoff = 1.0, max_backoff = 300, max_age = 86400, poll = 1.0, duplicates = None):
+        super().__init__(jira, on_done, workers = workers, max_batch = max_batch, max_linger = max_linger, duplicates = duplicates)
+        self._setup(outbox, backoff, max_backoff, max_age, poll)
+        self.ready = asyncio.Event()
+        self._stopping = False
+
+    async def submit(self, ticket_data, user_id, key = None):
+        await self.start()
+        stored = await asyncio.to_thread(self._append, ticket_data, user_id, key)
+        self.ready.set()
+        return stored
+
+    async def stop(self):
+        self._stopping = True
+        self.ready.set()
+        await asyncio.gather(*self.workers)
+        self.workers = []
+
+    async def _next_batch(self):
+        while not self._stopping:
+            batch = await asyncio.to_thread(self.outbox.claim, self.max_batch)
+            if batch:
+                if len(batch) < self.max_batch and self.max_linger:
+                    await asyncio.sleep(self.max_linger)
+                    batch += await asyncio.to_thread(self.outbox.claim, self.max_batch - len(batch))
+                return batch, False
+            try:
+                await asyncio.wait_for(self.ready.wait(), self.poll)
+            except asyncio.TimeoutError:
+                pass
+            self.ready.clear()
+            if self._purge_due():
+                await asyncio.to_thread(self.outbox.purge)
+        return [], True
+
+    async def _create(self, batch):
+        results = [None] * len(batch)
+        fresh = []
+        for idx, job in enumerate(batch):
+            if job.attempts:
+                try:
+                    issue = await self.jira.find_issue_by_label(label(job.key))
+                except Exception as err:
+                    results[idx] = (None, err)
+                    continue
+                if issue is not None:
+                    recovered.inc()
+                    results[idx] = (issue, None)
+                    continue
+            fresh.append(idx)
+        if fresh:
+            for idx, result in zip(fresh, await super()._create([batch[idx] for idx in fresh])):
+                results[idx] = result
+        return results
+
+    async def _finish(self, batch, results):
+        done, retry, abandoned = self._sort(batch, results)
+        await asyncio.to_thread(self._settle, done, retry, abandoned)
+        await super()._finish(*self._notify_args(done, abandoned))
+
+
+def open_pipeline(configur, jira, on_done, section = 'pipeline', duplicates = None):
+    '''
+    DurableTicketPipeline, or the in-memory TicketPipeline when `[pipeline] OUTBOX_PATH` is empty.
+    `duplicates` -> DuplicateIndex (ticket_dedup.py) or None
+    '''
+    if configur.get(section, "OUTBOX_PATH", fallback = 'data/outbox.db'):
+        return DurableTicketPipeline.from_config(configur, jira, on_done, section, duplicates)
+    return TicketPipeline.from_config(configur, jira, on_done, section, duplicates)
+
+
+def open_async_pipeline(configur, jira, on_done, section = 'pipeline', duplicates = None):
+    if configur.get(section, "OUTBOX_PATH", fallback = 'data/outbox.db'):
+        return AsyncDurableTicketPipeline.from_config(configur, jira, on_done, section, duplicates)
+    return AsyncTicketPipeline.from_config(configur, jira, on_done, section, duplicates)
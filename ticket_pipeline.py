@@ -0,0 +1,376 @@
+import asyncio
+import queue
+import threading
+import time
+import metrics
+from jira_client import BULK_LIMIT
+from ticket_dedup import deduplicated
+
+queue_wait = metrics.histogram('ticket_queue_wait_seconds', 'Time a ticket waited in the queue before a worker picked it up')
+jira_latency = metrics.histogram('jira_create_seconds', 'Time spent in the Jira create call')
+batch_sizes = metrics.histogram('ticket_batch_size', 'Tickets sent per Jira call', buckets = (1, 2, 5, 10, 20, 50))
+submitted = metrics.counter('tickets_submitted_total', 'Tickets accepted into the queue')
+rejected = metrics.counter('tickets_rejected_total', 'Tickets rejected because the queue was full')
+completed = metrics.counter('tickets_created_total', 'Tickets created in Jira')
+failed = metrics.counter('tickets_failed_total', 'Tickets that could not be created in Jira')
+
+
+class TicketJob:
+    '''
+    A help desk submission waiting to be sent to Jira
+    `ticket_data` -> {"fields": {...}} payload for Jira
+    `user_id` -> Slack user who submitted it, gets the DM with the ticket key
+    `id`, `key`, `attempts` -> outbox row, idempotency key and delivery attempts so far (ticket_outbox.py)
+    '''
+    __slots__ = ('ticket_data', 'user_id', 'enqueued_at', 'id', 'key', 'attempts')
+
+    def __init__(self, ticket_data, user_id, id = None, key = None, attempts = 0, enqueued_at = None):
+        self.ticket_data = ticket_data
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic() if enqueued_at is None else enqueued_at
+        self.id = id
+        self.key = key
+        self.attempts = attempts
+
+
+class TicketPipeline:
+    '''
+    Bounded in-process work queue with a pool of worker threads creating Jira tickets
+    in the background, so Bolt listener threads never wait on Jira.
+
+    `jira` -> JiraClient
+    `on_done(job, issue, error)` -> called from the worker once a job finishes,
+        `issue` is Jira's answer or None when `error` is set
+    `max_batch` -> tickets coalesced into one `/issue/bulk` call (capped at Jira's limit of 50)
+    `max_linger` -> seconds a worker waits for more tickets before sending a partial batch
+    `duplicates` -> DuplicateIndex (ticket_dedup.py), near duplicates of recent tickets are
+        commented on their issue instead of creating another one
+
+    The worker threads start with the first submission or start(), so a pipeline built before
+    a pre-fork server forks (see service.py) only runs threads in the worker processes
+    '''
+    # Jira fields every issue of the pipeline carries besides the ticket's own
+    required_fields = ()
+
+    def payload(self, ticket_data, key = None):
+        '''
+        The Jira payload the workers send for `ticket_data` submitted with `key`
+        '''
+        return ticket_data
+
+    def __init__(self, jira, on_done, workers = 4, max_queue = 1000, max_batch = 10, max_linger = 0.05, duplicates = None):
+        self.jira = jira
+        self.on_done = on_done
+        self.concurrency = workers
+        self.max_batch = max(1, min(max_batch, BULK_LIMIT))
+        self.max_linger = max_linger
+        self.max_queue = max_queue
+        self.duplicates = duplicates
+        self.queue = queue.Queue(maxsize = max_queue)
+        self.workers = []
+        self._start_lock = threading.Lock()
+        metrics.gauge('ticket_queue_depth', 'Tickets waiting for a worker', lambda: self.depth())
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def start(self):
+        with self._start_lock:
+            if self.workers:
+                return
+            for idx in range(self.concurrency):
+                worker = threading.Thread(target = self._run, name = f'ticket-worker-{idx}', daemon = True)
+                worker.start()
+                self.workers.append(worker)
+
+    def after_fork(self):
+        '''
+        Drops state inherited from the parent process, threads do not survive a fork
+        '''
+        self.queue = queue.Queue(maxsize = self.max_queue)
+        self.workers = []
+        self._start_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, configur, jira, on_done, section = 'pipeline', duplicates = None):
+        return cls(
+            jira,
+            on_done,
+            workers = configur.getint(section, "WORKERS", fallback = 4),
+            max_queue = configur.getint(section, "MAX_QUEUE", fallback = 1000),
+            max_batch = configur.getint(section, "MAX_BATCH", fallback = 10),
+            max_linger = configur.getfloat(section, "MAX_LINGER_MS", fallback = 50) / 1000,
+            duplicates = duplicates,
+        )
+
+    def submit(self, ticket_data, user_id, key = None):
+        '''
+        Queues a ticket, returns False without blocking when the queue is full.
+        `key` identifies the submission for the durable pipeline, the queue ignores it
+        '''
+        if not self.workers:
+            self.start()
+        try:
+            self.queue.put_nowait(TicketJob(ticket_data, user_id))
+        except queue.Full:
+            rejected.inc()
+            return False
+        submitted.inc()
+        return True
+
+    def stop(self):
+        '''
+        Lets the workers finish the queued jobs and exit
+        '''
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def _next_batch(self):
+        '''
+        Blocks for the first job then keeps collecting until the batch is full or
+        `max_linger` has passed. Returns (jobs, stop)
+        '''
+        job = self.queue.get()
+        if job is None:
+            return [], True
+        batch = [job]
+        deadline = time.monotonic() + self.max_linger
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self.queue.get(timeout = remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    def _create(self, batch):
+        '''
+        Creates the batch's issues, or adds duplicates to the issue of their first report.
+        Returns a list of (issue, error) aligned with `batch`
+        '''
+        if self.duplicates is None:
+            return self._post(batch)
+        claims = [self.duplicates.claim(job.ticket_data) for job in batch]
+        results = [None] * len(batch)
+        # New tickets first, a duplicate of one in the same batch then finds its issue
+        fresh = [idx for idx, (report, _) in enumerate(claims) if report is not None]
+        for idx, result in zip(fresh, self._post([batch[idx] for idx in fresh])):
+            self.duplicates.resolve(claims[idx][0], result[0])
+            results[idx] = result
+        for idx, (_, first) in enumerate(claims):
+            if first is not None:
+                results[idx] = self._add_duplicate(batch[idx], self.duplicates.wait(first))
+        return results
+
+    def _add_duplicate(self, job, issue):
+        if issue is None:
+            # The first report failed or is still being created, this one gets its own issue
+            result = self._post([job])[0]
+            if result[0] is not None:
+                self.duplicates.add(job.ticket_data, result[0])
+            return result
+        try:
+            # The job's labels go along, a retry of the durable pipeline finds the issue by them
+            self.jira.comment_issue(issue['key'], self.duplicates.comment(job.ticket_data), job.ticket_data['fields'].get('labels', ()))
+        except Exception as err:
+            return (None, err)
+        deduplicated.inc()
+        return (dict(issue, duplicate = True), None)
+
+    def _post(self, batch):
+        '''
+        Sends the batch to Jira, single tickets skip the bulk endpoint
+        '''
+        if len(batch) == 1:
+            try:
+                return [(self.jira.create_issue(batch[0].ticket_data), None)]
+            except Exception as err:
+                return [(None, err)]
+        try:
+            return self.jira.create_issues_bulk([job.ticket_data for job in batch])
+        except Exception as err:
+            return [(None, err)] * len(batch)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if not batch:
+                continue
+            now = time.monotonic()
+            for job in batch:
+                queue_wait.observe(now - job.enqueued_at)
+            batch_sizes.observe(len(batch))
+            start = time.monotonic()
+            results = self._create(batch)
+            jira_latency.observe(time.monotonic() - start)
+            self._finish(batch, results)
+
+    def _finish(self, batch, results):
+        for job, (issue, error) in zip(batch, results):
+            if error:
+                failed.inc()
+            else:
+                completed.inc()
+            try:
+                self.on_done(job, issue, error)
+            except Exception as err:
+                print(err)
+
+
+class AsyncTicketPipeline:
+    '''
+    asyncio counterpart of TicketPipeline for async_app.py, worker tasks instead of threads.
+    `jira` -> AsyncJiraClient, `on_done(job, issue, error)` -> coroutine function.
+    Workers start with start() or the first submission, inside the running event loop
+    '''
+    # Jira fields every issue of the pipeline carries besides the ticket's own
+    required_fields = ()
+
+    def payload(self, ticket_data, key = None):
+        '''
+        The Jira payload the workers send for `ticket_data` submitted with `key`
+        '''
+        return ticket_data
+
+    def __init__(self, jira, on_done, workers = 4, max_queue = 1000, max_batch = 10, max_linger = 0.05, duplicates = None):
+        self.jira = jira
+        self.on_done = on_done
+        self.concurrency = workers
+        self.max_batch = max(1, min(max_batch, BULK_LIMIT))
+        self.max_linger = max_linger
+        self.duplicates = duplicates
+        self.queue = asyncio.Queue(maxsize = max_queue)
+        self.workers = []
+        metrics.gauge('ticket_queue_depth', 'Tickets waiting for a worker', lambda: self.depth())
+
+    def depth(self):
+        return self.queue.qsize()
+
+    @classmethod
+    def from_config(cls, configur, jira, on_done, section = 'pipeline', duplicates = None):
+        return cls(
+            jira,
+            on_done,
+            workers = configur.getint(section, "WORKERS", fallback = 4),
+            max_queue = configur.getint(section, "MAX_QUEUE", fallback = 1000),
+            max_batch = configur.getint(section, "MAX_BATCH", fallback = 10),
+            max_linger = configur.getfloat(section, "MAX_LINGER_MS", fallback = 50) / 1000,
+            duplicates = duplicates,
+        )
+
+    async def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def submit(self, ticket_data, user_id, key = None):
+        '''
+        Queues a ticket, returns False when the queue is full. A coroutine like the durable
+        pipeline's submit (ticket_outbox.py), it never waits
+        '''
+        await self.start()
+        try:
+            self.queue.put_nowait(TicketJob(ticket_data, user_id))
+        except asyncio.QueueFull:
+            rejected.inc()
+            return False
+        submitted.inc()
+        return True
+
+    async def stop(self):
+        for _ in self.workers:
+            await self.queue.put(None)
+        await asyncio.gather(*self.workers)
+        self.workers = []
+
+    async def _next_batch(self):
+        job = await self.queue.get()
+        if job is None:
+            return [], True
+        batch = [job]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_linger
+        while len(batch) < self.max_batch:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                job = await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if job is None:
+                return batch, True
+            batch.append(job)
+        return batch, False
+
+    async def _create(self, batch):
+        if self.duplicates is None:
+            return await self._post(batch)
+        # Signatures and waits for another worker's issue run off the event loop
+        claims = await asyncio.to_thread(lambda: [self.duplicates.claim(job.ticket_data) for job in batch])
+        results = [None] * len(batch)
+        fresh = [idx for idx, (report, _) in enumerate(claims) if report is not None]
+        for idx, result in zip(fresh, await self._post([batch[idx] for idx in fresh])):
+            self.duplicates.resolve(claims[idx][0], result[0])
+            results[idx] = result
+        for idx, (_, first) in enumerate(claims):
+            if first is not None:
+                results[idx] = await self._add_duplicate(batch[idx], await asyncio.to_thread(self.duplicates.wait, first))
+        return results
+
+    async def _add_duplicate(self, job, issue):
+        if issue is None:
+            result = (await self._post([job]))[0]
+            if result[0] is not None:
+                await asyncio.to_thread(self.duplicates.add, job.ticket_data, result[0])
+            return result
+        try:
+            await self.jira.comment_issue(issue['key'], self.duplicates.comment(job.ticket_data), job.ticket_data['fields'].get('labels', ()))
+        except Exception as err:
+            return (None, err)
+        deduplicated.inc()
+        return (dict(issue, duplicate = True), None)
+
+    async def _post(self, batch):
+        if len(batch) == 1:
+            try:
+                return [(await self.jira.create_issue(batch[0].ticket_data), None)]
+            except Exception as err:
+                return [(None, err)]
+        try:
+            return await self.jira.create_issues_bulk([job.ticket_data for job in batch])
+        except Exception as err:
+            return [(None, err)] * len(batch)
+
+    async def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = await self._next_batch()
+            if not batch:
+                continue
+            now = time.monotonic()
+            for job in batch:
+                queue_wait.observe(now - job.enqueued_at)
+            batch_sizes.observe(len(batch))
+            start = time.monotonic()
+            results = await self._create(batch)
+            jira_latency.observe(time.monotonic() - start)
+            await self._finish(batch, results)
+
+    async def _finish(self, batch, results):
+        for job, (issue, error) in zip(batch, results):
+            if error:
+                failed.inc()
+            else:
+                completed.inc()
+            try:
+                await self.on_done(job, issue, error)
+            except Exception as err:
+                print(err)
@@ -0,0 +1,96 @@
+'''
+Jira project, issue type and priority of a help desk ticket, by department and category.
+
+    # config.ini, optional, every ticket goes to TEST as a Task without it
+    [routing]
+    DEFAULT = TEST, Task
+    # <department> = <project>, <issue type>[, <priority>]
+    I.T = IT, Task
+    HR = PEOPLE, Request
+    # <department> / <category>, over the department's own route
+    I.T / VPN = IT, Incident, High
+
+Department and category names match case insensitively. Routes are resolved once into a dict,
+a ticket's route is at most two lookups
+'''
+from collections import namedtuple
+
+# Separates the category from the department in a key, ConfigParser takes ':' as a delimiter
+SEPARATOR = '/'
+
+
+class Route(namedtuple('Route', ('project', 'issuetype', 'priority'))):
+    '''
+    Where a ticket is created, `priority` None leaves Jira's default
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, text):
+        parts = [part.strip() for part in text.split(',')]
+        if len(parts) not in (2, 3) or not all(parts):
+            raise ValueError(f'route {text!r} is not "<project>, <issue type>[, <priority>]"')
+        return cls(parts[0], parts[1], parts[2] if len(parts) == 3 else None)
+
+    def fields(self):
+        '''
+        The Jira fields this route sets
+        '''
+        fields = {
+            "project": {"key": self.project},
+            "issuetype": {"name": self.issuetype},
+        }
+        if self.priority:
+            fields["priority"] = {"name": self.priority}
+        return fields
+
+
+# Same as the existing JIRA Project, when no routes are configured
+DEFAULT_ROUTE = Route('TEST', 'Task', None)
+
+
+def route_key(dept, category = None):
+    return (dept.strip().lower(), category.strip().lower() if category else None)
+
+
+class Routes:
+    '''
+    (department, category) -> Route, falling back to the department's route, then `default`
+    '''
+    def __init__(self, routes = None, default = DEFAULT_ROUTE):
+        self.default = default
+        self._routes = {route_key(*key): route for key, route in (routes or {}).items()}
+
+    @classmethod
+    def from_config(cls, configur, section = 'routing'):
+        if not configur.has_section(section):
+            return cls()
+        routes = {}
+        default = DEFAULT_ROUTE
+        for key, value in configur.items(section):
+            if key == 'default':
+                default = Route.parse(value)
+                continue
+            dept, _, category = key.partition(SEPARATOR)
+            routes[(dept, category or None)] = Route.parse(value)
+        return cls(routes, default)
+
+    def route(self, dept, category = None):
+        if category:
+            found = self._routes.get(route_key(dept, category))
+            if found is not None:
+                return found
+        return self._routes.get(route_key(dept), self.default)
+
+    def targets(self):
+        '''
+        Every (project, issue type) a ticket can be created as
+        '''
+        return sorted({(route.project, route.issuetype) for route in self._routes.values()}
+                      | {(self.default.project, self.default.issuetype)})
+
+    def projects(self):
+        '''
+        Every project a ticket can be routed to, the ones whose createmeta is worth fetching up front
+        '''
+        return sorted({route.project for route in self._routes.values()} | {self.default.project})
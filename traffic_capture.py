@@ -0,0 +1,146 @@
+'''
+Capture of inbound Bolt requests for replaying production traffic offline (benchmarks/replay.py).
+
+Every request the app dispatches (shortcuts, actions, options, view submissions, events)
+is appended as one JSON line {"t": unix time received, "app": name, "body": payload} to a log
+rotated at `MAX_MB`. Tokens and response URLs are replaced before anything is written.
+
+    # config.ini, optional
+    [capture]
+    PATH = data/capture/requests.jsonl
+    MAX_MB = 100
+    BACKUPS = 5
+
+The writing happens on a background thread, the handlers only queue a scrubbed copy of the body.
+When the queue is full, requests are dropped from the capture rather than delaying the ack
+'''
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+import metrics
+
+# Keys whose values can authenticate as the app or post into a conversation
+SECRET_KEYS = frozenset((
+    'token', 'response_url', 'access_token', 'bot_access_token', 'refresh_token',
+    'client_secret', 'app_token', 'bot_token', 'user_token',
+))
+REDACTED = '[redacted]'
+
+captured = metrics.counter('capture_requests_total', 'Requests written to the traffic capture')
+dropped = metrics.counter('capture_dropped_total', 'Requests left out of the traffic capture, writer behind')
+
+
+def scrub(value):
+    '''
+    Copy of a request body with the values of SECRET_KEYS replaced, at any depth
+    '''
+    if isinstance(value, dict):
+        return {key: REDACTED if key in SECRET_KEYS and item else scrub(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    return value
+
+
+class TrafficRecorder:
+    '''
+    Appends captured requests to `path`, rotating to path.1 .. path.`backups` past `max_bytes`.
+    The writer thread starts on the first record, so a recorder made before a fork writes from the worker
+    '''
+    def __init__(self, path, max_bytes = 100 * 2 ** 20, backups = 5, max_queue = 10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.Queue(max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def record(self, name, body):
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait((time.time(), name, scrub(body)))
+        except queue.Full:
+            dropped.inc()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target = self._write, name = 'traffic-capture', daemon = True)
+                self._thread.start()
+
+    def _write(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        handler = RotatingFileHandler(self.path, maxBytes = self.max_bytes, backupCount = self.backups, encoding = 'utf-8')
+        while True:
+            received, name, body = self.queue.get()
+            line = json.dumps({'t': received, 'app': name, 'body': body}, separators = (',', ':'))
+            handler.emit(logging.makeLogRecord({'msg': line}))
+            captured.inc()
+
+    def after_fork(self):
+        '''
+        Gunicorn workers each write their own file, `requests.jsonl` -> `requests.<pid>.jsonl`
+        '''
+        root, ext = os.path.splitext(self.path)
+        self.path = f'{root}.{os.getpid()}{ext}'
+        self.queue = queue.Queue(self.queue.maxsize)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+
+# One recorder per file, app.py and app_autoresp.py share it when both run in service.py
+_recorders = {}
+
+
+def open_recorder(configur, section = 'capture'):
+    '''
+    Recorder from the `[capture]` section of config.ini, None when `PATH` is not set
+    '''
+    path = configur.get(section, "PATH", fallback = None)
+    if not path:
+        return None
+    if path not in _recorders:
+        _recorders[path] = TrafficRecorder(
+            path,
+            max_bytes = int(configur.getfloat(section, "MAX_MB", fallback = 100) * 2 ** 20),
+            backups = configur.getint(section, "BACKUPS", fallback = 5),
+        )
+    return _recorders[path]
+
+
+def after_fork():
+    for recorder in _recorders.values():
+        recorder.after_fork()
+
+
+def capture(app, name, configur):
+    '''
+    Records every request `app` dispatches when `[capture] PATH` is set, `name` tells the apps apart on replay
+    '''
+    recorder = open_recorder(configur)
+    if recorder is None:
+        return None
+
+    @app.middleware
+    def capture_request(body, next):
+        recorder.record(name, body)
+        next()
+
+    return recorder
+
+
+def async_capture(app, name, configur):
+    recorder = open_recorder(configur)
+    if recorder is None:
+        return None
+
+    @app.middleware
+    async def capture_request(body, next):
+        recorder.record(name, body)
+        await next()
+
+    return recorder
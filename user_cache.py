@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+
+def _token(token):
+    # Only override the client's own token when one is given
+    return {'token': token} if token else {}
+
+
+class TTLCache:
+    '''
+    Thread safe LRU cache whose entries also expire `ttl` seconds after being stored.
+    Hits and misses are counted in `metrics` as `{name}_cache_hits_total` / `{name}_cache_misses_total`
+    '''
+    def __init__(self, name, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = metrics.counter(f'{name}_cache_hits_total', f'{name} lookups answered from the cache')
+        self.misses = metrics.counter(f'{name}_cache_misses_total', f'{name} lookups that went to Slack')
+        metrics.gauge(f'{name}_cache_size', f'{name} entries cached', self.__len__)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits.inc()
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+        self.misses.inc()
+        return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class UserCache:
+    '''
+    Caches `users.info` and `users.getPresence` answers per user id.
+    Presence changes more often than profiles so it gets its own, shorter TTL
+    '''
+    def __init__(self, ttl = 300, presence_ttl = 30, maxsize = 10000):
+        self.profiles = TTLCache('users_info', ttl, maxsize)
+        self.presences = TTLCache('users_presence', presence_ttl, maxsize)
+
+    @classmethod
+    def from_config(cls, configur, section = 'cache'):
+        return cls(
+            ttl = configur.getfloat(section, "USER_TTL", fallback = 300),
+            presence_ttl = configur.getfloat(section, "PRESENCE_TTL", fallback = 30),
+            maxsize = configur.getint(section, "USER_MAX_ENTRIES", fallback = 10000),
+        )
+
+    def info(self, client, user_id, token = None):
+        '''
+        `users.info` for `user_id`, returns the `user` object
+        '''
+        user = self.profiles.get(user_id)
+        if user is None:
+            user = client.users_info(user = user_id, **_token(token))["user"]
+            self.profiles.set(user_id, user)
+        return user
+
+    def presence(self, client, user_id, token = None):
+        '''
+        `users.getPresence` for `user_id`, returns "active" or "away"
+        '''
+        presence = self.presences.get(user_id)
+        if presence is None:
+            presence = client.users_getPresence(user = user_id, **_token(token))["presence"]
+            self.presences.set(user_id, presence)
+        return presence
+
+    async def async_info(self, client, user_id, token = None):
+        '''
+        `info` for an AsyncWebClient
+        '''
+        user = self.profiles.get(user_id)
+        if user is None:
+            user = (await client.users_info(user = user_id, **_token(token)))["user"]
+            self.profiles.set(user_id, user)
+        return user
+
+    async def async_presence(self, client, user_id, token = None):
+        '''
+        `presence` for an AsyncWebClient
+        '''
+        presence = self.presences.get(user_id)
+        if presence is None:
+            presence = (await client.users_getPresence(user = user_id, **_token(token)))["presence"]
+            self.presences.set(user_id, presence)
+        return presence
+
+    def update(self, user):
+        '''
+        Stores the full user object carried by `user_change` / `user_status_changed` events
+        '''
+        self.profiles.set(user["id"], user)
+
+    def invalidate(self, user_id):
+        self.profiles.invalidate(user_id)
+        self.presences.invalidate(user_id)